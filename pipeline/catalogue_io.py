@@ -0,0 +1,611 @@
+###############################################################################
+#                                                                             #
+#   Chunked catalogue input/output. Readers iterate over row chunks of FITS   #
+#   and HDF5 tables and column stores without loading the full table, writers #
+#   append chunks to an output table, such that the memory usage of a stage   #
+#   is governed by the chunk size and not by the catalogue size. load_table   #
+#   memory-maps only the requested columns of a table. Realisation recipes   #
+#   (.json) are read like tables, their columns are computed when read.       #
+#                                                                             #
+###############################################################################
+
+import io
+import os
+import queue
+import threading
+
+import numpy as np
+from astropy import units
+from astropy.io import fits
+from astropy.table import Column, Table
+
+from column_store import ColumnStore, is_column_store
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+def table_format(path, format=None):
+    """
+    Determine the format of a catalogue file.
+    Parameters
+    ----------
+    path : str
+        File path of the catalogue.
+    format : str
+        astropy.table format specifier, guessed from the file extension if
+        None.
+    Returns
+    -------
+    format : str
+        One of "columns" (column store), "fits", "hdf5", "recipe"
+        (realisation recipe, see realisation_view.py) or the input format.
+    """
+    if is_column_store(path):
+        return "columns"
+    if format is not None:
+        return format
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".hdf5", ".hdf", ".h5"):
+        return "hdf5"
+    if ext == ".json":
+        return "recipe"
+    return "fits"
+
+
+def _open_recipe(path):
+    """
+    Open the realisation view of a recipe file, whose columns are computed
+    from the input catalogue of the recipe.
+    """
+    # realisation_view maps the input columns with this module
+    from realisation_view import RealisationView
+    return RealisationView.open(path)
+
+
+def _recipe_columns(view, columns, rows=None):
+    if columns is None:
+        columns = view.colnames
+    missing = [col for col in columns if col not in view]
+    if len(missing) > 0:
+        raise KeyError(
+            "table does not contain columns: %s" % ", ".join(missing))
+    return [view.column(col, rows) for col in columns]
+
+
+def _require_h5py():
+    if h5py is None:
+        raise ImportError("reading and writing HDF5 tables requires h5py")
+
+
+def _hdf5_columns(h5file):
+    """
+    Find the table data in an HDF5 file. Returns either a compound dataset
+    (as written by astropy) or a dictionary of one-dimensional datasets of
+    equal length (one per column, as in the cosmoDC2 extracts).
+    """
+    # column order of files written by HDF5Writer
+    group = h5file.get("data")
+    if isinstance(group, h5py.Group) and "columns" in group.attrs:
+        return {
+            name: group[name] for name in
+            np.char.decode(group.attrs["columns"], "utf-8")}
+    datasets = {}
+
+    def visit(name, obj):
+        if isinstance(obj, h5py.Dataset):
+            datasets[name] = obj
+
+    h5file.visititems(visit)
+    for name, dset in datasets.items():
+        if dset.dtype.names is not None and not name.endswith(
+                ".__table_column_meta__"):
+            return dset
+    columns = {
+        name.split("/")[-1]: dset for name, dset in datasets.items()
+        if dset.ndim >= 1}
+    if len(columns) == 0:
+        raise ValueError("no table data found in HDF5 file")
+    return columns
+
+
+def read_colnames(path, format=None):
+    """
+    Read the column names of a catalogue from the file header without loading
+    any data.
+    Parameters
+    ----------
+    path : str
+        File path of the catalogue.
+    format : str
+        Catalogue format (see table_format).
+    Returns
+    -------
+    colnames : list of str
+        Names of the table columns.
+    """
+    format = table_format(path, format)
+    if format == "columns":
+        return ColumnStore(path).colnames
+    if format == "recipe":
+        return _open_recipe(path).colnames
+    if format == "hdf5":
+        _require_h5py()
+        with h5py.File(path, "r") as f:
+            data = _hdf5_columns(f)
+            if isinstance(data, dict):
+                return list(data.keys())
+            return list(data.dtype.names)
+    with fits.open(path, memmap=True) as hdul:
+        return list(hdul[1].columns.names)
+
+
+def count_rows(path, format=None):
+    """
+    Read the number of rows of a catalogue from the file header.
+    Parameters
+    ----------
+    path : str
+        File path of the catalogue.
+    format : str
+        Catalogue format (see table_format).
+    Returns
+    -------
+    nrows : int
+        Number of table rows.
+    """
+    format = table_format(path, format)
+    if format == "columns":
+        return len(ColumnStore(path))
+    if format == "recipe":
+        return len(_open_recipe(path))
+    if format == "hdf5":
+        _require_h5py()
+        with h5py.File(path, "r") as f:
+            data = _hdf5_columns(f)
+            if isinstance(data, dict):
+                return len(next(iter(data.values())))
+            return len(data)
+    with fits.open(path, memmap=True) as hdul:
+        return hdul[1].header["NAXIS2"]
+
+
+def _fits_unit(unit):
+    if unit is None:
+        return None
+    return units.Unit(unit, format="fits", parse_strict="silent")
+
+
+def _hdf5_unit(dset):
+    # units of column datasets are stored as attribute by HDF5Writer
+    unit = dset.attrs.get("unit")
+    if unit is None:
+        return None
+    return units.Unit(unit, parse_strict="silent")
+
+
+def iter_chunks(path, format=None, columns=None, chunk_size=1000000,
+                start=0, stop=None):
+    """
+    Iterate over a catalogue in chunks of rows. Only the requested columns of
+    the current chunk are held in memory, the realisation columns of a recipe
+    are computed for each chunk.
+    Parameters
+    ----------
+    path : str
+        File path of the catalogue.
+    format : str
+        Catalogue format (see table_format).
+    columns : list of str
+        Columns to read (default: all).
+    chunk_size : int
+        Number of rows per chunk.
+    start : int
+        First row to read.
+    stop : int
+        Row at which to stop reading (default: end of table).
+    Yields
+    ------
+    offset : int
+        Row index of the first row of the chunk in the catalogue.
+    chunk : astropy.table.Table
+        Table with the data of the chunk.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk size must be positive")
+    format = table_format(path, format)
+    if format == "recipe":
+        view = _open_recipe(path)
+        stop = len(view) if stop is None else min(stop, len(view))
+        for offset in range(start, stop, chunk_size):
+            end = min(offset + chunk_size, stop)
+            yield offset, Table(
+                _recipe_columns(view, columns, slice(offset, end)),
+                copy=False)
+        return
+    nrows = count_rows(path, format)
+    stop = nrows if stop is None else min(stop, nrows)
+    if columns is None:
+        columns = read_colnames(path, format)
+    columns = list(columns)
+    if format == "columns":
+        store = ColumnStore(path)
+        mapped = [store.column(col) for col in columns]
+        for offset in range(start, stop, chunk_size):
+            end = min(offset + chunk_size, stop)
+            yield offset, Table(
+                [Column(col[offset:end], name=col.name, unit=col.unit,
+                        description=col.description)
+                 for col in mapped])
+    elif format == "hdf5":
+        _require_h5py()
+        with h5py.File(path, "r") as f:
+            data = _hdf5_columns(f)
+            missing = [
+                col for col in columns if col not in (
+                    data if isinstance(data, dict) else data.dtype.names)]
+            if len(missing) > 0:
+                raise KeyError(
+                    "table does not contain columns: %s" % ", ".join(missing))
+            for offset in range(start, stop, chunk_size):
+                end = min(offset + chunk_size, stop)
+                if isinstance(data, dict):
+                    chunk = Table(
+                        [Column(data[col][offset:end], name=col,
+                                unit=_hdf5_unit(data[col]))
+                         for col in columns])
+                else:
+                    # read only the requested fields of the compound dataset
+                    rows = data.fields(columns)[offset:end]
+                    chunk = Table(
+                        [rows[col] for col in columns], names=columns)
+                yield offset, chunk
+    else:
+        with fits.open(path, memmap=True) as hdul:
+            hdu = hdul[1]
+            missing = [col for col in columns if col not in hdu.columns.names]
+            if len(missing) > 0:
+                raise KeyError(
+                    "table does not contain columns: %s" % ", ".join(missing))
+            col_units = {
+                col.name: _fits_unit(col.unit) for col in hdu.columns}
+            for offset in range(start, stop, chunk_size):
+                end = min(offset + chunk_size, stop)
+                rows = hdu.data[offset:end]
+                # np.array copies the chunk out of the memory map
+                yield offset, Table(
+                    [Column(np.array(rows.field(col)), name=col,
+                            unit=col_units[col])
+                     for col in columns])
+
+
+def _hdf5_memmap(path, dset):
+    """
+    Memory-map an HDF5 dataset in copy-on-write mode if it is stored
+    contiguously and uncompressed, otherwise the dataset is read. Returns the
+    data as numpy.ndarray.
+    """
+    offset = dset.id.get_offset()
+    if dset.chunks is not None or offset is None or dset.size == 0:
+        return dset[()]
+    return np.memmap(
+        path, dtype=dset.dtype, mode="c", offset=offset, shape=dset.shape)
+
+
+def map_columns(path, format=None, columns=None):
+    """
+    Memory-map columns of a FITS or HDF5 table or a column store. Data is
+    only read from disk when the column values are accessed. Columns are
+    mapped in copy-on-write mode, i.e. changing the values does not alter the
+    file. The columns of a realisation recipe are computed for all rows.
+    Parameters
+    ----------
+    path : str
+        File path of the catalogue.
+    format : str
+        Catalogue format (see table_format).
+    columns : list of str
+        Columns to map (default: all).
+    Returns
+    -------
+    columns : list of astropy.table.Column
+        Columns that reference the memory-mapped data.
+    """
+    format = table_format(path, format)
+    if format == "recipe":
+        return _recipe_columns(_open_recipe(path), columns)
+    if columns is None:
+        columns = read_colnames(path, format)
+    columns = list(columns)
+    if format == "columns":
+        return list(ColumnStore(path).table(columns).columns.values())
+    if format == "hdf5":
+        _require_h5py()
+        with h5py.File(path, "r") as f:
+            data = _hdf5_columns(f)
+            names = data.keys() if isinstance(data, dict) else data.dtype.names
+            missing = [col for col in columns if col not in names]
+            if len(missing) > 0:
+                raise KeyError(
+                    "table does not contain columns: %s" % ", ".join(missing))
+            if isinstance(data, dict):
+                return [
+                    Column(_hdf5_memmap(path, data[col]), name=col,
+                           unit=_hdf5_unit(data[col]), copy=False)
+                    for col in columns]
+            # field views of the mapped compound dataset, a chunked dataset
+            # is read field by field
+            if data.chunks is None and data.id.get_offset() is not None:
+                rows = _hdf5_memmap(path, data)
+                return [Column(rows[col], name=col, copy=False)
+                        for col in columns]
+            return [Column(data.fields(col)[()], name=col, copy=False)
+                    for col in columns]
+    if format != "fits":
+        # no memory mapping for other astropy.table formats
+        table = Table.read(path, format=format)
+        return [table[col] for col in columns]
+    # the memory map stays open as long as the column data is referenced
+    with fits.open(path, memmap=True) as hdul:
+        hdu = hdul[1]
+        missing = [col for col in columns if col not in hdu.columns.names]
+        if len(missing) > 0:
+            raise KeyError(
+                "table does not contain columns: %s" % ", ".join(missing))
+        col_units = {col.name: _fits_unit(col.unit) for col in hdu.columns}
+        return [
+            Column(hdu.data.field(col), name=col, unit=col_units[col],
+                   copy=False)
+            for col in columns]
+
+
+def load_table(path, format=None, cols=None):
+    """
+    Load the columns of a table without reading the data into memory. The
+    signature matches table_tools.load_table such that stages can use it as
+    drop-in replacement, only the requested columns are mapped.
+    Parameters
+    ----------
+    path : str
+        File path of the catalogue (FITS, HDF5, column store or realisation
+        recipe).
+    format : str
+        astropy.table format specifier (see table_format).
+    cols : list of str
+        Subset of columns to load (default: all).
+    Returns
+    -------
+    table : astropy.table.Table
+        Table referencing the memory-mapped column data.
+    """
+    print("load data table: %s" % path)
+    return Table(map_columns(path, format, cols), copy=False)
+
+
+class ColumnStoreWriter(object):
+    """
+    Append table chunks to a column store.
+    Parameters
+    ----------
+    path : str
+        Directory of the column store, an existing store is cleared.
+    """
+
+    def __init__(self, path):
+        self.store = ColumnStore(path, create=True)
+        self.store.clear()
+        self.nrows = 0
+
+    def write(self, table):
+        self.store.append_table(table)
+        self.nrows += len(table)
+
+    def close(self):
+        pass
+
+
+class FITSWriter(object):
+    """
+    Append table chunks to a FITS binary table. The table header is written
+    with the first chunk and the row count (NAXIS2) is updated on closing.
+    Column data types are fixed by the first chunk, later chunks are cast to
+    these types (e.g. longer strings are truncated).
+    Parameters
+    ----------
+    path : str
+        File path of the output table, an existing file is overwritten.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.nrows = 0
+        self._file = None
+        self._header = None
+        self._dtypes = None
+        self._header_offset = None
+
+    def write(self, table):
+        if self._dtypes is not None:
+            # cast to the layout of the first chunk
+            table = Table(
+                [Column(table[col], dtype=self._dtypes[col])
+                 for col in self._dtypes],
+                names=list(self._dtypes))
+        hdu = fits.table_to_hdu(table)
+        # serialise the chunk with astropy to get the binary row data
+        buffer = io.BytesIO()
+        hdu.writeto(buffer)
+        primary_size = len(fits.PrimaryHDU().header.tostring())
+        data_offset = primary_size + len(hdu.header.tostring())
+        data_size = hdu.header["NAXIS1"] * hdu.header["NAXIS2"]
+        if self._file is None:
+            self._dtypes = {col: table[col].dtype for col in table.colnames}
+            self._header = hdu.header
+            self._header_offset = primary_size
+            self._file = open(self.path, "wb")
+            self._file.write(buffer.getvalue()[:data_offset])
+        self._file.write(
+            buffer.getbuffer()[data_offset:data_offset + data_size])
+        self.nrows += len(table)
+
+    def close(self):
+        if self._file is None:
+            return
+        # pad the data to a multiple of the FITS block size
+        size = self._file.tell()
+        self._file.write(b"\0" * (-size % 2880))
+        # update the row count in the header, which does not change its size
+        self._header["NAXIS2"] = self.nrows
+        self._file.seek(self._header_offset)
+        self._file.write(bytes(self._header.tostring(), "ascii"))
+        self._file.close()
+        self._file = None
+
+
+class HDF5Writer(object):
+    """
+    Append table chunks to an HDF5 file with one chunked, compressed dataset
+    per column in the group "data" (the layout of the cosmoDC2 extracts),
+    such that columns can be read individually. Units are stored as dataset
+    attribute. Column data types are fixed by the first chunk, later chunks
+    are cast to these types.
+    Parameters
+    ----------
+    path : str
+        File path of the output table, an existing file is overwritten.
+    compression : str
+        HDF5 compression filter ("gzip", "lzf" or None).
+    chunk_rows : int
+        Number of rows per HDF5 chunk.
+    """
+
+    def __init__(self, path, compression="gzip", chunk_rows=65536):
+        _require_h5py()
+        self.path = path
+        self.compression = compression
+        self.chunk_rows = chunk_rows
+        self.nrows = 0
+        self._file = None
+        self._group = None
+
+    def write(self, table):
+        if self._file is None:
+            self._file = h5py.File(self.path, "w")
+            self._group = self._file.create_group("data")
+            self._group.attrs["columns"] = np.char.encode(
+                table.colnames, "utf-8")
+            for col in table.colnames:
+                data = table[col]
+                dtype = data.dtype
+                if dtype.kind == "U":  # HDF5 stores byte strings
+                    dtype = np.dtype("S%d" % (dtype.itemsize // 4))
+                dset = self._group.create_dataset(
+                    col, shape=(0, *data.shape[1:]), dtype=dtype,
+                    maxshape=(None, *data.shape[1:]),
+                    chunks=(self.chunk_rows, *data.shape[1:]),
+                    compression=self.compression,
+                    shuffle=self.compression is not None)
+                if data.unit is not None:
+                    dset.attrs["unit"] = data.unit.to_string()
+        end = self.nrows + len(table)
+        for col, dset in self._group.items():
+            data = np.asarray(table[col])
+            if data.dtype.kind == "U":
+                data = np.char.encode(data, "utf-8")
+            dset.resize(end, axis=0)
+            dset[self.nrows:end] = data.astype(dset.dtype, copy=False)
+        self.nrows = end
+
+    def close(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+
+
+class BackgroundWriter(object):
+    """
+    Wraps a writer such that chunks are written in a background thread while
+    the next chunk is read and processed. At most depth chunks are queued to
+    bound the memory usage. Errors of the writer are raised on the next call
+    of write() or close().
+    Parameters
+    ----------
+    writer : object
+        Writer with methods write(table) and close() (see open_writer).
+    depth : int
+        Maximum number of queued chunks.
+    """
+
+    def __init__(self, writer, depth=2):
+        self.writer = writer
+        self._queue = queue.Queue(depth)
+        self._error = None
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    @property
+    def nrows(self):
+        return self.writer.nrows
+
+    def _work(self):
+        while True:
+            table = self._queue.get()
+            if table is None:
+                break
+            if self._error is None:  # drop all chunks after an error
+                try:
+                    self.writer.write(table)
+                except BaseException as e:
+                    self._error = e
+
+    def _raise(self):
+        if self._error is not None:
+            raise self._error
+
+    def write(self, table):
+        self._raise()
+        self._queue.put(table)
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self.writer.close()
+        self._raise()
+
+
+def open_writer(path, format=None, background=False, **kwargs):
+    """
+    Open a writer that appends table chunks to an output catalogue.
+    Parameters
+    ----------
+    path : str
+        File path of the output catalogue.
+    format : str
+        Catalogue format (see table_format), "columns", "fits" or "hdf5".
+    background : bool
+        Whether the chunks are written in a background thread (see
+        BackgroundWriter), the written tables must not be modified.
+    **kwargs
+        Options of HDF5Writer.
+    Returns
+    -------
+    writer : ColumnStoreWriter, FITSWriter, HDF5Writer or BackgroundWriter
+        Writer with methods write(table) and close().
+    """
+    format = table_format(path, format)
+    if format == "columns":
+        writer = ColumnStoreWriter(path)
+    elif format == "fits":
+        writer = FITSWriter(path)
+    elif format == "hdf5":
+        writer = HDF5Writer(path, **kwargs)
+    else:
+        raise ValueError(
+            "chunked writing not supported for format: %s" % format)
+    if background:
+        writer = BackgroundWriter(writer)
+    return writer
@@ -0,0 +1,484 @@
+###############################################################################
+#                                                                             #
+#   Directory-backed column store. Each column is stored in a separate raw    #
+#   binary file that can be memory-mapped, a manifest (manifest.json) records #
+#   the row count and the data type, unit, description and provenance of each #
+#   column. New columns are added without touching the existing ones, which   #
+#   replaces repeatedly stacking and rewriting a combined data table.         #
+#                                                                             #
+###############################################################################
+
+import json
+import os
+import time
+from urllib.parse import quote
+
+import numpy as np
+from astropy.table import Column, Table
+
+
+# file extension that identifies a column store directory
+STORE_EXTENSION = ".columns"
+# file extension of the column data files
+COLUMN_EXTENSION = ".col"
+
+
+def column_file_name(name):
+    """
+    Get the file name of a column. Characters other than letters, digits and
+    _.-~ are percent-encoded (reversed by urllib.parse.unquote), such that
+    distinct column names map to distinct file names.
+    """
+    return quote(name, safe="") + COLUMN_EXTENSION
+
+
+def is_column_store(path):
+    """
+    Whether a path refers to a column store (existing or to be created).
+    Parameters
+    ----------
+    path : str
+        File or directory path.
+    Returns
+    -------
+    is_store : bool
+        True if the path has the column store extension or contains a
+        column store manifest.
+    """
+    path = path.rstrip(os.sep)
+    return path.endswith(STORE_EXTENSION) or os.path.exists(
+        os.path.join(path, ColumnStore.manifest_name))
+
+
+class ColumnStore(object):
+    """
+    Catalogue stored as one memory-mappable binary file per column with a
+    manifest that records the row count and the column meta data.
+    Parameters
+    ----------
+    path : str
+        Directory of the column store.
+    create : bool
+        Whether to create an empty store if the directory does not exist.
+    """
+
+    manifest_name = "manifest.json"
+
+    def __init__(self, path, create=False):
+        self.path = path
+        self._manifest_path = os.path.join(path, self.manifest_name)
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path) as f:
+                self.manifest = json.load(f)
+        elif create:
+            os.makedirs(path, exist_ok=True)
+            self.manifest = {"nrows": None, "columns": {}}
+            self._write_manifest()
+        else:
+            raise OSError("column store does not exist: %s" % path)
+
+    def _write_manifest(self):
+        # replace the manifest atomically such that readers never see a
+        # partially written file
+        temp_path = self._manifest_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.manifest, f, indent=4)
+        os.replace(temp_path, self._manifest_path)
+
+    def _file(self, name):
+        return os.path.join(self.path, self.manifest["columns"][name]["file"])
+
+    def _column_file(self, name):
+        # file names of other columns may differ only in case, which collide
+        # on case-insensitive file systems
+        fname = column_file_name(name)
+        for other, meta in self.manifest["columns"].items():
+            if other != name and meta["file"].lower() == fname.lower():
+                raise ValueError(
+                    "file name of column '%s' collides with column '%s'" % (
+                        name, other))
+        return fname
+
+    def _register(self, name, fname, nrows, dtype, shape, unit, description,
+                  provenance):
+        # add the column to the manifest, the file of a replaced column is
+        # removed if it has a different name (stores of older versions)
+        old_file = None
+        if name in self and self.meta(name)["file"] != fname:
+            old_file = self._file(name)
+        if provenance is None:
+            provenance = {}
+        provenance.setdefault("time", time.strftime("%Y-%m-%d %H:%M:%S"))
+        self.manifest["nrows"] = nrows
+        self.manifest["columns"][name] = {
+            "file": fname, "dtype": dtype.str, "shape": list(shape),
+            "unit": unit, "description": description,
+            "provenance": provenance}
+        self._write_manifest()
+        if old_file is not None:
+            os.remove(old_file)
+
+    @property
+    def nrows(self):
+        return self.manifest["nrows"]
+
+    @property
+    def colnames(self):
+        return list(self.manifest["columns"].keys())
+
+    def __len__(self):
+        return 0 if self.nrows is None else self.nrows
+
+    def __contains__(self, name):
+        return name in self.manifest["columns"]
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def meta(self, name):
+        """
+        Get the manifest entry of a column (dtype, shape, unit, description,
+        provenance).
+        """
+        return self.manifest["columns"][name]
+
+    def column(self, name, mode="r"):
+        """
+        Get a column as memory-mapped astropy.table.Column.
+        Parameters
+        ----------
+        name : str
+            Name of the column.
+        mode : str
+            numpy.memmap file mode, "r" (read-only) or "r+" (read/write).
+        Returns
+        -------
+        column : astropy.table.Column
+            Column data mapped from disk.
+        """
+        if name not in self:
+            raise KeyError("column store does not contain column: %s" % name)
+        meta = self.meta(name)
+        shape = (len(self), *meta["shape"])
+        if len(self) == 0:
+            data = np.empty(shape, dtype=meta["dtype"])
+        else:
+            data = np.memmap(
+                self._file(name), dtype=meta["dtype"], mode=mode, shape=shape)
+        return Column(
+            data, name=name, unit=meta["unit"],
+            description=meta["description"], copy=False)
+
+    def add_column(
+            self, name, data, unit=None, description=None, provenance=None,
+            overwrite=False):
+        """
+        Add a new column to the store, existing columns are not modified.
+        Parameters
+        ----------
+        name : str
+            Name of the column.
+        data : array_like
+            Column data, must match the row count of the store.
+        unit : str
+            Unit of the column data (inherited from astropy Columns if None).
+        description : str
+            Description of the column (inherited from astropy Columns if
+            None).
+        provenance : dict
+            Information about how the column was created (e.g. stage name).
+        overwrite : bool
+            Whether an existing column with the same name is replaced.
+        """
+        if name in self and not overwrite:
+            raise ValueError("column already exists: %s" % name)
+        if isinstance(data, Column):
+            if unit is None and data.unit is not None:
+                unit = str(data.unit)
+            if description is None:
+                description = data.description
+        self.add_column_chunks(
+            name, [data], unit=unit, description=description,
+            provenance=provenance, overwrite=overwrite)
+
+    def add_column_chunks(
+            self, name, chunks, unit=None, description=None,
+            provenance=None, overwrite=False):
+        """
+        Add a new column from consecutive chunks of rows, such that the
+        column data is never held in memory at once. The column becomes
+        visible once all chunks are written.
+        Parameters
+        ----------
+        name : str
+            Name of the column.
+        chunks : iterable of array_like
+            Column data in chunks of rows, the data type and shape are fixed
+            by the first chunk. The total length must match the row count of
+            the store.
+        unit : str
+            Unit of the column data.
+        description : str
+            Description of the column.
+        provenance : dict
+            Information about how the column was created (e.g. stage name).
+        overwrite : bool
+            Whether an existing column with the same name is replaced.
+        """
+        if name in self and not overwrite:
+            raise ValueError("column already exists: %s" % name)
+        fname = self._column_file(name)
+        temp_path = os.path.join(self.path, fname + ".tmp")
+        dtype = None
+        shape = None
+        nrows = 0
+        try:
+            with open(temp_path, "wb") as f:
+                for data in chunks:
+                    data = np.asarray(data)
+                    if data.dtype.kind == "O":
+                        raise TypeError(
+                            "cannot store object column: %s" % name)
+                    if dtype is None:
+                        # store in native byte order (FITS is big endian)
+                        dtype = data.dtype.newbyteorder("=")
+                        shape = data.shape[1:]
+                    np.ascontiguousarray(data, dtype=dtype).tofile(f)
+                    nrows += len(data)
+            if dtype is None:
+                raise ValueError("no data for column: %s" % name)
+            if self.nrows is not None and nrows != self.nrows:
+                raise ValueError(
+                    "column '%s' has %d rows, but the store has %d rows" % (
+                        name, nrows, self.nrows))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        os.replace(temp_path, os.path.join(self.path, fname))
+        self._register(
+            name, fname, nrows, dtype, shape, unit, description, provenance)
+
+    def allocate_column(
+            self, name, dtype, shape=(), nrows=None, unit=None,
+            description=None, provenance=None, overwrite=False):
+        """
+        Add a new column with undefined values, which are filled through the
+        memory map returned by column(name, mode="r+"), e.g. to write rows in
+        arbitrary order. The column is visible before it is filled, see
+        open_column to add it once its values are complete.
+        Parameters
+        ----------
+        name : str
+            Name of the column.
+        dtype : numpy.dtype
+            Data type of the column.
+        shape : tuple
+            Shape of the column elements.
+        nrows : int
+            Row count, required if the store is empty, otherwise it must
+            match the row count of the store.
+        unit : str
+            Unit of the column data.
+        description : str
+            Description of the column.
+        provenance : dict
+            Information about how the column was created (e.g. stage name).
+        overwrite : bool
+            Whether an existing column with the same name is replaced.
+        """
+        data = self.open_column(
+            name, dtype, shape, nrows=nrows, overwrite=overwrite)
+        self.close_column(
+            name, data, unit=unit, description=description,
+            provenance=provenance)
+
+    def open_column(self, name, dtype, shape=(), nrows=None, overwrite=False):
+        """
+        Create the file of a new column with undefined values, which are
+        filled through the returned memory map. The column becomes visible
+        with close_column, until then a replaced column remains valid, e.g.
+        if filling the new column is interrupted.
+        Parameters
+        ----------
+        name : str
+            Name of the column.
+        dtype : numpy.dtype
+            Data type of the column.
+        shape : tuple
+            Shape of the column elements.
+        nrows : int
+            Row count, required if the store is empty, otherwise it must
+            match the row count of the store.
+        overwrite : bool
+            Whether an existing column with the same name is replaced.
+        Returns
+        -------
+        data : numpy.memmap
+            Writable memory map of the column data.
+        """
+        if name in self and not overwrite:
+            raise ValueError("column already exists: %s" % name)
+        if nrows is None:
+            nrows = self.nrows
+        if nrows is None:
+            raise ValueError("the row count of the empty store is required")
+        if self.nrows is not None and nrows != self.nrows:
+            raise ValueError(
+                "column '%s' has %d rows, but the store has %d rows" % (
+                    name, nrows, self.nrows))
+        dtype = np.dtype(dtype).newbyteorder("=")
+        shape = (nrows, *shape)
+        # a replaced column may still be memory-mapped, the new file is
+        # created next to it and renamed by close_column, which leaves open
+        # maps intact
+        temp_path = os.path.join(self.path, self._column_file(name) + ".tmp")
+        with open(temp_path, "wb") as f:
+            # allocated sparsely by the file system
+            f.truncate(dtype.itemsize * int(np.prod(shape)))
+        if nrows == 0:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(temp_path, dtype=dtype, mode="r+", shape=shape)
+
+    def close_column(
+            self, name, data, unit=None, description=None, provenance=None):
+        """
+        Add a column created by open_column to the store once its values are
+        filled.
+        Parameters
+        ----------
+        name : str
+            Name of the column.
+        data : numpy.memmap
+            Memory map returned by open_column.
+        unit : str
+            Unit of the column data.
+        description : str
+            Description of the column.
+        provenance : dict
+            Information about how the column was created (e.g. stage name).
+        """
+        fname = self._column_file(name)
+        if isinstance(data, np.memmap):
+            data.flush()
+        os.replace(
+            os.path.join(self.path, fname + ".tmp"),
+            os.path.join(self.path, fname))
+        self._register(
+            name, fname, len(data), data.dtype, data.shape[1:], unit,
+            description, provenance)
+
+    def add_table(self, table, provenance=None, overwrite=False):
+        """
+        Add all columns of a table to the store.
+        Parameters
+        ----------
+        table : astropy.table.Table
+            Table with the new columns.
+        provenance : dict
+            Information about how the columns were created (e.g. stage name).
+        overwrite : bool
+            Whether existing columns with the same name are replaced.
+        """
+        for name in table.colnames:
+            self.add_column(
+                name, table[name], provenance=dict(provenance or {}),
+                overwrite=overwrite)
+
+    def append_table(self, table, provenance=None):
+        """
+        Append the rows of a table to the store, e.g. to write a catalogue in
+        chunks. An empty store adopts the columns of the first table, later
+        tables must provide the same columns.
+        Parameters
+        ----------
+        table : astropy.table.Table
+            Table with the new rows.
+        provenance : dict
+            Information about how the columns were created (only used when
+            the columns are created).
+        """
+        if len(self.manifest["columns"]) == 0:
+            self.add_table(table, provenance=provenance)
+            return
+        if set(table.colnames) != set(self.colnames):
+            raise ValueError(
+                "appended table must have the columns: %s" %
+                ", ".join(self.colnames))
+        for name in self.colnames:
+            meta = self.meta(name)
+            dtype = np.dtype(meta["dtype"])
+            data = np.asarray(table[name])
+            if list(data.shape[1:]) != meta["shape"]:
+                raise ValueError(
+                    "column '%s' has shape %s, expected %s" % (
+                        name, data.shape[1:], tuple(meta["shape"])))
+            row_size = dtype.itemsize * int(np.prod(meta["shape"]))
+            with open(self._file(name), "r+b") as f:
+                # discard data of a previously interrupted append
+                f.truncate(len(self) * row_size)
+                f.seek(0, os.SEEK_END)
+                np.ascontiguousarray(data, dtype=dtype).tofile(f)
+        # the rows become visible only once the manifest is updated
+        self.manifest["nrows"] = len(self) + len(table)
+        self._write_manifest()
+
+    def drop_column(self, name):
+        """
+        Remove a column from the store.
+        """
+        fpath = self._file(name)
+        del self.manifest["columns"][name]
+        if len(self.manifest["columns"]) == 0:
+            self.manifest["nrows"] = None
+        self._write_manifest()
+        os.remove(fpath)
+
+    def clear(self):
+        """
+        Remove all columns from the store, e.g. before storing a catalogue
+        with a different row count.
+        """
+        for name in self.colnames:
+            self.drop_column(name)
+
+    def table(self, columns=None):
+        """
+        Get a table of memory-mapped columns.
+        Parameters
+        ----------
+        columns : list of str
+            Subset of columns to include (default: all).
+        Returns
+        -------
+        table : astropy.table.Table
+            Table referencing the memory-mapped column data.
+        """
+        if columns is None:
+            columns = self.colnames
+        missing = [col for col in columns if col not in self]
+        if len(missing) > 0:
+            raise KeyError(
+                "column store does not contain columns: %s" %
+                ", ".join(missing))
+        return Table([self.column(col) for col in columns], copy=False)
+
+
+def load_table(path, format=None, cols=None):
+    """
+    Load a column store as astropy.table.Table with memory-mapped columns.
+    The signature matches table_tools.load_table such that readers of combined
+    data tables can use column stores as drop-in replacement.
+    Parameters
+    ----------
+    path : str
+        Directory of the column store.
+    format : str
+        Ignored, kept for compatibility with table_tools.load_table.
+    cols : list of str
+        Subset of columns to load (default: all).
+    Returns
+    -------
+    table : astropy.table.Table
+        Table referencing the memory-mapped column data.
+    """
+    return ColumnStore(path).table(cols)
@@ -0,0 +1,222 @@
+###############################################################################
+#                                                                             #
+#   Maps of observing conditions (PSF size, limiting magnitude) that vary     #
+#   between the pointings of a survey or the pixels of a NESTED HEALPix map.  #
+#   The values of each object are gathered with its pointing or pixel index,  #
+#   such that spatially varying conditions cost an integer array lookup.      #
+#                                                                             #
+###############################################################################
+
+import re
+
+import numpy as np
+from astropy.table import Table
+
+import healpix
+
+
+# largest index for which the rows are looked up in a dense array, sparser
+# maps are searched
+MAX_DENSE_INDEX = 1 << 26
+
+
+def index_nside(column):
+    """
+    Get the HEALPix resolution of an index column named as
+    healpix.index_column.
+    Parameters
+    ----------
+    column : str
+        Name of the index column.
+    Returns
+    -------
+    nside : int
+        HEALPix resolution parameter, None if the column is not a HEALPix
+        index (e.g. a pointing index).
+    """
+    match = re.fullmatch(r"healpix_(\d+)", column)
+    if match is None:
+        return None
+    nside = int(match.group(1))
+    healpix.check_nside(nside)
+    return nside
+
+
+def is_fits(path):
+    """
+    Whether a map file is a FITS table, guessed from the file extension.
+    """
+    return path.lower().endswith((".fits", ".fit", ".fits.gz"))
+
+
+class ConditionMap(object):
+    """
+    Values of an observing condition in each filter for a set of pointings
+    or HEALPix pixels.
+    Parameters
+    ----------
+    column : str
+        Name of the catalogue column with the index of the entries, e.g. the
+        pointing index column or a NESTED HEALPix index column named
+        healpix_<nside>.
+    index : array_like
+        Pointing or pixel index of each entry.
+    values : dict
+        Value of each entry for each filter name.
+    """
+
+    def __init__(self, column, index, values):
+        self.column = column
+        self.nside = index_nside(column)
+        self.index = np.asarray(index, dtype=np.int64)
+        if self.index.ndim != 1 or len(self.index) == 0:
+            raise ValueError("condition map has no entries")
+        if np.any(self.index < 0):
+            raise ValueError("condition map index must be non-negative")
+        if len(np.unique(self.index)) != len(self.index):
+            raise ValueError("condition map index contains duplicates")
+        self.filters = list(values.keys())
+        # one row of values per filter
+        self.values = np.array(
+            [values[filt] for filt in self.filters], dtype=np.float32)
+        if self.values.shape != (len(self.filters), len(self.index)):
+            raise ValueError("expected %d values per filter" % len(self.index))
+        max_index = int(self.index.max())
+        if max_index < MAX_DENSE_INDEX:
+            # entry of each index, -1 if not in the map
+            self._lookup = np.full(max_index + 1, -1, dtype=np.int32)
+            self._lookup[self.index] = np.arange(len(self.index))
+        else:
+            self._lookup = None
+            self._order = np.argsort(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    @classmethod
+    def read(cls, path):
+        """
+        Read a map from a FITS or text table (with header line). The first
+        column is the index column, the other columns hold the values of the
+        filters.
+        Parameters
+        ----------
+        path : str
+            File path of the map.
+        Returns
+        -------
+        map : ConditionMap
+            Map read from the file.
+        """
+        if is_fits(path):
+            table = Table.read(path, format="fits")
+        else:
+            table = Table.read(path, format="ascii")
+        if len(table.colnames) < 2:
+            raise ValueError(
+                "condition map requires an index and a value column: %s" %
+                path)
+        column, *filters = table.colnames
+        return cls(
+            column, table[column],
+            {filt: np.asarray(table[filt]) for filt in filters})
+
+    def write(self, path):
+        """
+        Write the map to a FITS or text table (see read).
+        """
+        table = Table([self.index], names=[self.column])
+        for filt, values in zip(self.filters, self.values):
+            table[filt] = values
+        if is_fits(path):
+            table.write(path, format="fits", overwrite=True)
+        else:
+            table.write(
+                path, format="ascii.commented_header", overwrite=True)
+
+    def rows(self, index, nside=None):
+        """
+        Find the map entry of each object.
+        Parameters
+        ----------
+        index : array_like
+            Pointing or pixel index of the objects.
+        nside : int
+            HEALPix resolution of the pixel index, if it is finer than that
+            of the map the pixels are degraded (optional).
+        Returns
+        -------
+        rows : array_like
+            Map entry of each object, -1 if the object is not in the map.
+        """
+        index = np.asarray(index, dtype=np.int64)
+        if nside is not None and self.nside is not None and \
+                nside != self.nside:
+            index = healpix.degrade(index, nside, self.nside)
+        rows = np.full(index.shape, -1, dtype=np.int64)
+        if self._lookup is not None:
+            inside = (index >= 0) & (index < len(self._lookup))
+            rows[inside] = self._lookup[index[inside]]
+        else:
+            sorted_index = self.index[self._order]
+            pos = np.searchsorted(sorted_index, index)
+            pos[pos == len(sorted_index)] = 0
+            found = sorted_index[pos] == index
+            rows[found] = self._order[pos[found]]
+        return rows
+
+    def gather(self, index, defaults, nside=None):
+        """
+        Get the values of the objects in each filter.
+        Parameters
+        ----------
+        index : array_like
+            Pointing or pixel index of the objects.
+        defaults : dict
+            Value for each filter name, used for filters that are not in the
+            map and for objects outside of the map.
+        nside : int
+            HEALPix resolution of the pixel index (see rows).
+        Returns
+        -------
+        values : dict
+            Values of the objects (float32 arrays) for each filter name, or
+            the default for filters that are not in the map.
+        """
+        rows = self.rows(index, nside)
+        outside = rows < 0
+        mapped = [filt for filt in defaults if filt in self.filters]
+        gathered = self.values[
+            [self.filters.index(filt) for filt in mapped]][:, rows]
+        values = dict(defaults)
+        for filt, data in zip(mapped, gathered):
+            data[outside] = defaults[filt]
+            values[filt] = data
+        return values
+
+
+def gather_conditions(data, path, defaults, column=None):
+    """
+    Get the values of a condition map for the objects of a catalogue.
+    Parameters
+    ----------
+    data : astropy.table.Table
+        Catalogue with the index column of the map.
+    path : str
+        File path of the map (see ConditionMap.read), uniform values are
+        used if None.
+    defaults : dict
+        Uniform value for each filter name (see ConditionMap.gather).
+    column : str
+        Name of the catalogue index column (default: the map index column).
+    Returns
+    -------
+    values : dict
+        Values of the objects for each filter name.
+    """
+    if path is None:
+        return dict(defaults)
+    cmap = ConditionMap.read(path)
+    if column is None:
+        column = cmap.column
+    return cmap.gather(data[column], defaults, index_nside(column))
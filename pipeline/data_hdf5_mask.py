@@ -1,24 +1,206 @@
 #!/usr/bin/env python3
 import os
+import sys
 import argparse
 import numpy as np
 
-from table_tools import load_table
+from catalogue_io import count_rows, open_writer, table_format
+from footprint_regions import Rectangle, RegionMask, mask_ra_dec, read_regions
+from spatial_index import iter_region_chunks
+
+
+def _open_output(output, o_format, compression):
+    # background writer, compression applies only to HDF5 files
+    if table_format(output, o_format) == "hdf5":
+        return open_writer(
+            output, o_format, background=True, compression=compression)
+    return open_writer(output, o_format, background=True)
+
+
+def _read_columns(columns, ra, dec):
+    # RA/DEC are read for masking but only written if requested
+    if columns is None:
+        return None
+    return list(columns) + [col for col in (ra, dec) if col not in columns]
+
+
+def region_output(output, name):
+    """
+    File path of the output of a region: the region name is appended to the
+    file name of the output path, e.g. masked.hdf5 -> masked_KV450.hdf5.
+    """
+    root, ext = os.path.splitext(output)
+    return "%s_%s%s" % (root, name, ext)
+
+
+def mask_file(
+        input, output, bounds, ra, dec, i_format=None, o_format=None,
+        columns=None, chunk_size=1000000, compression="gzip"):
+    """
+    Mask a catalogue to a right ascension / declination bound without loading
+    it into memory. The input (FITS, HDF5 or column store) is read in chunks
+    of rows, the rows within the bound are appended to the output. Writing
+    runs in a background thread while the next chunk is read and masked.
+    Spatially sorted inputs (see data_spatial_sort.py) are only read in the
+    row ranges that overlap with the bound.
+
+    Parameters
+    ----------
+    input : str
+        File path of the input catalogue.
+    output : str
+        File path of the output catalogue (FITS, HDF5 or column store).
+    bounds : list of float
+        Bounds in degrees: RA_min RA_max DEC_min DEC_max.
+    ra : str
+        Column name of the right ascension.
+    dec : str
+        Column name of the declination.
+    i_format : str
+        Format of the input catalogue (see catalogue_io.table_format).
+    o_format : str
+        Format of the output catalogue (see catalogue_io.table_format).
+    columns : list of str
+        Columns written to the output (default: all).
+    chunk_size : int
+        Number of rows read at once.
+    compression : str
+        Compression filter of HDF5 output ("gzip", "lzf" or None).
+
+    Returns
+    -------
+    n_input : int
+        Number of input rows.
+    n_output : int
+        Number of rows within the bounds.
+    """
+    n_input = count_rows(input, i_format)
+    writer = _open_output(output, o_format, compression)
+    try:
+        for offset, chunk in iter_region_chunks(
+                input, Rectangle("bounds", *bounds), i_format,
+                _read_columns(columns, ra, dec), chunk_size):
+            mask = mask_ra_dec(
+                chunk[ra].data, chunk[dec].data, *bounds)
+            if np.any(mask):
+                masked = chunk[mask]
+                if columns is not None:
+                    masked = masked[list(columns)]
+                writer.write(masked)
+    finally:
+        writer.close()
+    return n_input, writer.nrows
+
+
+def mask_regions(
+        input, output, regions, ra, dec, i_format=None, o_format=None,
+        columns=None, chunk_size=1000000, compression="gzip", split=False,
+        index=None):
+    """
+    Mask a catalogue to a set of sky regions in a single pass over the data,
+    which is read in chunks of rows (see mask_file). Either the rows within
+    any of the regions are written to the output, with one boolean column
+    in_<region name> per region, or the members of each region are written
+    to a separate output (see region_output). Spatially sorted inputs are
+    only read in the row ranges that overlap with the regions.
+
+    Parameters
+    ----------
+    input : str
+        File path of the input catalogue.
+    output : str
+        File path of the output catalogue (FITS, HDF5 or column store).
+    regions : footprint_regions.RegionMask
+        Regions to which the data is masked.
+    ra : str
+        Column name of the right ascension.
+    dec : str
+        Column name of the declination.
+    i_format : str
+        Format of the input catalogue (see catalogue_io.table_format).
+    o_format : str
+        Format of the output catalogue (see catalogue_io.table_format).
+    columns : list of str
+        Columns written to the output (default: all).
+    chunk_size : int
+        Number of rows read at once.
+    compression : str
+        Compression filter of HDF5 output ("gzip", "lzf" or None).
+    split : bool
+        Whether the members of each region are written to separate outputs.
+    index : tuple
+        Column name and nside of a NESTED HEALPix index column (see
+        data_healpix_index.py) used for the region lookup (optional).
+
+    Returns
+    -------
+    n_input : int
+        Number of input rows.
+    n_members : dict
+        Number of rows within each region.
+    """
+    if split:
+        writers = {
+            name: _open_output(
+                region_output(output, name), o_format, compression)
+            for name in regions.names}
+    else:
+        writers = {None: _open_output(output, o_format, compression)}
+    read_columns = _read_columns(columns, ra, dec)
+    if index is not None and read_columns is not None:
+        read_columns = read_columns + [
+            col for col in index[:1] if col not in read_columns]
+    n_input = count_rows(input, i_format)
+    n_members = {name: 0 for name in regions.names}
+    try:
+        for offset, chunk in iter_region_chunks(
+                input, regions, i_format, read_columns, chunk_size):
+            if index is None:
+                masks = regions.contains(chunk[ra].data, chunk[dec].data)
+            else:
+                masks = regions.contains(
+                    chunk[ra].data, chunk[dec].data,
+                    pix=chunk[index[0]].data, nside=index[1])
+            if columns is not None:
+                chunk = chunk[list(columns)]
+            for name, mask in masks.items():
+                n_members[name] += np.count_nonzero(mask)
+                if split and np.any(mask):
+                    writers[name].write(chunk[mask])
+            if not split:
+                mask = np.any(list(masks.values()), axis=0)
+                if np.any(mask):
+                    masked = chunk[mask]
+                    for name, member in masks.items():
+                        masked["in_%s" % name] = member[mask]
+                    writers[None].write(masked)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return n_input, n_members
 
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(
         description='Mask the data objects to a right ascension / declination '
-                    'bound.')
+                    'bound or to a set of sky regions.')
     parser.add_argument(
         '-i', '--input', required=True, help='file path of input data table')
     parser.add_argument(
-        '--i-format', default='fits',
-        help='astropy.table format specifier of the input tables ')
-    parser.add_argument(
-        '-b', '--bounds', nargs=4, type=float, required=True,
+        '--i-format',
+        help='format of the input table: fits, hdf5 or columns (column '
+             'store) (default: guessed from the file extension)')
+    regions_group = parser.add_mutually_exclusive_group(required=True)
+    regions_group.add_argument(
+        '-b', '--bounds', nargs=4, type=float,
         help='bounds of polygon in degrees: RA_min RA_max DEC_min DEC_max')
+    regions_group.add_argument(
+        '-r', '--regions',
+        help='footprint file (see mocks_generate_footprint.py) or region '
+             'file with rectangles, convex polygons and HEALPix pixel lists '
+             '(see footprint_regions.read_regions), all regions are '
+             'evaluated in a single pass')
     parser.add_argument(
         '--ra', required=True, help='fits column name of RA')
     parser.add_argument(
@@ -26,11 +208,62 @@ if __name__ == "__main__":
     parser.add_argument(
         '-o', '--output', required=True, help='file path of output table')
     parser.add_argument(
-        '--o-format', default='fits',
-        help='astropy.table format specifier of the output table '
+        '--o-format',
+        help='format of the output table: fits, hdf5 or columns (column '
+             'store) (default: guessed from the file extension)')
+    parser.add_argument(
+        '--select', nargs='*',
+        help='names of the regions to use from --regions (default: all)')
+    parser.add_argument(
+        '--split', action='store_true',
+        help='write the members of each region to a separate output, named '
+             'after the output file with the region name appended '
+             '(default: one output with a boolean column in_<name> per '
+             'region)')
+    parser.add_argument(
+        '--nside', type=int, default=64,
+        help='HEALPix resolution of the coarse region index '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--index-nside', type=int,
+        help='nside of a NESTED HEALPix index column in the input table '
+             '(see data_healpix_index.py) that is used to look up --regions')
+    parser.add_argument(
+        '--index-column',
+        help='name of the HEALPix index column (default: healpix_<nside>)')
+    parser.add_argument(
+        '--columns', nargs='*',
+        help='columns written to the output table (default: all)')
+    parser.add_argument(
+        '--chunk-size', type=int, default=1000000,
+        help='number of rows read at once (default: %(default)s)')
+    parser.add_argument(
+        '--compression', default='gzip', choices=('gzip', 'lzf', 'none'),
+        help='compression filter of HDF5 output tables '
              '(default: %(default)s)')
     args = parser.parse_args()
 
+    compression = None if args.compression == 'none' else args.compression
+    if args.regions is not None:
+        regions = RegionMask(
+            read_regions(args.regions, args.select), args.nside)
+        if args.index_nside is not None:
+            index = (
+                args.index_column or "healpix_%d" % args.index_nside,
+                args.index_nside)
+        else:
+            index = None
+        print("mask data to regions: %s" % ", ".join(regions.names))
+        n_input, n_members = mask_regions(
+            args.input, args.output, regions, args.ra, args.dec,
+            args.i_format, args.o_format, args.columns, args.chunk_size,
+            compression, args.split, index)
+        for name, n_output in n_members.items():
+            print("%s: %d / %d rows" % (name, n_output, n_input))
+        if sum(n_members.values()) == 0:
+            sys.exit("ERROR: no data found within the regions")
+        sys.exit()
+
     RAmin, RAmax, DECmin, DECmax = args.bounds
     # check input bounds
     if not all(-90.0 <= dec <= 90.0 for dec in (DECmin, DECmax)):
@@ -39,28 +272,16 @@ if __name__ == "__main__":
         parser.error("RA_min and RA_max must be between 0 and 360 degrees")
     if DECmax <= DECmin:
         parser.error("DEC_min must be lower than DEC_max")
-    table = load_table(args.input, args.i_format, [args.ra, args.dec])
 
     # apply filter rule
     print(
         ("mask data to bounds with RA: %011.7f-%011.7f " % (RAmin, RAmax)) +
         ("and DEC: %0+11.7f-%0+11.7f " % (DECmin, DECmax)))
-    # collect RA/DEC from the table
-    ra_data = table[args.ra].data
-    dec_data = table[args.dec].data
-    if RAmax >= RAmin:
-        mask = (  # mask data to bounds
-            (ra_data >= RAmin) & (ra_data < RAmax) &
-            (dec_data >= DECmin) & (dec_data < DECmax))
-    else:
-        mask = (  # mask data to bounds
-            (ra_data >= RAmin) | (ra_data < RAmax) &
-            (dec_data >= DECmin) & (dec_data < DECmax))
-    if np.count_nonzero(mask) == 0:
-        sys.exit("ERROR: no data found within RA/DEC limits")
-    masked_table = table[mask]
-    # write to specified output path
-    print(
-        "removed %d / %d rows" % (len(table) - len(masked_table), len(table)))
     print("write table to: %s" % args.output)
-    masked_table.write(args.output, format=args.o_format, overwrite=True)
+    n_input, n_output = mask_file(
+        args.input, args.output, args.bounds, args.ra, args.dec,
+        args.i_format, args.o_format, args.columns, args.chunk_size,
+        compression)
+    if n_output == 0:
+        sys.exit("ERROR: no data found within RA/DEC limits")
+    print("removed %d / %d rows" % (n_input - n_output, n_input))
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+import argparse
+import sys
+
+import numpy as np
+from astropy.table import Column
+
+import healpix
+from catalogue_io import (
+    iter_chunks, open_writer, read_colnames, table_format)
+from column_store import ColumnStore
+
+
+def healpix_index(ra_data, dec_data, nside, name=None):
+    """
+    Compute the NESTED HEALPix index of objects as table column.
+
+    Parameters
+    ----------
+    ra_data : array_like
+        Right ascension of the objects in degrees.
+    dec_data : array_like
+        Declination of the objects in degrees.
+    nside : int
+        HEALPix resolution parameter (power of 2).
+    name : str
+        Name of the column (default: healpix.index_column(nside)).
+
+    Returns
+    -------
+    column : astropy.table.Column
+        Pixel indices of the objects.
+    """
+    if name is None:
+        name = healpix.index_column(nside)
+    return Column(
+        healpix.ang2pix(nside, ra_data, dec_data), name=name,
+        description="NESTED HEALPix index, nside=%d" % nside)
+
+
+def add_healpix_index(
+        input, output, ra, dec, nside, name=None, i_format=None,
+        o_format=None, chunk_size=1000000, compression="gzip"):
+    """
+    Add a NESTED HEALPix index column to a catalogue, which is processed in
+    chunks of rows. Column stores are updated in place if no output is given,
+    otherwise the catalogue is copied to the output with the new column.
+
+    Parameters
+    ----------
+    input : str
+        File path of the input catalogue.
+    output : str
+        File path of the output catalogue (FITS, HDF5 or column store), None
+        to add the column to an input column store.
+    ra : str
+        Column name of the right ascension.
+    dec : str
+        Column name of the declination.
+    nside : int
+        HEALPix resolution parameter (power of 2).
+    name : str
+        Name of the new column (default: healpix.index_column(nside)).
+    i_format : str
+        Format of the input catalogue (see catalogue_io.table_format).
+    o_format : str
+        Format of the output catalogue (see catalogue_io.table_format).
+    chunk_size : int
+        Number of rows processed at once.
+    compression : str
+        Compression filter of HDF5 output ("gzip", "lzf" or None).
+
+    Returns
+    -------
+    counts : array_like
+        Number of objects per pixel.
+    """
+    healpix.check_nside(nside)
+    if name is None:
+        name = healpix.index_column(nside)
+    counts = np.zeros(healpix.npix(nside), dtype=np.int64)
+
+    def index_chunks(columns):
+        for offset, chunk in iter_chunks(
+                input, i_format, columns, chunk_size):
+            column = healpix_index(chunk[ra], chunk[dec], nside, name)
+            counts[:] += np.bincount(column, minlength=len(counts))
+            yield chunk, column
+
+    if output is None:
+        if table_format(input, i_format) != "columns":
+            raise ValueError(
+                "an output is required unless the input is a column store")
+        ColumnStore(input).add_column_chunks(
+            name, (column for chunk, column in index_chunks([ra, dec])),
+            description="NESTED HEALPix index, nside=%d" % nside,
+            provenance={"stage": "healpix", "nside": nside}, overwrite=True)
+        return counts
+    if table_format(output, o_format) == "hdf5":
+        writer = open_writer(
+            output, o_format, background=True, compression=compression)
+    else:
+        writer = open_writer(output, o_format, background=True)
+    # an existing index column is replaced
+    columns = [col for col in read_colnames(input, i_format) if col != name]
+    try:
+        for chunk, column in index_chunks(columns):
+            chunk[name] = column
+            writer.write(chunk)
+    finally:
+        writer.close()
+    return counts
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description='Add a NESTED HEALPix pixel index column to a catalogue, '
+                    'such that spatial lookups (footprint masks, pointing '
+                    'assignment, density maps) become integer operations. '
+                    'The catalogue is processed in chunks.')
+    parser.add_argument(
+        '-i', '--input', required=True, help='file path of input data table')
+    parser.add_argument(
+        '--i-format',
+        help='format of the input table: fits, hdf5 or columns (column '
+             'store) (default: guessed from the file extension)')
+    parser.add_argument(
+        '--ra', required=True, help='column name of RA')
+    parser.add_argument(
+        '--dec', required=True, help='column name of DEC')
+    parser.add_argument(
+        '--nside', type=int, default=1024,
+        help='HEALPix resolution parameter, a power of 2 '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--name',
+        help='name of the index column (default: healpix_<nside>)')
+    parser.add_argument(
+        '-o', '--output',
+        help='file path of output table (default: add the column to the '
+             'input column store)')
+    parser.add_argument(
+        '--o-format',
+        help='format of the output table: fits, hdf5 or columns (column '
+             'store) (default: guessed from the file extension)')
+    parser.add_argument(
+        '--chunk-size', type=int, default=1000000,
+        help='number of rows processed at once (default: %(default)s)')
+    parser.add_argument(
+        '--compression', default='gzip', choices=('gzip', 'lzf', 'none'),
+        help='compression filter of HDF5 output tables '
+             '(default: %(default)s)')
+    args = parser.parse_args()
+
+    try:
+        healpix.check_nside(args.nside)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.output is None and table_format(
+            args.input, args.i_format) != "columns":
+        parser.error("--output is required unless the input is a column store")
+
+    print("compute HEALPix index with nside=%d" % args.nside)
+    counts = add_healpix_index(
+        args.input, args.output, args.ra, args.dec, args.nside, args.name,
+        args.i_format, args.o_format, args.chunk_size,
+        None if args.compression == 'none' else args.compression)
+    if counts.sum() == 0:
+        sys.exit("ERROR: input table is empty")
+    print("%d objects in %d / %d pixels" % (
+        counts.sum(), np.count_nonzero(counts), len(counts)))
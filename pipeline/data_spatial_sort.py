@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import shutil
+import sys
+
+import numpy as np
+
+import healpix
+from catalogue_io import (
+    count_rows, iter_chunks, open_writer, read_colnames, table_format)
+from column_store import ColumnStore
+from spatial_index import SpatialIndex, index_path
+
+
+def sort_catalogue(
+        input, output, ra, dec, nside=256, i_format=None, o_format=None,
+        chunk_size=1000000, compression="gzip", index_column=None):
+    """
+    Sort a catalogue by the NESTED HEALPix index of the objects and write
+    the sidecar row range index of the output (see spatial_index). The NESTED
+    scheme is a Z-order (Morton) curve within each base pixel, such that
+    compact regions map to few contiguous row ranges.
+
+    The sort is a two-pass counting sort over chunks of rows: the first pass
+    counts the objects per pixel, the second pass scatters each chunk to its
+    final rows in a preallocated column store. Objects within a pixel keep
+    their input order. FITS and HDF5 outputs are copied from a temporary
+    column store next to the output.
+
+    Parameters
+    ----------
+    input : str
+        File path of the input catalogue.
+    output : str
+        File path of the output catalogue (FITS, HDF5 or column store).
+    ra : str
+        Column name of the right ascension.
+    dec : str
+        Column name of the declination.
+    nside : int
+        HEALPix resolution parameter (power of 2) of the sorting, which sets
+        the granularity of the row ranges.
+    i_format : str
+        Format of the input catalogue (see catalogue_io.table_format).
+    o_format : str
+        Format of the output catalogue (see catalogue_io.table_format).
+    chunk_size : int
+        Number of rows processed at once.
+    compression : str
+        Compression filter of HDF5 output ("gzip", "lzf" or None).
+    index_column : str
+        Name of an optional pixel index column added to the output.
+
+    Returns
+    -------
+    index : spatial_index.SpatialIndex
+        Row range index of the output.
+    """
+    healpix.check_nside(nside)
+    o_format = table_format(output, o_format)
+    nrows = count_rows(input, i_format)
+    if nrows == 0:
+        raise ValueError("input table is empty")
+    columns = [
+        col for col in read_colnames(input, i_format) if col != index_column]
+
+    # pass 1: objects per pixel
+    counts = np.zeros(healpix.npix(nside), dtype=np.int64)
+    for offset, chunk in iter_chunks(
+            input, i_format, [ra, dec], chunk_size):
+        counts += np.bincount(
+            healpix.ang2pix(nside, chunk[ra].data, chunk[dec].data),
+            minlength=len(counts))
+    index = SpatialIndex(nside, counts)
+
+    # pass 2: scatter the chunks into the preallocated columns
+    if o_format == "columns":
+        store_path = output
+    else:
+        store_path = output.rstrip(os.sep) + ".sorting.columns"
+    if os.path.exists(store_path):
+        shutil.rmtree(store_path)
+    store = ColumnStore(store_path, create=True)
+    try:
+        offset, first = next(iter_chunks(input, i_format, columns, 1))
+        for col in columns:
+            data = first[col]
+            store.allocate_column(
+                col, data.dtype, data.shape[1:], nrows=nrows,
+                unit=None if data.unit is None else str(data.unit),
+                description=data.description,
+                provenance={"stage": "sort", "nside": nside})
+        if index_column is not None:
+            store.allocate_column(
+                index_column, np.int64, nrows=nrows,
+                description="NESTED HEALPix index, nside=%d" % nside,
+                provenance={"stage": "sort", "nside": nside})
+        mapped = {
+            col: store.column(col, mode="r+").data for col in store.colnames}
+        # next free row of each pixel
+        fill = index.offsets[:-1].copy()
+        for offset, chunk in iter_chunks(
+                input, i_format, columns, chunk_size):
+            pix = healpix.ang2pix(nside, chunk[ra].data, chunk[dec].data)
+            order = np.argsort(pix, kind="stable")
+            spix = pix[order]
+            # rank of each object among the objects of its pixel
+            rank = np.arange(len(spix)) - np.searchsorted(spix, spix)
+            rows = fill[spix] + rank
+            fill += np.bincount(pix, minlength=len(fill))
+            for col in columns:
+                mapped[col][rows] = chunk[col].data[order]
+            if index_column is not None:
+                mapped[index_column][rows] = spix
+        # unmap the columns, the shared mappings are written back to the files
+        del mapped
+        if o_format != "columns":
+            if o_format == "hdf5":
+                writer = open_writer(
+                    output, o_format, background=True,
+                    compression=compression)
+            else:
+                writer = open_writer(output, o_format, background=True)
+            try:
+                for offset, chunk in iter_chunks(
+                        store_path, "columns", chunk_size=chunk_size):
+                    writer.write(chunk)
+            finally:
+                writer.close()
+    finally:
+        if o_format != "columns":
+            shutil.rmtree(store_path)
+    index.save(index_path(output))
+    return index
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description='Sort a catalogue by the NESTED HEALPix index of the '
+                    'objects (a Z-order curve on the sky) and write a sidecar '
+                    'index of the row range of each pixel. Masking and '
+                    'loading of sky regions (data_hdf5_mask.py, the '
+                    'photometry pipeline) then only read the rows of the '
+                    'overlapping pixels. The catalogue is processed in '
+                    'chunks.')
+    parser.add_argument(
+        '-i', '--input', required=True, help='file path of input data table')
+    parser.add_argument(
+        '--i-format',
+        help='format of the input table: fits, hdf5 or columns (column '
+             'store) (default: guessed from the file extension)')
+    parser.add_argument(
+        '--ra', required=True, help='column name of RA')
+    parser.add_argument(
+        '--dec', required=True, help='column name of DEC')
+    parser.add_argument(
+        '--nside', type=int, default=256,
+        help='HEALPix resolution parameter of the sorting, a power of 2 '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--add-index-column', nargs='?', const='', metavar='NAME',
+        help='add the pixel index as column to the output (default name: '
+             'healpix_<nside>)')
+    parser.add_argument(
+        '-o', '--output', required=True, help='file path of output table')
+    parser.add_argument(
+        '--o-format',
+        help='format of the output table: fits, hdf5 or columns (column '
+             'store) (default: guessed from the file extension)')
+    parser.add_argument(
+        '--chunk-size', type=int, default=1000000,
+        help='number of rows processed at once (default: %(default)s)')
+    parser.add_argument(
+        '--compression', default='gzip', choices=('gzip', 'lzf', 'none'),
+        help='compression filter of HDF5 output tables '
+             '(default: %(default)s)')
+    args = parser.parse_args()
+
+    try:
+        healpix.check_nside(args.nside)
+    except ValueError as e:
+        parser.error(str(e))
+    if os.path.abspath(args.input) == os.path.abspath(args.output):
+        parser.error("the output must differ from the input")
+    index_column = args.add_index_column
+    if index_column == '':
+        index_column = healpix.index_column(args.nside)
+
+    print("sort %s with nside=%d" % (args.input, args.nside))
+    try:
+        index = sort_catalogue(
+            args.input, args.output, args.ra, args.dec, args.nside,
+            args.i_format, args.o_format, args.chunk_size,
+            None if args.compression == 'none' else args.compression,
+            index_column)
+    except ValueError as e:
+        sys.exit("ERROR: %s" % e)
+    print("%d objects in %d / %d pixels, index written to: %s" % (
+        index.nrows, np.count_nonzero(index.counts), len(index.counts),
+        index_path(args.output)))
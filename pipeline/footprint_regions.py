@@ -0,0 +1,422 @@
+###############################################################################
+#                                                                             #
+#   Survey footprints as named sky regions: RA/DEC rectangles, convex         #
+#   spherical polygons and lists of HEALPix pixels. RegionMask evaluates the  #
+#   membership of objects in many regions in a single pass, using a coarse    #
+#   HEALPix index to skip the exact test for objects far from a region.       #
+#                                                                             #
+###############################################################################
+
+import os
+
+import numpy as np
+
+import healpix
+
+
+def mask_ra_dec(ra_data, dec_data, RAmin, RAmax, DECmin, DECmax):
+    """
+    Compute a mask that selects objects within a right ascension /
+    declination bound. If RAmin > RAmax, the bound wraps around RA = 0.
+
+    Parameters
+    ----------
+    ra_data : array_like
+        Right ascension of the objects in degrees.
+    dec_data : array_like
+        Declination of the objects in degrees.
+    RAmin : float
+        Minimum right ascension of the bounds.
+    RAmax : float
+        Maximum right ascension of the bounds.
+    DECmin : float
+        Minimum declination of the bounds.
+    DECmax : float
+        Maximum declination of the bounds.
+
+    Returns
+    -------
+    mask : boolean array_like
+        Whether an object lies within the bounds.
+    """
+    if RAmax >= RAmin:
+        mask = (  # mask data to bounds
+            (ra_data >= RAmin) & (ra_data < RAmax) &
+            (dec_data >= DECmin) & (dec_data < DECmax))
+    else:
+        mask = (  # mask data to bounds
+            ((ra_data >= RAmin) | (ra_data < RAmax)) &
+            (dec_data >= DECmin) & (dec_data < DECmax))
+    return mask
+
+
+def radec_to_vector(ra, dec):
+    """
+    Convert sky coordinates to unit vectors.
+
+    Parameters
+    ----------
+    ra : array_like
+        Right ascension in degrees.
+    dec : array_like
+        Declination in degrees.
+
+    Returns
+    -------
+    vectors : array_like
+        Cartesian unit vectors with shape (..., 3).
+    """
+    ra = np.radians(ra)
+    dec = np.radians(dec)
+    cos_dec = np.cos(dec)
+    return np.stack(
+        [cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)], axis=-1)
+
+
+class Rectangle(object):
+    """
+    Region within RA/DEC bounds, wrapping around RA = 0 if RAmin > RAmax
+    (see mask_ra_dec).
+
+    Parameters
+    ----------
+    name : str
+        Name of the region.
+    RAmin, RAmax, DECmin, DECmax : float
+        Bounds of the region in degrees.
+    """
+
+    def __init__(self, name, RAmin, RAmax, DECmin, DECmax):
+        self.name = name
+        self.bounds = (
+            float(RAmin), float(RAmax), float(DECmin), float(DECmax))
+
+    def contains(self, ra, dec):
+        """
+        Whether objects lie within the region.
+        """
+        return mask_ra_dec(ra, dec, *self.bounds)
+
+    def coverage(self, nside):
+        """
+        Classify the pixels of a NESTED HEALPix map by their overlap with the
+        region.
+
+        Parameters
+        ----------
+        nside : int
+            HEALPix resolution parameter.
+
+        Returns
+        -------
+        maybe : array_like
+            Pixels that may overlap with the region.
+        inside : array_like
+            Pixels that lie entirely within the region.
+        """
+        RAmin, RAmax, DECmin, DECmax = self.bounds
+        ra, dec = healpix.pix2ang(nside, np.arange(healpix.npix(nside)))
+        radius = np.degrees(healpix.max_pixrad(nside))
+        # half width in RA of a circle with the pixel radius
+        dec_max = np.abs(dec) + radius
+        polar = dec_max >= 89.9
+        dRA = radius / np.cos(np.radians(np.minimum(dec_max, 89.9)))
+        # offset of the pixel centre from RAmin along the RA interval
+        width = RAmax - RAmin
+        if RAmin > RAmax:
+            width += 360.0
+        offset = np.mod(ra - RAmin, 360.0)
+        if width >= 360.0:
+            ra_maybe = ra_inside = np.ones(len(ra), dtype="bool")
+        else:
+            ra_maybe = polar | (offset < width + dRA) | (
+                offset > 360.0 - dRA)
+            ra_inside = ~polar & (offset >= dRA) & (offset < width - dRA)
+        maybe = ra_maybe & (dec >= DECmin - radius) & (dec < DECmax + radius)
+        inside = ra_inside & (dec >= DECmin + radius) & (
+            dec < DECmax - radius)
+        return maybe, inside
+
+
+class Polygon(object):
+    """
+    Convex spherical polygon with great circle edges. Non-convex regions can
+    be composed of several convex polygons with the same name.
+
+    Parameters
+    ----------
+    name : str
+        Name of the region.
+    ra : array_like
+        Right ascension of the vertices in degrees, in order along the
+        boundary (either orientation).
+    dec : array_like
+        Declination of the vertices in degrees.
+    """
+
+    def __init__(self, name, ra, dec):
+        self.name = name
+        if len(ra) < 3 or len(ra) != len(dec):
+            raise ValueError(
+                "polygon '%s' requires at least three vertices" % name)
+        vertices = radec_to_vector(
+            np.asarray(ra, dtype=np.float64),
+            np.asarray(dec, dtype=np.float64))
+        # normals of the edge planes, pointing into the polygon
+        normals = np.cross(vertices, np.roll(vertices, -1, axis=0))
+        norm = np.linalg.norm(normals, axis=1)
+        if np.any(norm == 0.0):
+            raise ValueError(
+                "polygon '%s' has repeated or antipodal vertices" % name)
+        normals /= norm[:, np.newaxis]
+        if np.dot(normals[0], vertices.sum(axis=0)) < 0.0:
+            normals *= -1.0
+        if np.any(np.dot(vertices, normals.T) < -1e-12):
+            raise ValueError(
+                "polygon '%s' is not convex, split it into convex polygons "
+                "with the same name" % name)
+        self.vertices = vertices
+        self.normals = normals
+
+    def _distance(self, vectors):
+        # sine of the smallest angular distance to the edge planes,
+        # negative outside the polygon
+        return np.min(np.dot(vectors, self.normals.T), axis=-1)
+
+    def contains(self, ra, dec):
+        """
+        Whether objects lie within the region.
+        """
+        return self._distance(radec_to_vector(ra, dec)) >= 0.0
+
+    def coverage(self, nside):
+        """
+        Classify the pixels of a NESTED HEALPix map by their overlap with the
+        region (see Rectangle.coverage).
+        """
+        centres = radec_to_vector(
+            *healpix.pix2ang(nside, np.arange(healpix.npix(nside))))
+        distance = self._distance(centres)
+        margin = np.sin(healpix.max_pixrad(nside))
+        return distance >= -margin, distance >= margin
+
+
+class HealpixPixels(object):
+    """
+    Region defined by a list of NESTED HEALPix pixels.
+
+    Parameters
+    ----------
+    name : str
+        Name of the region.
+    nside : int
+        HEALPix resolution parameter of the pixels.
+    pixels : array_like
+        Pixel indices.
+    """
+
+    def __init__(self, name, nside, pixels):
+        self.name = name
+        self.nside = int(nside)
+        self.order = healpix.check_nside(self.nside)
+        self.pixels = np.unique(np.asarray(pixels, dtype=np.int64))
+        if len(self.pixels) > 0 and (
+                self.pixels[0] < 0 or
+                self.pixels[-1] >= healpix.npix(self.nside)):
+            raise ValueError(
+                "region '%s' contains invalid pixels for nside=%d" % (
+                    name, self.nside))
+
+    def contains(self, ra, dec):
+        """
+        Whether objects lie within the region.
+        """
+        return self.contains_pixels(healpix.ang2pix(self.nside, ra, dec))
+
+    def contains_pixels(self, pix):
+        """
+        Whether objects with given NESTED pixel indices at the resolution of
+        the region lie within the region.
+        """
+        idx = np.searchsorted(self.pixels, pix)
+        idx[idx == len(self.pixels)] = 0
+        return self.pixels[idx] == pix if len(self.pixels) > 0 else (
+            np.zeros(len(pix), dtype="bool"))
+
+    def coverage(self, nside):
+        """
+        Classify the pixels of a NESTED HEALPix map by their overlap with the
+        region (see Rectangle.coverage), exact due to the nested hierarchy.
+        """
+        shift = 2 * (self.order - healpix.check_nside(nside))
+        if shift >= 0:  # count the region pixels within each coarse pixel
+            counts = np.bincount(
+                self.pixels >> shift, minlength=healpix.npix(nside))
+            return counts > 0, counts == (1 << shift)
+        inside = np.zeros(healpix.npix(nside), dtype="bool")
+        children = np.arange(1 << -shift)
+        inside[(self.pixels[:, np.newaxis] << -shift) + children] = True
+        return inside, inside
+
+
+def read_regions(path, names=None):
+    """
+    Read sky regions from a footprint file (see
+    mocks_generate_footprint.register_footprint) or a region file. Lines of
+    a footprint file define rectangles:
+        RAmin RAmax DECmin DECmax AREA NAME
+    Lines of a region file start with the region type:
+        rect NAME RAmin RAmax DECmin DECmax
+        poly NAME RA1 DEC1 RA2 DEC2 RA3 DEC3 [...]
+        healpix NAME NSIDE PIX1 [PIX2 ...]
+        healpix NAME NSIDE @pixel_file
+    where the pixel file is a text file with NESTED pixel indices (relative to
+    the region file). Repeated names define a union of regions.
+
+    Parameters
+    ----------
+    path : str
+        File path of the footprint or region file.
+    names : list of str
+        Only read these regions (default: all).
+
+    Returns
+    -------
+    regions : list
+        Rectangle, Polygon and HealpixPixels instances.
+    """
+    regions = []
+    with open(path) as f:
+        for i, line in enumerate(f, 1):
+            line = line.split("#")[0].strip()
+            if len(line) == 0:
+                continue
+            tokens = line.split()
+            try:
+                if tokens[0] == "rect":
+                    region = Rectangle(tokens[1], *map(float, tokens[2:6]))
+                    if len(tokens) != 6:
+                        raise ValueError("expected four bounds")
+                elif tokens[0] == "poly":
+                    coords = np.array(tokens[2:], dtype=np.float64)
+                    if len(coords) % 2 != 0:
+                        raise ValueError("expected RA/DEC pairs")
+                    region = Polygon(tokens[1], coords[0::2], coords[1::2])
+                elif tokens[0] == "healpix":
+                    if tokens[3].startswith("@"):
+                        pixels = np.loadtxt(os.path.join(
+                            os.path.dirname(path), tokens[3][1:]),
+                            dtype=np.int64, ndmin=1)
+                    else:
+                        pixels = np.array(tokens[3:], dtype=np.int64)
+                    region = HealpixPixels(tokens[1], int(tokens[2]), pixels)
+                else:  # footprint file
+                    if len(tokens) != 6:
+                        raise ValueError("expected bounds, area and name")
+                    region = Rectangle(tokens[5], *map(float, tokens[:4]))
+            except (IndexError, ValueError) as e:
+                raise ValueError(
+                    "%s:%d: invalid region definition: %s" % (path, i, e))
+            if names is None or region.name in names:
+                regions.append(region)
+    if names is not None:
+        missing = set(names) - set(region.name for region in regions)
+        if len(missing) > 0:
+            raise KeyError(
+                "regions not found in %s: %s" % (
+                    path, ", ".join(sorted(missing))))
+    return regions
+
+
+class RegionMask(object):
+    """
+    Evaluates the membership of objects in a set of named regions. A coarse
+    HEALPix map lists for each pixel the regions that overlap with it or
+    contain it entirely, only objects in pixels that overlap partially with a
+    region are tested exactly.
+
+    Parameters
+    ----------
+    regions : list
+        Rectangle, Polygon and HealpixPixels instances, regions with the same
+        name are combined.
+    nside : int
+        HEALPix resolution of the coarse index (default: 64, ~0.9 deg).
+    """
+
+    def __init__(self, regions, nside=64):
+        if len(regions) == 0:
+            raise ValueError("no regions given")
+        self.regions = list(regions)
+        self.nside = nside
+        self.names = []
+        for region in self.regions:
+            if region.name not in self.names:
+                self.names.append(region.name)
+        coverage = [region.coverage(nside) for region in self.regions]
+        self._maybe = [maybe for maybe, inside in coverage]
+        self._inside = [inside for maybe, inside in coverage]
+        self._any = np.any(self._maybe, axis=0)
+
+    def coverage(self, nside):
+        """
+        Classify the pixels of a NESTED HEALPix map by their overlap with any
+        of the regions (see Rectangle.coverage).
+        """
+        if nside == self.nside:
+            return self._any, np.any(self._inside, axis=0)
+        coverage = [region.coverage(nside) for region in self.regions]
+        return (
+            np.any([maybe for maybe, inside in coverage], axis=0),
+            np.any([inside for maybe, inside in coverage], axis=0))
+
+    def contains(self, ra, dec, pix=None, nside=None):
+        """
+        Whether objects lie within each of the regions. A precomputed NESTED
+        HEALPix index of the objects (see data_healpix_index.py) replaces the
+        computation of the coarse index and the test of HEALPix regions if
+        its resolution is sufficient.
+
+        Parameters
+        ----------
+        ra : array_like
+            Right ascension in degrees.
+        dec : array_like
+            Declination in degrees.
+        pix : array_like
+            NESTED HEALPix index of the objects (optional).
+        nside : int
+            HEALPix resolution parameter of pix.
+
+        Returns
+        -------
+        masks : dict
+            Boolean mask of members for each region name.
+        """
+        ra = np.asarray(ra)
+        dec = np.asarray(dec)
+        masks = {name: np.zeros(len(ra), dtype="bool") for name in self.names}
+        if pix is not None and nside >= self.nside:
+            cells = healpix.degrade(pix, nside, self.nside)
+        else:
+            pix = None
+            cells = healpix.ang2pix(self.nside, ra, dec)
+        # reject objects far from all regions
+        candidates = np.flatnonzero(self._any[cells])
+        cells = cells[candidates]
+        ra = ra[candidates]
+        dec = dec[candidates]
+        if pix is not None:
+            pix = np.asarray(pix)[candidates]
+        for region, maybe, inside in zip(
+                self.regions, self._maybe, self._inside):
+            member = inside[cells]
+            test = np.flatnonzero(maybe[cells] & ~member)
+            if (pix is not None and isinstance(region, HealpixPixels) and
+                    nside >= region.nside):
+                member[test] = region.contains_pixels(
+                    healpix.degrade(pix[test], nside, region.nside))
+            else:
+                member[test] = region.contains(ra[test], dec[test])
+            masks[region.name][candidates] |= member
+        return masks
@@ -0,0 +1,393 @@
+###############################################################################
+#                                                                             #
+#   Equal area tiling of survey footprints. Any number of RA/DEC rectangles   #
+#   is split into declination bands with an adaptive number of tiles per      #
+#   band, such that all tiles of a rectangle have the same area. Tiles are    #
+#   collected in a tile table that is stored as binary numpy file next to     #
+#   the text pointings file and assigns objects to tiles with binary search.  #
+#                                                                             #
+###############################################################################
+
+import os
+
+import numpy as np
+
+from mocks_generate_footprint import (
+    footprint_area, next_DEC, pointing_name, read_pointings_file,
+    write_pointings_file)
+
+
+# data type of the rows of the tile table (without the name field)
+TILE_FIELDS = [
+    ("region", np.int32), ("band", np.int32), ("RAmin", np.float64),
+    ("RAmax", np.float64), ("DECmin", np.float64), ("DECmax", np.float64),
+    ("area", np.float64)]
+
+
+def tile_table_path(pointings_file):
+    """
+    File path of the binary tile table next to a text pointings file, e.g.
+    pointings_KV450.txt -> pointings_KV450.npy.
+    """
+    return os.path.splitext(pointings_file)[0] + ".npy"
+
+
+def _group_index(counts):
+    # index of each element within its group for consecutive groups of the
+    # given sizes, e.g. [2, 3] -> [0, 1, 0, 1, 2]
+    counts = np.asarray(counts, dtype=np.int64)
+    starts = np.cumsum(counts) - counts
+    return np.arange(counts.sum()) - np.repeat(starts, counts)
+
+
+def tile_bands(bounds, n_bands, n_tiles):
+    """
+    Split RA/DEC rectangles into declination bands and each band into tiles
+    of equal RA width. The band edges are chosen such that all tiles of a
+    rectangle have the same area, i.e. the area of a band is proportional to
+    its number of tiles. All rectangles are processed at once.
+    Parameters
+    ----------
+    bounds : array_like
+        Bounds (RAmin, RAmax, DECmin, DECmax) of the rectangles in degrees,
+        shape (n_regions, 4). Rectangles with RAmin > RAmax wrap around
+        RA = 0.
+    n_bands : array_like
+        Number of declination bands of each rectangle.
+    n_tiles : array_like
+        Number of tiles of each band, in the order of the rectangles and
+        from low to high declination.
+    Returns
+    -------
+    tiles : numpy.ndarray
+        Structured array with region index, band index, bounds and area of
+        each tile (see TILE_FIELDS), ordered by region, band and RA.
+    """
+    bounds = np.atleast_2d(np.asarray(bounds, dtype=np.float64))
+    RAmin, RAmax, DECmin, DECmax = bounds.T
+    n_bands = np.broadcast_to(n_bands, len(bounds)).astype(np.int64)
+    n_tiles = np.asarray(n_tiles, dtype=np.int64)
+    if np.any(n_bands < 1) or np.any(n_tiles < 1):
+        raise ValueError("the numbers of bands and tiles must be positive")
+    if len(n_tiles) != n_bands.sum():
+        raise ValueError(
+            "expected tile numbers for %d bands, got %d" % (
+                n_bands.sum(), len(n_tiles)))
+    dRA = np.where(RAmin > RAmax, RAmax - RAmin + 360.0, RAmax - RAmin)
+    # bands: tile area of the region and the number of tiles below the band
+    region = np.repeat(np.arange(len(bounds)), n_bands)
+    band = _group_index(n_bands)
+    region_tiles = np.bincount(
+        region, weights=n_tiles, minlength=len(bounds)).astype(np.int64)
+    tile_area = footprint_area(RAmin, RAmax, DECmin, DECmax) / region_tiles
+    n_below = np.cumsum(n_tiles) - n_tiles - np.repeat(
+        np.cumsum(region_tiles) - region_tiles, n_bands)
+    band_DECmin = next_DEC(
+        tile_area[region] * n_below, RAmin[region], RAmax[region],
+        DECmin[region])
+    band_DECmax = next_DEC(
+        tile_area[region] * (n_below + n_tiles), RAmin[region],
+        RAmax[region], DECmin[region])
+    # avoid rounding errors at the rectangle edges
+    band_DECmin[band == 0] = DECmin
+    band_DECmax[band == n_bands[region] - 1] = DECmax
+    # tiles
+    tile_band = np.repeat(np.arange(len(band)), n_tiles)
+    tile_region = region[tile_band]
+    i_ra = _group_index(n_tiles)
+    width = dRA[tile_region] / n_tiles[tile_band]
+    tiles = np.empty(len(tile_band), dtype=TILE_FIELDS)
+    tiles["region"] = tile_region
+    tiles["band"] = band[tile_band]
+    tiles["RAmin"] = np.mod(RAmin[tile_region] + i_ra * width, 360.0)
+    tiles["RAmax"] = np.mod(RAmin[tile_region] + (i_ra + 1) * width, 360.0)
+    last = i_ra == n_tiles[tile_band] - 1
+    tiles["RAmax"][last] = RAmax[tile_region[last]]
+    tiles["DECmin"] = band_DECmin[tile_band]
+    tiles["DECmax"] = band_DECmax[tile_band]
+    tiles["area"] = tile_area[tile_region]
+    return tiles
+
+
+def adaptive_tiles(bounds, tile_area):
+    """
+    Compute the number of bands and tiles per band of an equal area tiling
+    (see tile_bands) with approximately square tiles of a target area. The
+    number of tiles per band follows the RA extent of the band, i.e. it
+    decreases towards the poles.
+    Parameters
+    ----------
+    bounds : array_like
+        Bounds (RAmin, RAmax, DECmin, DECmax) of the rectangles in degrees,
+        shape (n_regions, 4).
+    tile_area : float
+        Target area of the tiles in square degrees, the actual area differs
+        slightly such that each rectangle is covered by an integer number of
+        tiles.
+    Returns
+    -------
+    n_bands : array_like
+        Number of declination bands of each rectangle.
+    n_tiles : array_like
+        Number of tiles of each band.
+    """
+    if tile_area <= 0.0:
+        raise ValueError("the tile area must be positive")
+    bounds = np.atleast_2d(np.asarray(bounds, dtype=np.float64))
+    RAmin, RAmax, DECmin, DECmax = bounds.T
+    side = np.sqrt(tile_area)
+    n_bands = np.maximum(1, np.round((DECmax - DECmin) / side)).astype(
+        np.int64)
+    # bands of equal height, the final band edges follow from the number of
+    # tiles per band
+    region = np.repeat(np.arange(len(bounds)), n_bands)
+    height = (DECmax - DECmin) / n_bands
+    band_DECmin = DECmin[region] + _group_index(n_bands) * height[region]
+    band_area = footprint_area(
+        RAmin[region], RAmax[region], band_DECmin,
+        band_DECmin + height[region])
+    n_tiles = np.maximum(1, np.round(band_area / tile_area)).astype(np.int64)
+    return n_bands, n_tiles
+
+
+class TileTable(object):
+    """
+    Table of the tiles (pointings) of a footprint.
+    Parameters
+    ----------
+    tiles : numpy.ndarray
+        Structured array with the fields of TILE_FIELDS and optionally the
+        tile names (field name).
+    """
+
+    def __init__(self, tiles):
+        self.tiles = tiles
+        self._lookup = None
+
+    def __len__(self):
+        return len(self.tiles)
+
+    @property
+    def names(self):
+        return list(self.tiles["name"])
+
+    @property
+    def bound_tuples(self):
+        """
+        Bounds (RAmin, RAmax, DECmin, DECmax) of each tile.
+        """
+        return [
+            tuple(float(b) for b in row) for row in
+            self.tiles[["RAmin", "RAmax", "DECmin", "DECmax"]].tolist()]
+
+    @classmethod
+    def from_tiles(cls, tiles, prefixes):
+        """
+        Create a table from the output of tile_bands, the tiles are named
+        after their centre (see mocks_generate_footprint.pointing_name).
+        Parameters
+        ----------
+        tiles : numpy.ndarray
+            Tiles created by tile_bands.
+        prefixes : list of str
+            Name prefix (e.g. survey name) of each region.
+        """
+        names = [
+            pointing_name(prefixes[region], *bounds) for region, *bounds in
+            tiles[["region", "RAmin", "RAmax", "DECmin", "DECmax"]].tolist()]
+        name_len = max([len(name) for name in names] + [1])
+        table = np.empty(
+            len(tiles), dtype=[("name", "U%d" % name_len), *TILE_FIELDS])
+        for field, dtype in TILE_FIELDS:
+            table[field] = tiles[field]
+        table["name"] = names
+        return cls(table)
+
+    @classmethod
+    def from_bounds(cls, bound_tuples, names=None):
+        """
+        Create a table from the bounds of the tiles, e.g. from a pointings
+        file. Tiles with the same DEC bounds form a band.
+        Parameters
+        ----------
+        bound_tuples : list of tuple
+            Bounds (RAmin, RAmax, DECmin, DECmax) of each tile.
+        names : list of str
+            Names of the tiles (optional).
+        """
+        bounds = np.asarray(bound_tuples, dtype=np.float64).reshape(-1, 4)
+        if names is None:
+            names = [str(i) for i in range(len(bounds))]
+        table = np.empty(len(bounds), dtype=[
+            ("name", "U%d" % max([len(n) for n in names] + [1])),
+            *TILE_FIELDS])
+        table["name"] = names
+        table["RAmin"], table["RAmax"], table["DECmin"], table["DECmax"] = \
+            bounds.T
+        table["area"] = footprint_area(*bounds.T)
+        # bands are enumerated from low to high declination
+        dec_bounds, band = np.unique(
+            bounds[:, 2:], axis=0, return_inverse=True)
+        table["band"] = band.ravel()
+        table["region"] = 0
+        return cls(table)
+
+    @classmethod
+    def read(cls, pointings_file):
+        """
+        Read the tiles of a pointings file, from the binary tile table if it
+        exists and is not older than the pointings file.
+        """
+        path = tile_table_path(pointings_file)
+        if os.path.exists(path) and (
+                not os.path.exists(pointings_file) or
+                os.path.getmtime(path) >= os.path.getmtime(pointings_file)):
+            return cls(np.load(path))
+        names, bound_tuples = read_pointings_file(pointings_file)
+        return cls.from_bounds(bound_tuples, names)
+
+    def save(self, path):
+        """
+        Write the table as binary numpy file (see tile_table_path).
+        """
+        with open(path, "wb") as f:
+            np.save(f, self.tiles)
+
+    def _build_lookup(self):
+        # Bands are grouped into layers of non-overlapping declination
+        # ranges (one layer if the regions do not overlap in declination),
+        # each layer is searched with a single binary search. The RA
+        # intervals of the tiles, split at RA = 0, are sorted by band and RA
+        # such that a second binary search finds the tile.
+        tiles = self.tiles
+        band_keys, band_id = np.unique(
+            tiles[["region", "band"]], return_inverse=True)
+        band_id = band_id.ravel()
+        n_bands = len(band_keys)
+        band_DECmin = np.zeros(n_bands)
+        band_DECmax = np.zeros(n_bands)
+        band_DECmin[band_id] = tiles["DECmin"]
+        band_DECmax[band_id] = tiles["DECmax"]
+        layers = []  # band ids and DEC edges of each layer
+        for b in np.argsort(band_DECmin, kind="stable"):
+            for layer in layers:
+                if band_DECmin[b] >= band_DECmax[layer[-1]]:
+                    layer.append(b)
+                    break
+            else:
+                layers.append([b])
+        self._layers = [
+            (np.array(layer), np.append(
+                band_DECmin[layer], band_DECmax[layer[-1]]))
+            for layer in layers]
+        # RA intervals with offset 360 * band id
+        wraps = tiles["RAmin"] > tiles["RAmax"]
+        starts = np.concatenate([
+            tiles["RAmin"], np.zeros(np.count_nonzero(wraps))])
+        stops = np.concatenate([
+            np.where(wraps, 360.0, tiles["RAmax"]), tiles["RAmax"][wraps]])
+        index = np.concatenate([
+            np.arange(len(tiles)), np.flatnonzero(wraps)])
+        order = np.lexsort([starts, band_id[index]])
+        self._ra_band = band_id[index][order]
+        self._ra_starts = starts[order]
+        self._ra_stops = stops[order]
+        # approximate search keys, the matches are tested exactly
+        self._ra_keys = self._ra_starts + 360.0 * self._ra_band
+        self._ra_index = index[order]
+        self._band_DECmax = band_DECmax
+        self._lookup = True
+
+    def assign(self, ra, dec):
+        """
+        Assign objects to the tile that contains them, the bounds follow
+        footprint_regions.mask_ra_dec (lower bounds inclusive).
+        Parameters
+        ----------
+        ra : array_like
+            Right ascension of the objects in degrees.
+        dec : array_like
+            Declination of the objects in degrees.
+        Returns
+        -------
+        index : array_like
+            Index of the tile of each object (int32), -1 if the object is
+            not within any tile.
+        """
+        if self._lookup is None:
+            self._build_lookup()
+        ra = np.mod(np.asarray(ra, dtype=np.float64), 360.0)
+        dec = np.asarray(dec, dtype=np.float64)
+        index = np.full(len(ra), -1, dtype=np.int32)
+        for bands, edges in self._layers:
+            todo = np.flatnonzero(index == -1)
+            i = np.searchsorted(edges, dec[todo], side="right") - 1
+            inside = (i >= 0) & (i < len(bands))
+            todo, i = todo[inside], i[inside]
+            band = bands[i]
+            # bands of a layer may have gaps in declination
+            inside = dec[todo] < self._band_DECmax[band]
+            todo, band = todo[inside], band[inside]
+            j = np.searchsorted(
+                self._ra_keys, ra[todo] + 360.0 * band, side="right") - 1
+            # the rounding of the keys may shift the match by one interval
+            for shift in (0, -1, 1):
+                k = np.clip(j + shift, 0, len(self._ra_keys) - 1)
+                valid = (
+                    (index[todo] == -1) & (self._ra_band[k] == band) &
+                    (ra[todo] >= self._ra_starts[k]) &
+                    (ra[todo] < self._ra_stops[k]))
+                index[todo[valid]] = self._ra_index[k[valid]]
+        return index
+
+
+def tile_footprints(surveys, tile_area=None, grid=None):
+    """
+    Tile the RA/DEC bounds of a set of surveys in a single pass, either with
+    a fixed n_RA x n_DEC grid per survey (see
+    mocks_generate_footprint.make_pointings) or adaptively with a target
+    tile area (see adaptive_tiles).
+    Parameters
+    ----------
+    surveys : dict
+        Bounds (RAmin, RAmax, DECmin, DECmax) indexed by survey name, the
+        name is used as prefix of the tile names.
+    tile_area : float
+        Target area of the tiles in square degrees.
+    grid : list of int
+        Number of tiles along the RA and the DEC axis (n_RA, n_DEC).
+    Returns
+    -------
+    table : TileTable
+        Tiles of all surveys.
+    """
+    if (tile_area is None) == (grid is None):
+        raise ValueError("either the tile area or the grid is required")
+    names = list(surveys.keys())
+    bounds = np.array([surveys[name][:4] for name in names], dtype=float)
+    if grid is None:
+        n_bands, n_tiles = adaptive_tiles(bounds, tile_area)
+    else:
+        n_ra, n_dec = grid
+        n_bands = np.full(len(bounds), n_dec)
+        n_tiles = np.full(n_dec * len(bounds), n_ra)
+    tiles = tile_bands(bounds, n_bands, n_tiles)
+    return TileTable.from_tiles(tiles, names)
+
+
+def write_tile_files(pointings_file, pointing_names, bound_tuples):
+    """
+    Write the text pointings file (see
+    mocks_generate_footprint.write_pointings_file) and the binary tile table
+    next to it (see tile_table_path). The tile table is created from the
+    written text file, such that both contain the same (rounded) bounds.
+    Returns
+    -------
+    table : TileTable
+        Tiles of the pointings file.
+    """
+    write_pointings_file(pointings_file, pointing_names, bound_tuples)
+    names, bound_tuples = read_pointings_file(pointings_file)
+    table = TileTable.from_bounds(bound_tuples, names)
+    table.save(tile_table_path(pointings_file))
+    return table
@@ -0,0 +1,238 @@
+###############################################################################
+#                                                                             #
+#   HEALPix pixelisation in the NESTED scheme. Uses healpy if installed,      #
+#   otherwise a vectorized numpy implementation of the HEALPix C++ reference  #
+#   algorithms (Gorski et al. 2005).                                          #
+#                                                                             #
+###############################################################################
+
+import numpy as np
+
+try:
+    import healpy
+except ImportError:
+    healpy = None
+
+
+# face layout of the base pixels
+_JRLL = np.array([2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 4, 4], dtype=np.int64)
+_JPLL = np.array([1, 3, 5, 7, 0, 2, 4, 6, 1, 3, 5, 7], dtype=np.int64)
+
+
+def check_nside(nside):
+    """
+    Check that nside is a power of two, as required by the NESTED scheme.
+
+    Parameters
+    ----------
+    nside : int
+        HEALPix resolution parameter.
+
+    Returns
+    -------
+    order : int
+        Resolution order, log2(nside).
+    """
+    nside = int(nside)
+    if nside < 1 or nside & (nside - 1) != 0 or nside > 2**29:
+        raise ValueError("nside must be a power of 2 <= 2^29: %d" % nside)
+    return nside.bit_length() - 1
+
+
+def npix(nside):
+    """
+    Number of pixels of a HEALPix map.
+    """
+    return 12 * int(nside)**2
+
+
+def max_pixrad(nside):
+    """
+    Upper bound of the maximum angular distance between a pixel centre and
+    its corners in radians (slightly larger than healpy.max_pixrad).
+    """
+    return 1.2 / int(nside)
+
+
+def _spread_bits(value):
+    # move the bits of the (up to 32 bit) integers to the even bit positions
+    value = value.astype(np.int64)
+    value = (value | (value << 16)) & 0x0000FFFF0000FFFF
+    value = (value | (value << 8)) & 0x00FF00FF00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F0F0F0F0F
+    value = (value | (value << 2)) & 0x3333333333333333
+    value = (value | (value << 1)) & 0x5555555555555555
+    return value
+
+
+def _compress_bits(value):
+    # inverse of _spread_bits, collects the even bits
+    value = value & 0x5555555555555555
+    value = (value | (value >> 1)) & 0x3333333333333333
+    value = (value | (value >> 2)) & 0x0F0F0F0F0F0F0F0F
+    value = (value | (value >> 4)) & 0x00FF00FF00FF00FF
+    value = (value | (value >> 8)) & 0x0000FFFF0000FFFF
+    value = (value | (value >> 16)) & 0x00000000FFFFFFFF
+    return value
+
+
+def ang2pix(nside, ra, dec):
+    """
+    Compute the NESTED HEALPix pixel index of sky positions.
+
+    Parameters
+    ----------
+    nside : int
+        HEALPix resolution parameter (power of 2).
+    ra : array_like
+        Right ascension in degrees.
+    dec : array_like
+        Declination in degrees.
+
+    Returns
+    -------
+    pix : array_like
+        Pixel indices (int64).
+    """
+    order = check_nside(nside)
+    if healpy is not None:
+        return healpy.ang2pix(
+            nside, np.asarray(ra, dtype=np.float64),
+            np.asarray(dec, dtype=np.float64), nest=True,
+            lonlat=True).astype(np.int64)
+    z = np.sin(np.radians(np.atleast_1d(dec).astype(np.float64)))
+    # tt in [0, 4) in units of 90 degrees
+    tt = np.mod(np.atleast_1d(ra).astype(np.float64), 360.0) / 90.0
+    tt[tt >= 4.0] = 0.0  # rounding of tiny negative RAs
+    za = np.abs(z)
+    face = np.empty(z.shape, dtype=np.int64)
+    ix = np.empty(z.shape, dtype=np.int64)
+    iy = np.empty(z.shape, dtype=np.int64)
+    # equatorial region
+    eq = za <= 2.0 / 3.0
+    temp1 = nside * (0.5 + tt[eq])
+    temp2 = nside * (0.75 * z[eq])
+    jp = (temp1 - temp2).astype(np.int64)  # ascending edge line index
+    jm = (temp1 + temp2).astype(np.int64)  # descending edge line index
+    ifp = jp >> order
+    ifm = jm >> order
+    face[eq] = np.where(
+        ifp == ifm, ifp | 4, np.where(ifp < ifm, ifp, ifm + 8))
+    ix[eq] = jm & (nside - 1)
+    iy[eq] = nside - (jp & (nside - 1)) - 1
+    # polar caps
+    pol = ~eq
+    ntt = np.minimum(tt[pol].astype(np.int64), 3)
+    tp = tt[pol] - ntt
+    tmp = nside * np.sqrt(3.0 * (1.0 - za[pol]))
+    jp = np.minimum((tp * tmp).astype(np.int64), nside - 1)
+    jm = np.minimum(((1.0 - tp) * tmp).astype(np.int64), nside - 1)
+    north = z[pol] >= 0.0
+    face[pol] = np.where(north, ntt, ntt + 8)
+    ix[pol] = np.where(north, nside - jm - 1, jp)
+    iy[pol] = np.where(north, nside - jp - 1, jm)
+    return (face << (2 * order)) + _spread_bits(ix) + (_spread_bits(iy) << 1)
+
+
+def pix2ang(nside, pix):
+    """
+    Compute the centre of NESTED HEALPix pixels.
+
+    Parameters
+    ----------
+    nside : int
+        HEALPix resolution parameter (power of 2).
+    pix : array_like
+        Pixel indices.
+
+    Returns
+    -------
+    ra : array_like
+        Right ascension of the pixel centres in degrees.
+    dec : array_like
+        Declination of the pixel centres in degrees.
+    """
+    order = check_nside(nside)
+    pix = np.asarray(pix, dtype=np.int64)
+    if healpy is not None:
+        return healpy.pix2ang(nside, pix, nest=True, lonlat=True)
+    face = pix >> (2 * order)
+    ipf = pix & (nside * nside - 1)
+    ix = _compress_bits(ipf)
+    iy = _compress_bits(ipf >> 1)
+    # ring index counted from the north pole
+    jr = _JRLL[face] * nside - ix - iy - 1
+    fact2 = 4.0 / npix(nside)
+    nr = np.where(
+        jr < nside, jr, np.where(jr > 3 * nside, 4 * nside - jr, nside))
+    z = np.where(
+        jr < nside, 1.0 - nr**2 * fact2,
+        np.where(
+            jr > 3 * nside, nr**2 * fact2 - 1.0,
+            (2 * nside - jr) * 2.0 * nside * fact2))
+    kshift = np.where((jr >= nside) & (jr <= 3 * nside), (jr - nside) & 1, 0)
+    jp = (_JPLL[face] * nr + ix - iy + 1 + kshift) // 2
+    jp = np.where(jp > 4 * nside, jp - 4 * nside, jp)
+    jp = np.where(jp < 1, jp + 4 * nside, jp)
+    phi = (jp - (kshift + 1) * 0.5) * (0.5 * np.pi / nr)
+    ra = np.mod(np.degrees(phi), 360.0)
+    dec = np.degrees(np.arcsin(np.clip(z, -1.0, 1.0)))
+    return ra, dec
+
+
+def index_column(nside):
+    """
+    Default name of the NESTED HEALPix index column at a given resolution.
+    """
+    return "healpix_%d" % int(nside)
+
+
+def degrade(pix, nside, nside_out):
+    """
+    Map NESTED pixel indices to the pixels of a lower resolution map that
+    contain them, a bit shift in the NESTED scheme.
+
+    Parameters
+    ----------
+    pix : array_like
+        Pixel indices.
+    nside : int
+        HEALPix resolution parameter of the pixel indices.
+    nside_out : int
+        Lower HEALPix resolution parameter.
+
+    Returns
+    -------
+    pix : array_like
+        Pixel indices at resolution nside_out.
+    """
+    shift = 2 * (check_nside(nside) - check_nside(nside_out))
+    if shift < 0:
+        raise ValueError(
+            "cannot degrade from nside=%d to nside=%d" % (nside, nside_out))
+    return np.asarray(pix, dtype=np.int64) >> shift
+
+
+def pixel_counts(pix, nside, nside_out=None):
+    """
+    Count the objects per pixel (a density map) from their NESTED pixel
+    indices, optionally at a lower resolution.
+
+    Parameters
+    ----------
+    pix : array_like
+        Pixel indices.
+    nside : int
+        HEALPix resolution parameter of the pixel indices.
+    nside_out : int
+        Resolution of the map (default: nside).
+
+    Returns
+    -------
+    counts : array_like
+        Number of objects in each pixel of the map.
+    """
+    if nside_out is None:
+        nside_out = nside
+    return np.bincount(
+        degrade(pix, nside, nside_out), minlength=npix(nside_out))
@@ -5,23 +5,141 @@ import sys
 from hashlib import md5
 
 import numpy as np
-from matplotlib import pyplot as plt
-from scipy.integrate import cumtrapz
-from scipy.stats import gaussian_kde
 
 import specz_selection as pipeline   # provides spec-z selection functions
-from table_tools import load_table
+from catalogue_io import load_table, read_colnames
 
 
-if __name__ == "__main__":
+# magnitude suffixes that are read by the selection functions
+SELECTION_SUFFIXES = ("", "obs", "evo")
+
 
-    survey_names = []
+def get_selection_functions():
+    """
+    Collect the spectroscopic selection functions (make_* classes) defined
+    in specz_selection.py.
+    Returns
+    -------
+    selection_functions : dict
+        Selection function classes indexed by survey name.
+    """
     selection_functions = {}
     for s in pipeline.__dir__():
         if s.startswith("make_"):
-            survey = s[5:]
-            survey_names.append(survey)
-            selection_functions[survey] = getattr(pipeline, s)
+            selection_functions[s[5:]] = getattr(pipeline, s)
+    return selection_functions
+
+
+def selection_columns(data_class, colnames):
+    """
+    Find the table columns that are read by the selection functions, i.e. the
+    redshift and the magnitudes of the filters defined by a dc2_data class.
+    Parameters
+    ----------
+    data_class : type
+        Sub-class of specz_selection.dc2_data.
+    colnames : list of str
+        Column names of the simulation table.
+    Returns
+    -------
+    columns : list of str
+        Names of the required columns present in the table.
+    """
+    candidates = ["redshift"]
+    for key in data_class.filter_keys.values():
+        for suffix in SELECTION_SUFFIXES:
+            base = key if suffix == "" else "%s_%s" % (key, suffix)
+            candidates.extend(["%s_%s_mag" % (key, suffix), base])
+    return [col for col in colnames if col in set(candidates)]
+
+
+def apply_selection(
+        simul, survey, n_data=None, n_z=None, pass_phot_detection=False,
+        seed="KV450"):
+    """
+    Apply a spectroscopic selection function to the simulation data.
+    Parameters
+    ----------
+    simul : specz_selection.dc2_data
+        Simulation data.
+    survey : str
+        Name of the selection function (see get_selection_functions).
+    n_data : int
+        Number of objects after downsampling (for selection functions that
+        match the total number of objects).
+    n_z : array_like
+        Data spectroscopic redshifts (for selection functions that match the
+        data redshift distribution).
+    pass_phot_detection : bool
+        Whether included objects must be detected in the photometric survey
+        detection band.
+    seed : str
+        String to seed the random generator.
+    Returns
+    -------
+    mask : boolean array_like
+        Mask of the selected simulation objects.
+    stats : list
+        Statistics from each selection function step.
+    """
+    # reseed the random state to make results reproducible
+    hasher = md5(bytes(seed, "utf-8"))
+    hashval = bytes(hasher.hexdigest(), "utf-8")
+    np.random.seed(np.frombuffer(hashval, dtype=np.uint32))
+    selection_function = get_selection_functions()[survey](simul)
+    if selection_function.needs_n_tot:
+        if n_data is None:
+            raise ValueError(
+                "selection function '%s' requires the number of data "
+                "objects" % survey)
+        simul_spec, stats = selection_function(n_data, pass_phot_detection)
+    elif selection_function.needs_n_z:
+        if n_z is None:
+            raise ValueError(
+                "selection function '%s' requires the data redshifts" %
+                survey)
+        simul_spec, stats = selection_function(n_z, pass_phot_detection)
+    else:
+        simul_spec, stats = selection_function(pass_phot_detection)
+    return selection_function.mask, stats
+
+
+def write_stats(filename, stats, label, mode="w"):
+    """
+    Write the statistics of a selection to a text file.
+    Parameters
+    ----------
+    filename : str
+        Path of the statistics file.
+    stats : list
+        Statistics from each selection function step.
+    label : str
+        Label appended to the line, e.g. the output file path.
+    mode : str
+        Whether the file is written (w) or appended to (a).
+    """
+    print(
+        "%s the selection statistics to: %s" % (
+            "append" if mode == "a" else "write", filename))
+    # create a table header
+    keyorder = sorted(key for key in stats[0].keys() if key != "method")
+    header = ""
+    for stat in stats:
+        header += "%s (%s)    " % (stat["method"], ",".join(keyorder))
+    line = ""
+    for stat in stats:
+        line += "%8d %.3f    " % tuple(stat[key] for key in keyorder)
+    line += label
+    write_header = not os.path.exists(filename) or mode == "w"
+    with open(filename, mode) as f:
+        if write_header:
+            f.write(header + "\n")
+        f.write(line + "\n")
+
+
+if __name__ == "__main__":
+
+    survey_names = list(get_selection_functions().keys())
 
     parser = argparse.ArgumentParser(
         description='Mimic the selection of common spectroscopic surveys for '
@@ -82,18 +200,18 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-    # get simulation data
+    # get simulation data, only the columns used by the selection functions
     if args.s_type == "KV450":
-        simul = pipeline.KV450_dc2_data(
-            load_table(args.simulated, args.s_format))
+        data_class = pipeline.KV450_dc2_data
     elif args.s_type == "DES":
-        simul = pipeline.DES_dc2_data(
-            load_table(args.simulated, args.s_format))
+        data_class = pipeline.DES_dc2_data
     elif args.s_type == "LSST":
-        simul = pipeline.LSST_dc2_data(
-            load_table(args.simulated, args.s_format))
+        data_class = pipeline.LSST_dc2_data
     else:
         raise ValueError("unspecified survey --s-type '%s'" % args.s_type)
+    columns = selection_columns(
+        data_class, read_colnames(args.simulated, args.s_format))
+    simul = data_class(load_table(args.simulated, args.s_format, columns))
     # get real data
     if args.data is not None:
         if args.d_z_spec is None:
@@ -105,50 +223,20 @@ if __name__ == "__main__":
 
     # select galaxies
     print("apply selection function of: %s" % args.survey)
-    # reseed the random state to make results reproducible
-    hasher = md5(bytes(args.seed, "utf-8"))
-    hashval = bytes(hasher.hexdigest(), "utf-8")
-    np.random.seed(np.frombuffer(hashval, dtype=np.uint32))
-    selection_function = selection_functions[args.survey](simul)
-    if selection_function.needs_n_tot:
-        if args.n_data is None:
-            sys.exit(
-                "ERROR: selection function '%s' requires --n-data" %
-                args.survey)
-        simul_spec, stats = selection_function(
-            args.n_data, args.pass_phot_detection)
-    elif selection_function.needs_n_z:
-        if args.data is None:
-            sys.exit(
-                "ERROR: selection function '%s' requires --data" %
-                args.survey)
-        simul_spec, stats = selection_function(
-            data, args.pass_phot_detection)
-    else:
-        simul_spec, stats = selection_function(
-            args.pass_phot_detection)
+    try:
+        mask, stats = apply_selection(
+            simul, args.survey, n_data=args.n_data, n_z=data,
+            pass_phot_detection=args.pass_phot_detection, seed=args.seed)
+    except ValueError as e:
+        sys.exit("ERROR: %s" % e)
+    # gather the selected rows with all columns
+    simul_spec = load_table(args.simulated, args.s_format)[mask]
 
     # process the statistics
     if args.stats_file != "n":
         filename = os.path.join(
             os.path.dirname(args.output), "%s_selection.stats" % args.survey)
-        print(
-            "%s the selection statistics to: %s" % (
-                "append" if args.stats_file == "a" else "write", filename))
-        # create a table header
-        keyorder = sorted(key for key in stats[0].keys() if key != "method")
-        header = ""
-        for stat in stats:
-            header += "%s (%s)    " % (stat["method"], ",".join(keyorder))
-        line = ""
-        for stat in stats:
-            line += "%8d %.3f    " % tuple(stat[key] for key in keyorder)
-        line += args.output
-        write_header = not os.path.exists(filename) or args.stats_file == "w"
-        with open(filename, args.stats_file) as f:
-            if write_header:
-                f.write(header + "\n")
-            f.write(line + "\n")
+        write_stats(filename, stats, args.output, args.stats_file)
 
     # write to specified output path
     print("write table to: %s" % args.output)
@@ -12,10 +12,11 @@ from astropy import units
 from astropy.table import Column, Table, vstack
 from scipy.integrate import cumtrapz
 
-from table_tools import load_table
+from catalogue_io import load_table
 
 
-def make_columns_file(column_file, temp_table):
+def make_columns_file(
+        column_file, temp_table, filters, errors, prior_filter, id_col=None):
     """
     Create a BPZ columns file specifying the input data table columns.
     Parameters
@@ -24,10 +25,18 @@ def make_columns_file(column_file, temp_table):
         Path to write the columns file to.
     temp_table : astropy.table.Table
         Table containing the minimal subset of data columns needed by BPZ
+    filters : list of str
+        Table column names defining the magnitude columns.
+    errors : list of str
+        Table column names defining the magnitude errors.
+    prior_filter : str
+        Table column name of filter used to evaluate the BPZ prior.
+    id_col : str
+        Table column name of a unique object identifier (optional).
     """
     # create a columns file
     with open(column_file, "w") as f:
-        for i, (filt, err) in enumerate(zip(args.filters, args.errors)):
+        for i, (filt, err) in enumerate(zip(filters, errors)):
             # register the filters
             if filt.endswith("_mag"):
                 filt_name = filt[:-4]
@@ -38,13 +47,13 @@ def make_columns_file(column_file, temp_table):
                     filt_name, temp_table.index_column(filt) + 1,
                     temp_table.index_column(err) + 1, 0.01, 0.0))
         # add the object index and prior columns
-        if args.id is not None:
-            f.write("ID %d\n" % (temp_table.index_column(args.id) + 1))
+        if id_col is not None:
+            f.write("ID %d\n" % (temp_table.index_column(id_col) + 1))
         f.write(
-            "M_0 %d\n" % (temp_table.index_column(args.prior_filter) + 1))
+            "M_0 %d\n" % (temp_table.index_column(prior_filter) + 1))
 
 
-def make_thread_tables(temp_table, logdir):
+def make_thread_tables(temp_table, logdir, cat_base, log_base, threads):
     """
     Split the data table into chucks by the number of threads and write these
     as temporary files to disk. Returns the list of file paths and
@@ -55,19 +64,24 @@ def make_thread_tables(temp_table, logdir):
         Table containing the minimal subset of data columns needed by BPZ
     logdir : string
         Folder in which all logs are stored for later inspection.
+    cat_base : string
+        Base path of the temporary tables, a counter is added per thread.
+    log_base : string
+        Base name of the log files, a counter is added per thread.
+    threads : int
+        Number of threads to split the data for.
     """
     cat_files = []
     log_files = []
     # estimate the number of rows per table based on the number of threads
-    row_count = len(temp_table) // args.threads + 1
-    for i in range(args.threads):
+    row_count = len(temp_table) // threads + 1
+    for i in range(threads):
         # take the input file path and add a counter to discriminate each
         # thread's table
-        basename = os.path.splitext(args.input)[0] + ".%02d" % (i + 1)
+        basename = cat_base + ".%02d" % (i + 1)
         cat_files.append(basename + ".ascii")
         # use the same naming patterns for the log files, but based on output
         # file name
-        log_base = os.path.basename(os.path.splitext(args.output)[0])
         log_files.append(
             os.path.join(logdir, log_base + ".%02d.log" % (i + 1)))
         # split the table into slices of length row_count
@@ -86,14 +100,16 @@ def run_BPZ(arguments):
     Parameters
     ----------
     arguments : list
-        List containing the input table file path, the posterior output file
-        and the log file path (if None, use stdout).
+        List containing the input table file path, the posterior output file,
+        the log file path (if None, use stdout) and a dictionary with the BPZ
+        settings (bpz_path, column_file, prior, templates, z_min, z_max,
+        verbose).
     Returns
     -------
     outputfile : string
         Path to BPZ output table.
     """
-    inputfile, logfile = arguments
+    inputfile, logfile, settings = arguments
     outputfile = os.path.splitext(inputfile)[0] + ".bpz"
     # assemble command chain
     try:
@@ -101,13 +117,14 @@ def run_BPZ(arguments):
     except KeyError:
         python = "python2"
     command = [
-        python, os.path.join(bpz_path, "bpz.py"), inputfile,
-        "-COLUMNS", column_file, "-OUTPUT", outputfile,
-        "-PRIOR", args.prior, "-SPECTRA", args.templates + ".list",
-        "-ZMIN", str(args.z_min), "-ZMAX", str(args.z_max),
+        python, os.path.join(settings["bpz_path"], "bpz.py"), inputfile,
+        "-COLUMNS", settings["column_file"], "-OUTPUT", outputfile,
+        "-PRIOR", settings["prior"],
+        "-SPECTRA", settings["templates"] + ".list",
+        "-ZMIN", str(settings["z_min"]), "-ZMAX", str(settings["z_max"]),
         "-INTERP", "10", "-NEW_AB", "no",
         "-ODDS", "0.68", "-MIN_RMS", "0.067", "-INTERACTIVE", "no",
-        "-VERBOSE", "yes" if args.verbose else "no",
+        "-VERBOSE", "yes" if settings["verbose"] else "no",
         "-PROBS_LITE", "no", "-CHECK", "no"]
     # open the log file
     if logfile is not None:
@@ -118,8 +135,15 @@ def run_BPZ(arguments):
     return outputfile, return_code
 
 
-if __name__ == "__main__":
-
+def get_bpz_path():
+    """
+    Get the BPZ source directory from the environment and set up the
+    environment variables required by BPZ.
+    Returns
+    -------
+    bpz_path : string
+        Path to the BPZ source directory ($BPZPATH).
+    """
     try:
         bpz_path = os.environ["BPZPATH"]
     except KeyError:
@@ -127,6 +151,160 @@ if __name__ == "__main__":
             "ERROR: $BPZPATH (BPZ source director path) not found in "
             "enironment")
     os.environ["NUMERIX"] = "numpy"  # required for BPZ
+    return bpz_path
+
+
+def run_bpz(
+        data, filters, errors, prior_filter, work_base, output_base,
+        templates="CWWSB4", prior="hdfn_gen", id_col=None, z_min=0.01,
+        z_max=7.0, threads=1, verbose=False):
+    """
+    Run BPZ on a data table. The data is split into chunks which are processed
+    in parallel.
+    Parameters
+    ----------
+    data : astropy.table.Table
+        Input data table with the magnitude, error and prior columns.
+    filters : list of str
+        Table column names defining the magnitude columns.
+    errors : list of str
+        Table column names defining the magnitude errors.
+    prior_filter : str
+        Table column name of filter used to evaluate the BPZ prior.
+    work_base : str
+        Base path (without extension) for the temporary BPZ input files. The
+        log files are collected in the folder BPZ_logs next to it.
+    output_base : str
+        Base name of the log files.
+    templates : str
+        Template set list defined in the SED folder of BPZ.
+    prior : str
+        Prior function defined in the BPZ root-folder.
+    id_col : str
+        Table column name of a unique object identifier (optional).
+    z_min : float
+        Minimum allowed redshift.
+    z_max : float
+        Maximum allowed redshift.
+    threads : int
+        Number of threads to use.
+    verbose : bool
+        Show full output from BPZ.
+    Returns
+    -------
+    table : astropy.table.Table
+        Concatenated BPZ output table.
+    """
+    bpz_path = get_bpz_path()
+    # create a subdirectory to collect the log files of each thread
+    logdir = os.path.join(os.path.dirname(work_base), "BPZ_logs")
+    if os.path.exists(logdir):
+        rmtree(logdir)
+    os.mkdir(logdir)
+
+    string = "build BPZ input catalogues"
+    if threads > 1:
+        string += " for parallel processing"
+    print(string)
+    # collect only the required data columns
+    temp_columns = [] if id_col is None else [id_col]
+    temp_columns.extend(filters)
+    temp_columns.extend(errors)
+    if prior_filter not in temp_columns:
+        temp_columns.append(prior_filter)
+    temp_table = data[temp_columns]
+
+    # create write a temporary table(s per thread) in ascii format
+    column_file = work_base + ".columns"
+    settings = {
+        "bpz_path": bpz_path, "column_file": column_file, "prior": prior,
+        "templates": templates, "z_min": z_min, "z_max": z_max,
+        "verbose": verbose}
+
+    # put this in a try statement to clean up the temporary files if something
+    # goes wrong
+    cat_files = []
+    out_files = []
+    try:
+        make_columns_file(
+            column_file, temp_table, filters, errors, prior_filter, id_col)
+        # write a table-subset for each BPZ thread
+        cat_files, log_files = make_thread_tables(
+            temp_table, logdir, work_base, output_base, threads)
+        del(temp_table)  # free some memory since these are now on disk
+        # run bpz
+        message = "running BPZ"
+        if threads > 1:
+            print(message + " with %d threads" % threads)
+            print(
+                "redirecting concurrent output to: %s" %
+                log_files[0].replace(".01.", ".*."))
+            with multiprocessing.Pool(threads) as pool:
+                results = pool.map(
+                    run_BPZ, [
+                        (cat_file, log_file, settings)
+                        for cat_file, log_file in zip(cat_files, log_files)])
+            out_files = [res[0] for res in results]
+            return_codes = [res[1] for res in results]
+        else:
+            print(message)
+            # if there is only one thread the output will not be stored in a
+            # log file
+            print("#" * 30)
+            out_file, return_code = run_BPZ([cat_files[0], None, settings])
+            print("#" * 30)
+            out_files = [out_file]
+            return_codes = [return_code]
+
+        # check if BPZ terminated with code 0
+        for return_code, out_file in zip(return_codes, out_files):
+            if return_code != 0:
+                threadID = out_file.rsplit(".")[1]
+                sys.exit(
+                    "ERROR: BPZ in thread %s exited with return-code %d" % (
+                        threadID, int(return_code)))
+
+        # recombine and convert output tables
+        print(
+            "%s output data" % (
+                "concatenate" if threads > 1 else "convert"))
+        # Merge back the BPZ output table(s). Read the output files from disk
+        # and delete them afterwards.
+        tables = []
+        for fpath in out_files:
+            tables.append(Table.read(fpath, format="ascii"))
+            try:
+                os.remove(fpath)
+            except Exception:
+                pass
+        table = vstack(tables)
+        # correct the index offset (each threads starts indexing from 0)
+        if id_col is None:
+            table["ID"] = np.arange(1, len(table["ID"]) + 1, dtype=np.int64)
+
+    # cleaning up code, always executed before leaving the script
+    finally:
+        # try to delete whatever temporary files might exist
+        print("remove temporary data")
+        try:
+            pass
+            #os.remove(column_file)
+        except Exception:
+            pass
+        # remove remaining data products
+        for flist in [cat_files, out_files]:
+            for fpath in flist:
+                try:
+                    pass
+                    #os.remove(fpath)
+                except Exception:
+                    pass
+    return table
+
+
+if __name__ == "__main__":
+
+    bpz_path = get_bpz_path()
     sed_path = os.path.join(bpz_path, "SED")
     # collect a list of installed templates and priors to be displayed in the
     # argument parser help text.
@@ -215,101 +393,14 @@ if __name__ == "__main__":
     columns.extend(args.errors)
     data = load_table(args.input, args.i_format, columns)
 
-    # create a subdirectory to collect the log files of each thread
-    logdir = os.path.join(os.path.dirname(args.input), "BPZ_logs")
-    if os.path.exists(logdir):
-        rmtree(logdir)
-    os.mkdir(logdir)
-
-    string = "build BPZ input catalogues"
-    if args.threads > 1:
-        string += " for parallel processing"
-    print(string)
-    # collect only the required data columns
-    temp_columns = [] if args.id is None else [args.id]
-    temp_columns.extend(args.filters)
-    temp_columns.extend(args.errors)
-    if args.prior_filter not in temp_columns:
-        temp_columns.append(args.prior_filter)
-    temp_table = data[temp_columns]
-
-    # create write a temporary table(s per thread) in ascii format
-    column_file = os.path.splitext(args.input)[0] + ".columns"
-
-    # put this in a try statement to clean up the temporary files if something
-    # goes wrong
-    try:
-        make_columns_file(column_file, temp_table)
-        # write a table-subset for each BPZ thread
-        cat_files, log_files = make_thread_tables(
-            temp_table, logdir)
-        del(temp_table)  # free some memory since these are now on disk
-        # run bpz
-        message = "running BPZ"
-        if args.threads > 1:
-            print(message + " with %d threads" % args.threads)
-            print(
-                "redirecting concurrent output to: %s" %
-                log_files[0].replace(".01.", ".*."))
-            with multiprocessing.Pool(args.threads) as pool:
-                results = pool.map(
-                    run_BPZ, list(zip(cat_files, log_files)))
-            out_files = [res[0] for res in results]
-            return_codes = [res[1] for res in results]
-        else:
-            print(message)
-            # if there is only one thread the output will not be stored in a
-            # log file
-            print("#" * 30)
-            out_file, return_code = run_BPZ([cat_files[0], None])
-            print("#" * 30)
-            out_files = [out_file]
-            return_codes = [return_code]
-
-        # check if BPZ terminated with code 0
-        for return_code, out_file in zip(return_codes, out_files):
-            if return_code != 0:
-                threadID = out_file.rsplit(".")[1]
-                sys.exit(
-                    "ERROR: BPZ in thread %s exited with return-code %d" % (
-                        threadID, int(return_code)))
+    table = run_bpz(
+        data, args.filters, args.errors, args.prior_filter,
+        work_base=os.path.splitext(args.input)[0],
+        output_base=os.path.basename(os.path.splitext(args.output)[0]),
+        templates=args.templates, prior=args.prior, id_col=args.id,
+        z_min=args.z_min, z_max=args.z_max, threads=args.threads,
+        verbose=args.verbose)
 
-        # recombine and convert output tables
-        print(
-            "%s output data" % (
-                "concatenate" if args.threads > 1 else "convert"))
-        # Merge back the BPZ output table(s). Read the output files from disk
-        # and delete them afterwards.
-        tables = []
-        for fpath in out_files:
-            tables.append(Table.read(fpath, format="ascii"))
-            try:
-                os.remove(fpath)
-            except Exception:
-                pass
-        table = vstack(tables)
-        # correct the index offset (each threads starts indexing from 0)
-        if args.id is None:
-            table["ID"] = np.arange(1, len(table["ID"]) + 1, dtype=np.int64)
-
-        # write to specified output path
-        print("write table to: %s" % args.output)
-        table.write(args.output, format=args.o_format, overwrite=True)
-
-    # cleaning up code, always executed before leaving the script
-    finally:
-        # try to delete whatever temporary files might exist
-        print("remove temporary data")
-        try:
-            pass
-            #os.remove(column_file)
-        except Exception:
-            pass
-        # remove remaining data products
-        for flist in [cat_files, out_files]:
-            for fpath in flist:
-                try:
-                    pass
-                    #os.remove(fpath)
-                except Exception:
-                    pass
\ No newline at end of file
+    # write to specified output path
+    print("write table to: %s" % args.output)
+    table.write(args.output, format=args.o_format, overwrite=True)
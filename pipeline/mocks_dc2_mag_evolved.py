@@ -1,13 +1,12 @@
 #!/usr/bin/env python3
 import argparse
-import os
 import sys
 
 import numpy as np
 from astropy import units
 from astropy.table import Column, Table
 
-from table_tools import load_table
+from catalogue_io import iter_chunks, open_writer, read_colnames, table_format
 
 
 def mag_correction(mag, redshift, evo=True):
@@ -31,49 +30,142 @@ def mag_correction(mag, redshift, evo=True):
         return mag
 
 
+def magnitude_columns(colnames, prefix="mag"):
+    """
+    Find the model magnitude columns of a DC2 catalogue.
+
+    Parameters
+    ----------
+    colnames : list of str
+        Column names of the catalogue, e.g. from the file header (see
+        catalogue_io.read_colnames).
+    prefix : str
+        Prefix of the magnitude column names.
+
+    Returns
+    -------
+    mag_cols : list of str
+        Names of the magnitude columns, excluding corrected magnitudes
+        (suffix _evo).
+    """
+    return [
+        col for col in colnames
+        if col.startswith(prefix) and not col.endswith("_evo")]
+
+
+def evolve_catalogue(
+        input, output, mag_cols, z_col="redshift", evo=True, i_format=None,
+        o_format=None, chunk_size=10000000, compression="gzip"):
+    """
+    Apply the evolution correction to the magnitudes of a catalogue. Only the
+    redshift and the magnitude columns are read, in chunks of rows, and the
+    corrected magnitudes (suffix _evo) are appended to the output chunk by
+    chunk. The chunk size is a number of values that is split between the
+    redshift and the magnitude columns, such that the memory usage does not
+    grow with the number of bands.
+
+    Parameters
+    ----------
+    input : str
+        File path of the input catalogue.
+    output : str
+        File path of the output table containing only the corrected
+        magnitudes.
+    mag_cols : list of str
+        Names of the magnitude columns to correct.
+    z_col : str
+        Column name of the true redshift.
+    evo : bool
+        Whether the correction is applied, otherwise the magnitudes are
+        copied.
+    i_format : str
+        Format of the input catalogue (see catalogue_io.table_format).
+    o_format : str
+        Format of the output catalogue (see catalogue_io.table_format).
+    chunk_size : int
+        Number of values processed at once, i.e. chunks have
+        chunk_size / (len(mag_cols) + 1) rows.
+    compression : str
+        Compression filter of HDF5 output ("gzip", "lzf" or None).
+
+    Returns
+    -------
+    nrows : int
+        Number of rows written.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk size must be positive")
+    rows = max(1, chunk_size // (len(mag_cols) + 1))
+    if table_format(output, o_format) == "hdf5":
+        writer = open_writer(
+            output, o_format, background=True, compression=compression)
+    else:
+        writer = open_writer(output, o_format, background=True)
+    try:
+        for offset, chunk in iter_chunks(
+                input, i_format, [z_col, *mag_cols], rows):
+            table = Table()
+            for filt in mag_cols:
+                table[filt + "_evo"] = Column(
+                    mag_correction(chunk[filt], chunk[z_col], evo),
+                    unit=units.mag,
+                    description="evolution corrected model magnitude")
+            writer.write(table)
+    finally:
+        writer.close()
+    return writer.nrows
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(
         description='Apply the missing magnitude evolution correction to '
-                    'DC2.')
+                    'DC2. The magnitude columns are found from the table '
+                    'header and processed in chunks.')
     parser.add_argument(
         '-i', '--input', required=True, help='file path of DC2 data table')
     parser.add_argument(
-        '--i-format', default='fits',
-        help='astropy.table format specifier of the input table')
+        '--i-format',
+        help='format of the input table: fits, hdf5 or columns (column '
+             'store) (default: guessed from the file extension)')
     parser.add_argument(
         '-o', '--output', required=True,
         help='file path of output table containing only the corrected colours')
     parser.add_argument(
-        '--o-format', default='fits',
-        help='astropy.table format specifier of the output table '
-             '(default: %(default)s)')
+        '--o-format',
+        help='format of the output table: fits, hdf5 or columns (column '
+             'store) (default: guessed from the file extension)')
     parser.add_argument(
-        '--evo', default='True',
+        '--evo', default='True', choices=('True', 'False'),
         help='Add evolution correction or not?')
+    parser.add_argument(
+        '--redshift', default='redshift',
+        help='column name of the true redshift (default: %(default)s)')
+    parser.add_argument(
+        '--chunk-size', type=int, default=10000000,
+        help='number of values processed at once, split between the '
+             'redshift and the magnitude columns (default: %(default)s)')
+    parser.add_argument(
+        '--compression', default='gzip', choices=('gzip', 'lzf', 'none'),
+        help='compression filter of HDF5 output tables '
+             '(default: %(default)s)')
     args = parser.parse_args()
 
-    # check if all required columns exist
-    z_col = "redshift"
-    evo = args.evo
-    data = load_table(args.input, args.i_format, [z_col])
-    # find all model magnitude columns, ending with _true
-        
-    mag_cols = [col for col in data.colnames if col.startswith("mag")]
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be positive")
+    # find all model magnitude columns in the table header
+    colnames = read_colnames(args.input, args.i_format)
+    if args.redshift not in colnames:
+        sys.exit("ERROR: table does not contain the column: " + args.redshift)
+    mag_cols = magnitude_columns(colnames)
     if len(mag_cols) == 0:
         sys.exit("ERROR: table does not contain any DC2 magnitude columns")
     print("Find following filters:" + str(mag_cols))
 
-    # collect data and apply correction
-    z_data = data[z_col]
-    # create a new table that only contains the evolution corrected magnitudes
-    table = Table()
-    for filt in mag_cols:
-        print(filt + "_evo")
-        table[filt + "_evo"] = Column(
-            mag_correction(data[filt], z_data, evo), unit=units.mag,
-            description="evolution corrected model magnitude")
-
-    # write to specified output path
+    # write a new table that only contains the evolution corrected magnitudes
     print("write table to: %s" % args.output)
-    table.write(args.output, format=args.o_format, overwrite=True)
\ No newline at end of file
+    nrows = evolve_catalogue(
+        args.input, args.output, mag_cols, args.redshift,
+        args.evo == 'True', args.i_format, args.o_format, args.chunk_size,
+        None if args.compression == 'none' else args.compression)
+    print("corrected %d objects" % nrows)
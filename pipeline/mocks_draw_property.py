@@ -10,7 +10,170 @@ from astropy import units
 from astropy.table import Column, Table, hstack, vstack
 from scipy.spatial import cKDTree
 
-from table_tools import load_table
+from catalogue_io import load_table
+
+
+def append_fallbacks(data_props, fallback):
+    """
+    Append a row of fallback values to the property table. If neighbours are
+    outside r_max, cKDTree.query will point to index len(property) and
+    therefore at the newly appended fallback value.
+    Parameters
+    ----------
+    data_props : astropy.table.Table
+        Table with shape (n_data, n_props) of properties in the data table.
+    fallback : list of str
+        Value to assign if no neighbour is found, one for each property (bools
+        can be represented by "True" or "False").
+    Returns
+    -------
+    data_props : astropy.table.Table
+        Property table with the fallback values appended as last row.
+    """
+    n_props = len(data_props.columns)
+    fallbacks = [f for f in fallback]
+    # convert the input fallback values to data of valid type
+    if len(fallbacks) != n_props:
+        raise ValueError(
+            "number of properties is %d, but number of fallbacks is %d" % (
+                n_props, len(fallbacks)))
+    for i in range(n_props):
+        dtype = data_props.dtype[i]
+        colname = data_props.colnames[i]
+        # store the converted fallback values as astropy.table.Column
+        # for compatibility with the data table
+        try:
+            if dtype.kind == "b":  # conversion of booleans
+                if fallback[i].upper() == "TRUE":
+                    fallbacks[i] = Column([True], colname, dtype=dtype)
+                elif fallback[i].upper() == "FALSE":
+                    fallbacks[i] = Column([False], colname, dtype=dtype)
+                else:
+                    raise ValueError(
+                        ("expected boolean but the fallback '%s' " %
+                         fallback[i]) +
+                        "matches neither TRUE or FALSE")
+            else:
+                fallbacks[i] = Column(
+                    [fallback[i]], colname, dtype=dtype)
+        except ValueError:
+            raise ValueError(
+                "failed to convert fallback '%s' to type '%s'" % (
+                    fallback[i], dtype.str))
+    fallback_row = Table(fallbacks)
+    return vstack([data_props, fallback_row])
+
+
+def get_search_tree(data_attr, tree_path=""):
+    """
+    Create the nearest neighbour search tree or load it from a pickle file.
+    A loaded tree is verified against the data attributes.
+    Parameters
+    ----------
+    data_attr : array_like
+        Data attributes with shape (n_data, n_attr) on which the tree is
+        built.
+    tree_path : str
+        Python pickle file path at which the generated search tree is stored
+        or loaded from if existing (empty string: do not store the tree).
+    Returns
+    -------
+    tree : scipy.spatial.cKDTree
+        Search tree of the data attributes.
+    """
+    if os.path.exists(tree_path):
+        print("load existing search tree from: %s" % tree_path)
+        with open(tree_path, "rb") as f:
+            tree = pickle.load(f)
+        # verify the tree structure
+        if not isinstance(tree, cKDTree):
+            sys.exit("ERROR: pickled object ist not a 'cKDTree' instance")
+        n, m, = data_attr.shape
+        if tree.m != m or tree.n != n:
+            message = "ERROR: data with dimensions (%d, %d) does not " % (n, m)
+            message += "match loaded tree with (%d, %d)" % (tree.n, tree.m)
+            sys.exit(message)
+        # verify the data values to be sure that the data has not changed
+        # NOTE: this is much faster than creating a new tree every time
+        for i in range(m):
+            if not np.isclose(
+                    tree.data[:, i], data_attr[:, i], equal_nan=True).all():
+                message = "ERROR: data in dimension %d " % i
+                message += "of tree does not match data"
+                sys.exit(message)
+    else:
+        print("build search tree")
+        tree = cKDTree(data_attr)
+        # write the tree if the path string is not empty
+        if tree_path != "":
+            print("write search tree to python pickle file")
+            if os.path.exists(os.path.dirname(tree_path)):
+                with open(tree_path, "wb") as f:
+                    pickle.dump(tree, f)
+            else:
+                sys.exit(
+                    "ERROR: folder does not exit: %s" %
+                    os.path.dirname(tree_path))
+    return tree
+
+
+def draw_property(
+        simul_attr, data_attr, data_props, s_props, r_max=None,
+        fallback=None, tree_path="", threads=1, description=""):
+    """
+    Assign properties from real data to simulated objects based on the
+    nearest neighbours in the space of a set of data attributes.
+    Parameters
+    ----------
+    simul_attr : array_like
+        Simulation attributes with shape (n_simul, n_attr).
+    data_attr : array_like
+        Data attributes with shape (n_data, n_attr).
+    data_props : astropy.table.Table
+        Table with shape (n_data, n_props) of properties to draw.
+    s_props : list of str
+        Column names at which the assigned properties are stored.
+    r_max : float
+        Maximum Minkowski distance at which neighbours are considered a match
+        (requires fallback).
+    fallback : list of str
+        Value to assign if no neighbour is found within r_max, one for each
+        drawn property.
+    tree_path : str
+        Python pickle file path of the search tree (see get_search_tree).
+    threads : int
+        Number of threads to use for the nearest neighbour query.
+    description : str
+        Description attached to the output columns.
+    Returns
+    -------
+    table : astropy.table.Table
+        Table with the assigned properties.
+    """
+    d_props = data_props.colnames
+    dtypes = data_props.dtype
+    if fallback is not None:
+        data_props = append_fallbacks(data_props, fallback)
+    # create or load the nearest neighbour search tree
+    tree = get_search_tree(data_attr, tree_path)
+
+    message = "assign values from nearest data neighbour"
+    if threads > 1:
+        print(message + " with %d threads" % threads)
+    else:
+        print(message)
+    dist, idx_nearest = tree.query(
+        simul_attr, k=1, distance_upper_bound=r_max, n_jobs=threads)
+
+    # create a new output table
+    table = Table()
+    for i, (s_prop, d_prop) in enumerate(zip(s_props, d_props)):
+        table[s_prop] = Column(
+            # look up the property values of the nearest data neightbours and
+            # store them
+            data_props[d_prop][idx_nearest], dtype=dtypes[i],
+            description=description)
+    return table
 
 
 if __name__ == "__main__":
@@ -101,98 +264,12 @@ if __name__ == "__main__":
     data_attr = np.transpose([data[s] for s in args.d_attr])
     data_props = data[tuple(args.d_prop)]
     # this is an astropy.table.Table with shape (n_data, n_props)
-    n_props = len(data_props.columns)
-    n_data = len(data_props)
-
-    # get the property data type
-    if args.fallback is not None:
-        fallbacks = [f for f in args.fallback]
-        # convert the input fallback values to data of valid type
-        if len(fallbacks) != n_props:
-            raise ValueError(
-                "number of properties is %d, but number of fallbacks is %d" % (
-                    n_props, len(fallbacks)))
-        for i in range(n_props):
-            dtype = data_props.dtype[i]
-            colname = data_props.colnames[i]
-            # store the converted fallback values as astropy.table.Column
-            # for compatibility with the data table
-            try:
-                if dtype.kind == "b":  # conversion of booleans
-                    if args.fallback[i].upper() == "TRUE":
-                        fallbacks[i] = Column([True], colname, dtype=dtype)
-                    elif args.fallback[i].upper() == "FALSE":
-                        fallbacks[i] = Column([False], colname, dtype=dtype)
-                    else:
-                        raise ValueError(
-                            ("expected boolean but the fallback '%s' " %
-                             args.fallback[i]) +
-                            "matches neither TRUE or FALSE")
-                else:
-                    fallbacks[i] = Column(
-                        [args.fallback[i]], colname, dtype=dtype)
-            except ValueError:
-                raise ValueError(
-                    "failed to convert fallback '%s' to type '%s'" % (
-                        args.fallback[i], dtype.str))
-        # Append the fallbacks into the property vectors. If neighbours are
-        # outside r_max, cKDTree.query will point to index len(property) and
-        # therefore at the newly append fallback value
-        fallback_row = Table(fallbacks)
-        data_props = vstack([data_props, fallback_row])
-
-    # create or load the nearest neighbour search tree
-    if os.path.exists(args.tree):
-        print("load existing search tree from: %s" % args.tree)
-        with open(args.tree, "rb") as f:
-            tree = pickle.load(f)
-        # verify the tree structure
-        if not isinstance(tree, cKDTree):
-            sys.exit("ERROR: pickled object ist not a 'cKDTree' instance")
-        n, m, = data_attr.shape
-        if tree.m != m or tree.n != n:
-            message = "ERROR: data with dimensions (%d, %d) does not " % (n, m)
-            message += "match loaded tree with (%d, %d)" % (tree.n, tree.m)
-            sys.exit(message)
-        # verify the data values to be sure that the data has not changed
-        # NOTE: this is much faster than creating a new tree every time
-        for i in range(m):
-            if not np.isclose(
-                    tree.data[:, i], data_attr[:, i], equal_nan=True).all():
-                message = "ERROR: data in dimension %d " % i
-                message += "of tree does not match data"
-                sys.exit(message)
-    else:
-        print("build search tree for '%s'" % ", ".join(args.d_attr))
-        tree = cKDTree(data_attr)
-        # write the tree if the path string is not empty
-        if args.tree != "":
-            print("write search tree to python pickle file")
-            if os.path.exists(os.path.dirname(args.tree)):
-                with open(args.tree, "wb") as f:
-                    pickle.dump(tree, f)
-            else:
-                sys.exit(
-                    "ERROR: folder does not exit: %s" %
-                    os.path.dirname(args.tree))
-
-    message = "assign values from nearest data neighbour"
-    if args.threads > 1:
-        print(message + " with %d threads" % args.threads)
-    else:
-        print(message)
-    dist, idx_nearest = tree.query(
-        simul_attr, k=1, distance_upper_bound=args.r_max, n_jobs=args.threads)
 
-    # create a new output table
-    table = Table()
-    for i, (s_prop, d_prop) in enumerate(zip(args.s_prop, args.d_prop)):
-        table[s_prop] = Column(
-            # look up the property values of the nearest data neightbours and
-            # store them
-            data_props[d_prop][idx_nearest], dtype=data_props.dtype[i],
-            description="drawn via %s from file: %s" % (
-                ", ".join(args.d_attr), args.data))
+    table = draw_property(
+        simul_attr, data_attr, data_props, args.s_prop, r_max=args.r_max,
+        fallback=args.fallback, tree_path=args.tree, threads=args.threads,
+        description="drawn via %s from file: %s" % (
+            ", ".join(args.d_attr), args.data))
 
     # write to specified output path
     print("write table to: %s" % args.output)
@@ -7,7 +7,7 @@ import numpy as np
 from astropy import units
 from astropy.table import Column, Table
 
-from table_tools import load_table
+from catalogue_io import load_table
 
 
 def magnification_correction(mag, kappa):
@@ -30,12 +30,13 @@ def footprint_area(RAmin, RAmax, DECmin, DECmax):
         Area within the bounds in square degrees.
     """
     # np.radians and np.degrees avoids rounding errors
-    sin_DEC_min, sin_DEC_max = np.sin(np.radians([DECmin, DECmax]))
+    sin_DEC_min = np.sin(np.radians(DECmin))
+    sin_DEC_max = np.sin(np.radians(DECmax))
     dRA = RAmax - RAmin
-    if RAmin > RAmax:
-        dRA += 360.0
+    # bounds that wrap around RA = 0
+    dRA = np.where(np.greater(RAmin, RAmax), dRA + 360.0, dRA)
     area = dRA * np.degrees(sin_DEC_max - sin_DEC_min)
-    return area
+    return area if np.ndim(area) > 0 else float(area)
 
 
 def next_DEC(area, RAmin, RAmax, current_DEC):
@@ -63,18 +64,13 @@ def next_DEC(area, RAmin, RAmax, current_DEC):
     # np.radians and np.degrees avoids rounding errors
     area_sterad = np.radians(np.radians(area))
     dRA = RAmax - RAmin
-    if RAmin > RAmax:
-        dRA += 360.0
+    # bounds that wrap around RA = 0
+    dRA = np.where(np.greater(RAmin, RAmax), dRA + 360.0, dRA)
     sin_current_DEC = np.sin(np.radians(current_DEC))
     arcsin_argument = area_sterad / np.radians(dRA) + sin_current_DEC
-    if arcsin_argument >= 1.0:
-        next_DEC = 90.0
-    elif arcsin_argument <= -1.0:
-        next_DEC = -90.0
-    else:
-        next_DEC_rad = np.arcsin(arcsin_argument)
-        next_DEC = np.degrees(next_DEC_rad)
-    return next_DEC
+    # tiles that extend beyond the poles end at the pole
+    next_DEC = np.degrees(np.arcsin(np.clip(arcsin_argument, -1.0, 1.0)))
+    return next_DEC if np.ndim(next_DEC) > 0 else float(next_DEC)
 
 
 def pointing_name(prefix, RAmin, RAmax, DECmin, DECmax):
@@ -107,6 +103,157 @@ def pointing_name(prefix, RAmin, RAmax, DECmin, DECmax):
     return "_".join(fragments)
 
 
+def register_footprint(footprint_file, survey, bounds):
+    """
+    Register the RA/DEC bounds of a survey in a footprint file. If the file
+    exists, its entries are preserved and the survey is added or updated.
+
+    Parameters
+    ----------
+    footprint_file : str
+        File in which the survey meta data is collected.
+    survey : str
+        Name to identify the survey in the footprint file.
+    bounds : list of float
+        Bounds of the survey in degrees: RA_min RA_max DEC_min DEC_max.
+
+    Returns
+    -------
+    area : float
+        Area of the survey in square degrees.
+    """
+    area = footprint_area(*bounds)
+    print("registering survey in: %s" % footprint_file)
+    if os.path.exists(footprint_file):
+        surveys = read_footprint_file(footprint_file)
+        if survey in surveys:  # update with current area
+            print(
+                "WARNING: survey '%s' already registered, updating values" %
+                survey)
+        surveys[survey] = (*bounds, area)
+    else:
+        surveys = {survey: (*bounds, area)}
+
+    # rewrite the footprint file with possibly updated footprint
+    with open(footprint_file, "w") as f:
+        f.write(
+            "# RA min/max               DEC min/max                " +
+            "AREA             FIELD NAME\n")
+        for name, props in surveys.items():
+            ra_min, ra_max, dec_min, dec_max, area_ = props
+            f.write(
+                "%11.7f %11.7f    %+11.7f %+11.7f    %13.7e    %s\n" % (
+                    ra_min, ra_max, dec_min, dec_max, area_, name))
+    return area
+
+
+def make_pointings(survey, bounds, grid):
+    """
+    Split a RA/DEC bound into a grid of equal area pointings.
+
+    Parameters
+    ----------
+    survey : str
+        Name of the survey, used as prefix of the pointing names.
+    bounds : list of float
+        Bounds of the footprint in degrees: RA_min RA_max DEC_min DEC_max.
+    grid : list of int
+        Number of pointings along the RA and the DEC axis (n_RA, n_DEC).
+
+    Returns
+    -------
+    pointing_names : list of str
+        Automatic names of the pointings.
+    bound_tuples : list of tuple
+        Bounds (RAmin, RAmax, DECmin, DECmax) of each pointing.
+    """
+    RAmin, RAmax, DECmin, DECmax = bounds
+    # get the grid shape
+    pointings_ra, pointings_dec = grid
+    n_pointings = pointings_ra * pointings_dec
+    area = footprint_area(RAmin, RAmax, DECmin, DECmax) / n_pointings
+    # split the footprint into equal RA columns
+    if RAmax >= RAmin:
+        RAs = np.linspace(RAmin, RAmax, pointings_ra + 1)
+    else:
+        RAs = np.linspace(RAmin, RAmax + 360.0, pointings_ra + 1)
+        RAs[RAs >= 360.0] -= 360.0
+    ra_mins = RAs[:-1]
+    ra_maxs = RAs[1:]
+    # split the RA columns in DEC rows such that all pointings have the
+    # same area (up to rounding errors), the k-th declination cut encloses
+    # the area of k pointings
+    print(
+        "create %d x %d = %d pointings with %.7e sqdeg each" % (
+            pointings_ra, pointings_dec, n_pointings, area))
+    DECs = next_DEC(
+        area * np.arange(pointings_dec + 1), RAs[0], RAs[1], DECmin)
+    DECs[-1] = DECmax
+    dec_mins = DECs[:-1]
+    dec_maxs = DECs[1:]
+    # combine the RA/DEC bounds
+    bound_tuples = [
+        (*ras, *decs) for decs, ras in product(
+            zip(dec_mins, dec_maxs), zip(ra_mins, ra_maxs))]
+    pointing_names = [
+        pointing_name(survey, *bound_tuple)
+        for bound_tuple in bound_tuples]
+    return pointing_names, bound_tuples
+
+
+def write_pointings_file(pointings_file, pointing_names, bound_tuples):
+    """
+    Write a file that defines the pointing boundaries.
+
+    Parameters
+    ----------
+    pointings_file : str
+        File in which the pointing boundaries are collected.
+    pointing_names : list of str
+        Names of the pointings.
+    bound_tuples : list of tuple
+        Bounds (RAmin, RAmax, DECmin, DECmax) of each pointing.
+    """
+    print("write pointing file: %s" % pointings_file)
+    name_len = max(len(name) for name in pointing_names)
+    with open(pointings_file, "w") as f:
+        for bounds, name in zip(bound_tuples, pointing_names):
+            # line format: tile name, RAmin, RAmax, DECmin, DECmax
+            f.write(
+                "%s    %11.7f    %11.7f    %+11.7f    %+11.7f\n" % (
+                    name.ljust(name_len), *bounds))
+
+
+def read_pointings_file(pointings_file):
+    """
+    Read the pointing boundaries from a pointings file.
+
+    Parameters
+    ----------
+    pointings_file : str
+        File in which the pointing boundaries are collected.
+
+    Returns
+    -------
+    pointing_names : list of str
+        Names of the pointings.
+    bound_tuples : list of tuple
+        Bounds (RAmin, RAmax, DECmin, DECmax) of each pointing.
+    """
+    pointing_names = []
+    bound_tuples = []
+    with open(pointings_file) as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0 or line.startswith("#"):
+                continue
+            # line format: tile name, RAmin, RAmax, DECmin, DECmax
+            name, *bounds = line.split()
+            pointing_names.append(name)
+            bound_tuples.append(tuple(float(b) for b in bounds))
+    return pointing_names, bound_tuples
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(
@@ -114,7 +261,7 @@ if __name__ == "__main__":
                     'bounds, represented by a STOMP map. The bounds are '
                     'appended to the file ./footprint.txt. Optionally split '
                     'the footprint into equal area pointings, exported to '
-                    'a pointings list file.')
+                    'a pointings list file and a binary tile table (.npy).')
     parser.add_argument(
         '-b', '--bounds', nargs=4, type=float, required=True,
         help='bounds of polygon in degrees: RA_min RA_max DEC_min DEC_max')
@@ -129,11 +276,21 @@ if __name__ == "__main__":
         '-p', '--pointings-file',
         help='file in which the pointing boundaries are collected '
              '(default: do not create this file)')
-    parser.add_argument(
+    tiling_group = parser.add_mutually_exclusive_group()
+    tiling_group.add_argument(
         '--grid', nargs=2, type=int,
         help='number of pointings along the RA and the DEC axis of the '
              'pointing grid (n_RA x n_DEC), format: n_RA n_DEC '
              '(requires --pointings-file)')
+    tiling_group.add_argument(
+        '--tile-area', type=float,
+        help='target area of the pointings in square degrees, the number of '
+             'pointings per declination band is adapted such that all '
+             'pointings have the same area (requires --pointings-file)')
+    parser.add_argument(
+        '--all-surveys', action='store_true',
+        help='create the pointings of all surveys registered in the '
+             'footprint file instead of only --survey')
     args = parser.parse_args()
 
     RAmin, RAmax, DECmin, DECmax = args.bounds
@@ -146,77 +303,41 @@ if __name__ == "__main__":
     if DECmax <= DECmin:
         sys.exit("ERROR: DEC_min must be lower than DEC_max")
     # check pointings related arguements
-    if args.pointings_file is not None and args.grid is None:
+    tiling = args.grid is not None or args.tile_area is not None
+    if args.pointings_file is not None and not tiling:
         parser.error(
-            "--pointings-file requires --grid")
-    if args.grid is not None and args.pointings_file is None:
+            "--pointings-file requires --grid or --tile-area")
+    if tiling and args.pointings_file is None:
         parser.error(
-            "--grid requires --pointings-file")
+            "--grid and --tile-area require --pointings-file")
+    if args.all_surveys and args.pointings_file is None:
+        parser.error("--all-surveys requires --pointings-file")
+    if args.tile_area is not None and args.tile_area <= 0.0:
+        parser.error("--tile-area must be positive")
 
     # create footprint.txt file that lists the RA/DEC boundaries of this
     # survey (and others created with this script in the same folder)
-    area = footprint_area(*args.bounds)
-    print("registering survey in: %s" % args.footprint_file)
-    if os.path.exists(args.footprint_file):
-        surveys = read_footprint_file(args.footprint_file)
-        if args.survey in surveys:  # update with current area
-            print(
-                "WARNING: survey '%s' already registered, updating values" %
-                args.survey)
-        surveys[args.survey] = (*args.bounds, area)
-    else:
-        surveys = {args.survey: (*args.bounds, area)}
-
-    # rewrite the footprint file with possibly updated footprint
-    with open(args.footprint_file, "w") as f:
-        f.write(
-            "# RA min/max               DEC min/max                " +
-            "AREA             FIELD NAME\n")
-        for survey, props in surveys.items():
-            ra_min, ra_max, dec_min, dec_max, area = props
-            f.write(
-                "%11.7f %11.7f    %+11.7f %+11.7f    %13.7e    %s\n" % (
-                    ra_min, ra_max, dec_min, dec_max, area, survey))
+    register_footprint(args.footprint_file, args.survey, args.bounds)
 
     # create the pointings file
     if args.pointings_file is not None:
-        # get the grid shape
-        pointings_ra, pointings_dec = args.grid
-        n_pointings = pointings_ra * pointings_dec
-        area = footprint_area(RAmin, RAmax, DECmin, DECmax) / n_pointings
-        # split the footprint into equal RA columns
-        if RAmax >= RAmin:
-            RAs = np.linspace(RAmin, RAmax, pointings_ra + 1)
+        # imported here since footprint_tiling uses this module
+        from footprint_tiling import tile_footprints, write_tile_files
+
+        if args.all_surveys:
+            surveys = read_footprint_file(args.footprint_file)
+        else:
+            surveys = {args.survey: args.bounds}
+        if args.grid is not None and not args.all_surveys:
+            pointing_names, bound_tuples = make_pointings(
+                args.survey, args.bounds, args.grid)
         else:
-            RAs = np.linspace(RAmin, RAmax + 360.0, pointings_ra + 1)
-            RAs[RAs >= 360.0] -= 360.0
-        ra_mins = RAs[:-1]
-        ra_maxs = RAs[1:]
-        # split the RA columns in DEC rows such that all pointings have the
-        # same area (up to rounding errors)
-        DECs = [DECmin]
-        print(
-            "create %d x %d = %d pointings with %.7e sqdeg each" % (
-                pointings_ra, pointings_dec, n_pointings, area))
-        for i in range(pointings_dec):
-            # calculate the next declination cut using the width in RA and
-            # the targeted pointing area
-            DECs.append(next_DEC(area, RAs[0], RAs[1], DECs[-1]))
-        dec_mins = DECs[:-1]
-        dec_maxs = DECs[1:]
-        # generate a file that defines the pointing boundaries
-        print("write pointing file: %s" % args.pointings_file)
-        # combine the RA/DEC bounds
-        bound_tuples = [
-            (*ras, *decs) for decs, ras in product(
-                zip(dec_mins, dec_maxs), zip(ra_mins, ra_maxs))]
-        pointing_names = [
-            pointing_name(args.survey, *bound_tuple)
-            for bound_tuple in bound_tuples]
-        name_len = max(len(name) for name in pointing_names)
-        with open(args.pointings_file, "w") as f:
-            for bounds, name in zip(bound_tuples, pointing_names):
-                # line format: tile name, RAmin, RAmax, DECmin, DECmax
-                f.write(
-                    "%s    %11.7f    %11.7f    %+11.7f    %+11.7f\n" % (
-                        name.ljust(name_len), *bounds))
+            # all surveys are tiled at once
+            tiles = tile_footprints(
+                surveys, tile_area=args.tile_area, grid=args.grid)
+            pointing_names, bound_tuples = tiles.names, tiles.bound_tuples
+            print("create %d pointings in %d survey(s)" % (
+                len(tiles), len(surveys)))
+        # generate a file that defines the pointing boundaries and its
+        # binary tile table
+        write_tile_files(args.pointings_file, pointing_names, bound_tuples)
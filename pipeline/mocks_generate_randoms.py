@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+import argparse
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import md5
+from multiprocessing import cpu_count
+
+import numpy as np
+from astropy.table import Column, Table
+
+from catalogue_io import count_rows, open_writer, table_format
+from mocks_generate_footprint import footprint_area, read_pointings_file
+from pointing_grid import assign_pointings, pointing_lookup
+from table_tools import read_footprint_file
+
+
+def chunk_generator(seed, chunk):
+    """
+    Create the random generator of a chunk of randoms. The chunks draw from
+    independent streams (numpy.random.SeedSequence) of the same seed, such
+    that the randoms do not depend on the order or the process in which the
+    chunks are generated.
+
+    Parameters
+    ----------
+    seed : str
+        String to seed the random generator.
+    chunk : int
+        Index of the chunk.
+
+    Returns
+    -------
+    rng : numpy.random.Generator
+        Random generator of the chunk.
+    """
+    entropy = int(md5(bytes(seed, "utf-8")).hexdigest(), 16)
+    return np.random.Generator(np.random.PCG64(
+        np.random.SeedSequence(entropy, spawn_key=(chunk,))))
+
+
+def uniform_randoms(rng, n_randoms, RAmin, RAmax, DECmin, DECmax):
+    """
+    Draw positions uniformly distributed in area within a RA/DEC bound, i.e.
+    uniform in RA and in sin(DEC). If RAmin > RAmax, the bound wraps around
+    RA = 0.
+
+    Parameters
+    ----------
+    rng : numpy.random.Generator
+        Random generator.
+    n_randoms : int
+        Number of positions.
+    RAmin : float
+        Minimum right ascension of the bounds.
+    RAmax : float
+        Maximum right ascension of the bounds.
+    DECmin : float
+        Minimum declination of the bounds.
+    DECmax : float
+        Maximum declination of the bounds.
+
+    Returns
+    -------
+    ra : array_like
+        Right ascension in degrees.
+    dec : array_like
+        Declination in degrees.
+    """
+    dRA = RAmax - RAmin
+    if RAmin > RAmax:
+        dRA += 360.0
+    ra = np.mod(RAmin + dRA * rng.random(n_randoms), 360.0)
+    sin_DEC_min, sin_DEC_max = np.sin(np.radians([DECmin, DECmax]))
+    sin_dec = rng.uniform(sin_DEC_min, sin_DEC_max, n_randoms)
+    dec = np.degrees(np.arcsin(sin_dec))
+    # keep the positions within the bounds (see mask_ra_dec) despite the
+    # rounding errors
+    ra[ra == RAmax] = RAmin
+    dec = np.clip(dec, DECmin, np.nextafter(DECmax, DECmin))
+    return ra, dec
+
+
+def check_pointings(bounds, pointings, tolerance=1e-6):
+    """
+    Check that the pointings lie within the RA/DEC bound of the survey and
+    cover it, e.g. to reject the pointings file of a different survey.
+
+    Parameters
+    ----------
+    bounds : list of float
+        Bounds in degrees: RA_min RA_max DEC_min DEC_max.
+    pointings : list of tuple
+        Bounds (RAmin, RAmax, DECmin, DECmax) of the pointings.
+    tolerance : float
+        Tolerance in degrees for the rounding of the bounds in the pointings
+        file.
+
+    Raises
+    ------
+    ValueError
+        If a pointing exceeds the bounds or the pointings do not cover the
+        bounds.
+    """
+    RAmin, RAmax, DECmin, DECmax = bounds
+    pointings = np.asarray(pointings, dtype=np.float64).reshape(-1, 4)
+    # RA relative to the lower bound of the survey, unwrapped at RA = 0
+    width = np.mod(RAmax - RAmin, 360.0) or 360.0
+    ra_start = np.mod(pointings[:, 0] - RAmin + tolerance, 360.0) - tolerance
+    ra_width = np.mod(pointings[:, 1] - pointings[:, 0], 360.0)
+    ra_width[ra_width == 0.0] = 360.0
+    outside = (
+        (ra_start + ra_width > width + tolerance) |
+        (pointings[:, 2] < DECmin - tolerance) |
+        (pointings[:, 3] > DECmax + tolerance))
+    if np.any(outside):
+        raise ValueError(
+            "%d of %d pointings are not within the bounds %s" % (
+                np.count_nonzero(outside), len(pointings),
+                " ".join("%.7f" % b for b in bounds)))
+    area = footprint_area(*bounds)
+    covered = np.sum(footprint_area(*pointings.T))
+    if abs(covered - area) > 1e-4 * area:
+        raise ValueError(
+            "the pointings cover %.3f sqdeg of %.3f sqdeg within the "
+            "bounds" % (covered, area))
+
+
+def random_chunk(args):
+    """
+    Generate a chunk of randoms with their pointing index.
+
+    Parameters
+    ----------
+    args : tuple
+        Seed string, chunk index, number of randoms, bounds (RAmin, RAmax,
+        DECmin, DECmax), pointing bounds (list of tuples or None), their
+        lookup (see pointing_grid.pointing_lookup) and the column names of
+        RA, DEC and the pointing index.
+
+    Returns
+    -------
+    table : astropy.table.Table
+        Table with the randoms.
+    """
+    seed, chunk, n_randoms, bounds, pointings, lookup, names = args
+    ra_name, dec_name, pointing_name = names
+    rng = chunk_generator(seed, chunk)
+    ra, dec = uniform_randoms(rng, n_randoms, *bounds)
+    table = Table([
+        Column(ra, name=ra_name, unit="deg"),
+        Column(dec, name=dec_name, unit="deg")])
+    if pointings is not None:
+        table[pointing_name] = assign_pointings(ra, dec, pointings, lookup)
+    return table
+
+
+def generate_randoms(
+        output, bounds, n_randoms, seed, pointings=None, chunk_size=10000000,
+        processes=1, o_format=None, compression="gzip",
+        names=("ra", "dec", "pointing")):
+    """
+    Generate a random catalogue with uniform density within a RA/DEC bound.
+    The randoms are drawn in chunks with independent random streams (see
+    chunk_generator), in parallel if requested, and appended to the output in
+    the order of the chunks while the next chunks are generated, such that
+    the memory usage is bounded by the chunk size. The randoms depend on the
+    seed and the chunk size, but not on the number of processes.
+
+    Parameters
+    ----------
+    output : str
+        File path of the output catalogue (FITS, HDF5 or column store).
+    bounds : list of float
+        Bounds in degrees: RA_min RA_max DEC_min DEC_max.
+    n_randoms : int
+        Number of randoms.
+    seed : str
+        String to seed the random generator.
+    pointings : list of tuple
+        Bounds (RAmin, RAmax, DECmin, DECmax) of the pointings, adds the
+        index of the pointing of each random (optional). The pointings must
+        cover the bounds (see check_pointings).
+    chunk_size : int
+        Number of randoms per chunk.
+    processes : int
+        Number of parallel processes.
+    o_format : str
+        Format of the output catalogue (see catalogue_io.table_format).
+    compression : str
+        Compression filter of HDF5 output ("gzip", "lzf" or None).
+    names : tuple of str
+        Column names of RA, DEC and the pointing index.
+
+    Returns
+    -------
+    n_randoms : int
+        Number of randoms written.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk size must be positive")
+    if pointings is not None:
+        check_pointings(bounds, pointings)
+        lookup = pointing_lookup(pointings)
+    else:
+        lookup = None
+    tasks = (
+        (seed, i, min(chunk_size, n_randoms - start), tuple(bounds),
+         pointings, lookup, tuple(names))
+        for i, start in enumerate(range(0, n_randoms, chunk_size)))
+    if table_format(output, o_format) == "hdf5":
+        writer = open_writer(
+            output, o_format, background=True, compression=compression)
+    else:
+        writer = open_writer(output, o_format, background=True)
+    try:
+        if processes > 1:
+            with ProcessPoolExecutor(processes) as pool:
+                # at most two pending chunks per process are held in memory
+                pending = deque()
+                for task in tasks:
+                    pending.append(pool.submit(random_chunk, task))
+                    if len(pending) >= 2 * processes:
+                        writer.write(pending.popleft().result())
+                while len(pending) > 0:
+                    writer.write(pending.popleft().result())
+        else:
+            for task in tasks:
+                writer.write(random_chunk(task))
+    finally:
+        writer.close()
+    return writer.nrows
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description='Generate a random catalogue with uniform density '
+                    '(uniform in RA and sin(DEC)) within the bounds of a '
+                    'survey registered in a footprint file (see '
+                    'mocks_generate_footprint.py). Optionally the index of '
+                    'the pointing of each random is added from the pointings '
+                    'file. The randoms are generated in chunks with '
+                    'independent, reproducible random streams and streamed '
+                    'to the output.')
+    parser.add_argument(
+        '-f', '--footprint-file', default="footprint.txt",
+        help='file in which the survey meta data is collected '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--survey', required=True,
+        help='name of the survey in the footprint file')
+    parser.add_argument(
+        '-p', '--pointings-file',
+        help='file with the pointing boundaries of the survey, adds the '
+             'pointing index column')
+    number_group = parser.add_mutually_exclusive_group(required=True)
+    number_group.add_argument(
+        '-n', '--number', type=int, help='number of randoms')
+    number_group.add_argument(
+        '--density', type=float,
+        help='number of randoms per square degree')
+    number_group.add_argument(
+        '--factor', type=float,
+        help='number of randoms as multiple of the number of objects in the '
+             'data table (requires --data)')
+    parser.add_argument(
+        '--data', help='file path of the data table used with --factor')
+    parser.add_argument(
+        '-o', '--output', required=True, help='file path of output table')
+    parser.add_argument(
+        '--o-format',
+        help='format of the output table: fits, hdf5 or columns (column '
+             'store) (default: guessed from the file extension)')
+    parser.add_argument(
+        '--ra', default='ra',
+        help='column name of RA (default: %(default)s)')
+    parser.add_argument(
+        '--dec', default='dec',
+        help='column name of DEC (default: %(default)s)')
+    parser.add_argument(
+        '--pointing', default='pointing',
+        help='column name of the pointing index (default: %(default)s)')
+    parser.add_argument(
+        '--seed', default='KV450',
+        help='string to seed the random generator (default: %(default)s)')
+    parser.add_argument(
+        '--chunk-size', type=int, default=10000000,
+        help='number of randoms generated at once, the randoms depend on '
+             'this value (default: %(default)s)')
+    parser.add_argument(
+        '--threads', type=int, default=cpu_count(),
+        help='number of parallel processes (default: %(default)s)')
+    parser.add_argument(
+        '--compression', default='gzip', choices=('gzip', 'lzf', 'none'),
+        help='compression filter of HDF5 output tables '
+             '(default: %(default)s)')
+    args = parser.parse_args()
+
+    setattr(args, "threads", min(cpu_count(), max(1, args.threads)))
+    if args.factor is not None and args.data is None:
+        parser.error("--factor requires --data")
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be positive")
+    surveys = read_footprint_file(args.footprint_file)
+    if args.survey not in surveys:
+        sys.exit("ERROR: survey '%s' not found in %s" % (
+            args.survey, args.footprint_file))
+    *bounds, area = surveys[args.survey]
+
+    if args.number is not None:
+        n_randoms = args.number
+    elif args.density is not None:
+        n_randoms = int(round(args.density * area))
+    else:
+        n_randoms = int(round(args.factor * count_rows(args.data)))
+    if n_randoms < 1:
+        sys.exit("ERROR: the number of randoms must be positive")
+    if args.pointings_file is not None:
+        pointing_names, pointings = read_pointings_file(args.pointings_file)
+    else:
+        pointings = None
+
+    if pointings is not None:
+        try:
+            check_pointings(bounds, pointings)
+        except ValueError as e:
+            sys.exit("ERROR: %s: %s" % (args.pointings_file, e))
+
+    print("generate %d randoms within %.3f sqdeg of %s" % (
+        n_randoms, area, args.survey))
+    print("write table to: %s" % args.output)
+    generate_randoms(
+        args.output, bounds, n_randoms, args.seed, pointings,
+        args.chunk_size, args.threads, args.o_format,
+        None if args.compression == 'none' else args.compression,
+        (args.ra, args.dec, args.pointing))
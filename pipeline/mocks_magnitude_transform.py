@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+import argparse
+import sys
+
+import numpy as np
+from astropy.table import Column, Table
+
+from catalogue_io import iter_chunks, open_writer, table_format
+from column_store import ColumnStore
+from mocks_dc2_mag_evolved import mag_correction
+from mocks_flux_magnification import magnification_correction
+
+
+def transformed_names(filters, evolution=False, magnification=False):
+    """
+    Get the column names of the transformed model magnitudes, i.e. the
+    magnitude columns with the suffix _evo (evolution correction) and _mag
+    (magnification correction) appended.
+
+    Parameters
+    ----------
+    filters : list of str
+        Model magnitude column names.
+    evolution : bool
+        Whether the evolution correction is applied.
+    magnification : bool
+        Whether the magnification correction is applied.
+
+    Returns
+    -------
+    names : list of str
+        Transformed magnitude column names, in the order of the filters.
+    """
+    suffix = ("_evo" if evolution else "") + ("_mag" if magnification else "")
+    return [filt + suffix for filt in filters]
+
+
+def magnitude_offset(redshift=None, kappa=None):
+    """
+    Compute the magnitude shift of the evolution (mag_correction) and the
+    magnification (magnification_correction) corrections. Both corrections
+    are independent of the filter, such that the shift is computed once per
+    object and subtracted from all bands.
+
+    Parameters
+    ----------
+    redshift : array_like
+        True galaxy redshift, applies the evolution correction (optional).
+    kappa : array_like
+        Convergence field at the galaxy positions, applies the magnification
+        correction (optional).
+
+    Returns
+    -------
+    offset : array_like
+        Shift subtracted from the model magnitudes (float64).
+    """
+    if redshift is None and kappa is None:
+        raise ValueError("no magnitude correction selected")
+    n_objects = len(redshift if redshift is not None else kappa)
+    offset = np.zeros(n_objects)
+    if redshift is not None:
+        offset -= mag_correction(0.0, np.asarray(redshift, dtype=np.float64))
+    if kappa is not None:
+        offset -= magnification_correction(
+            0.0, np.asarray(kappa, dtype=np.float64))
+    return offset
+
+
+def transform_magnitudes(data, filters, redshift=None, convergence=None):
+    """
+    Apply the evolution and magnification corrections to all model
+    magnitudes in a single pass.
+
+    Parameters
+    ----------
+    data : astropy.table.Table
+        Table with the model magnitudes and the redshift and convergence
+        columns.
+    filters : list of str
+        Model magnitude column names.
+    redshift : str
+        Column name of the true redshift, applies the evolution correction
+        (optional).
+    convergence : str
+        Column name of the convergence, applies the magnification correction
+        (optional).
+
+    Returns
+    -------
+    table : astropy.table.Table
+        Table with the transformed magnitudes (float32, see
+        transformed_names).
+    """
+    offset = magnitude_offset(
+        None if redshift is None else data[redshift],
+        None if convergence is None else data[convergence])
+    names = transformed_names(
+        filters, redshift is not None, convergence is not None)
+    table = Table()
+    for filt, name in zip(filters, names):
+        mag = np.empty(len(offset), dtype=np.float32)
+        np.subtract(
+            np.asarray(data[filt]), offset, out=mag, casting="same_kind")
+        table[name] = Column(
+            mag, unit="mag", copy=False,
+            description=column_description(redshift, convergence))
+    return table
+
+
+def column_description(redshift=None, convergence=None):
+    """
+    Description of the transformed magnitude columns.
+    """
+    corrections = []
+    if redshift is not None:
+        corrections.append("evolution")
+    if convergence is not None:
+        corrections.append("magnification")
+    return "%s corrected model magnitude" % " and ".join(corrections)
+
+
+def transform_store(
+        path, filters, redshift=None, convergence=None, chunk_size=1000000,
+        overwrite=False):
+    """
+    Apply the evolution and magnification corrections to all model
+    magnitudes of a column store in place. The transformed columns are
+    allocated as temporary files (float32) and filled chunk by chunk through
+    their memory maps, i.e. each input column is read once and no
+    intermediate tables are created. The columns are added to the store once
+    they are filled, an interrupted run leaves the store unchanged.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the column store.
+    filters : list of str
+        Model magnitude column names.
+    redshift : str
+        Column name of the true redshift, applies the evolution correction
+        (optional).
+    convergence : str
+        Column name of the convergence, applies the magnification correction
+        (optional).
+    chunk_size : int
+        Number of rows processed at once.
+    overwrite : bool
+        Whether existing transformed columns are replaced.
+
+    Returns
+    -------
+    names : list of str
+        Names of the transformed magnitude columns.
+    """
+    if redshift is None and convergence is None:
+        raise ValueError("no magnitude correction selected")
+    if chunk_size < 1:
+        raise ValueError("chunk size must be positive")
+    store = ColumnStore(path)
+    required = list(filters) + [
+        col for col in (redshift, convergence) if col is not None]
+    missing = [col for col in required if col not in store]
+    if len(missing) > 0:
+        raise KeyError(
+            "column store does not contain columns: %s" % ", ".join(missing))
+    names = transformed_names(
+        filters, redshift is not None, convergence is not None)
+    existing = [name for name in names if name in store]
+    if len(existing) > 0 and not overwrite:
+        raise ValueError("columns already exist: %s" % ", ".join(existing))
+    provenance = {
+        "stage": "magnitudes", "redshift": redshift,
+        "convergence": convergence}
+    mags = {filt: store.column(filt).data for filt in filters}
+    z = None if redshift is None else store.column(redshift).data
+    kappa = None if convergence is None else store.column(convergence).data
+    mapped = {
+        name: store.open_column(name, np.float32, overwrite=overwrite)
+        for name in names}
+    for start in range(0, len(store), chunk_size):
+        rows = slice(start, min(start + chunk_size, len(store)))
+        offset = magnitude_offset(
+            None if z is None else z[rows],
+            None if kappa is None else kappa[rows])
+        for filt, name in zip(filters, names):
+            np.subtract(
+                mags[filt][rows], offset, out=mapped[name][rows],
+                casting="same_kind")
+    for filt, name in zip(filters, names):
+        store.close_column(
+            name, mapped.pop(name), unit="mag",
+            description=column_description(redshift, convergence),
+            provenance=dict(provenance, source=filt))
+    return names
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description='Apply the evolution and the magnification corrections '
+                    'to the model magnitudes in a single pass. The corrected '
+                    'magnitudes (float32) are added in place to a column '
+                    'store input, otherwise they are written to a new table. '
+                    'The input is processed in chunks.')
+
+    data_group = parser.add_argument_group('data')
+    data_group.add_argument(
+        '-i', '--input', required=True, help='file path of input data table')
+    data_group.add_argument(
+        '--i-format',
+        help='format of the input table: fits, hdf5 or columns (column '
+             'store) (default: guessed from the file extension)')
+    data_group.add_argument(
+        '-o', '--output',
+        help='file path of output table containing only the corrected '
+             'magnitudes (default: add the columns to the input column '
+             'store)')
+    data_group.add_argument(
+        '--o-format',
+        help='format of the output table: fits, hdf5 or columns (column '
+             'store) (default: guessed from the file extension)')
+
+    params_group = parser.add_argument_group('parameters')
+    params_group.add_argument(
+        '--filters', nargs='*', required=True,
+        help='list of table column names providing model magnitudes')
+    params_group.add_argument(
+        '--redshift',
+        help='table column name of the true redshift, applies the evolution '
+             'correction')
+    params_group.add_argument(
+        '--convergence',
+        help='table column name of convergence, applies the magnification '
+             'correction')
+    params_group.add_argument(
+        '--chunk-size', type=int, default=1000000,
+        help='number of rows processed at once (default: %(default)s)')
+    params_group.add_argument(
+        '--overwrite', action='store_true',
+        help='replace existing corrected magnitude columns of the input '
+             'column store')
+    args = parser.parse_args()
+
+    if args.redshift is None and args.convergence is None:
+        parser.error("at least one of --redshift and --convergence required")
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be positive")
+    in_place = args.output is None
+    if in_place and table_format(args.input, args.i_format) != "columns":
+        parser.error("--output is required if the input is not a column store")
+
+    print("use input filters: %s" % ", ".join(args.filters))
+    if in_place:
+        print("add columns to: %s" % args.input)
+        try:
+            names = transform_store(
+                args.input, args.filters, args.redshift, args.convergence,
+                args.chunk_size, args.overwrite)
+        except (KeyError, ValueError) as e:
+            sys.exit("ERROR: %s" % e.args[0])
+    else:
+        columns = list(args.filters) + [
+            col for col in (args.redshift, args.convergence)
+            if col is not None]
+        print("write table to: %s" % args.output)
+        writer = open_writer(args.output, args.o_format, background=True)
+        try:
+            for offset, chunk in iter_chunks(
+                    args.input, args.i_format, columns, args.chunk_size):
+                writer.write(transform_magnitudes(
+                    chunk, args.filters, args.redshift, args.convergence))
+        finally:
+            writer.close()
+        names = transformed_names(
+            args.filters, args.redshift is not None,
+            args.convergence is not None)
+    print("corrected magnitudes: %s" % ", ".join(names))
@@ -1,14 +1,506 @@
 #!/usr/bin/env python3
 import argparse
+import json
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import md5
+from multiprocessing import cpu_count
 
 import numpy as np
 from astropy import units
 from astropy.table import Column, Table
 
-from table_tools import load_table
+from catalogue_io import load_table
+from condition_maps import ConditionMap, index_nside
+
+
+# multipliers and key increments of the Philox4x32-10 generator
+PHILOX_M = (0xD2511F53, 0xCD9E8D57)
+PHILOX_W = (0x9E3779B9, 0xBB67AE85)
+PHILOX_ROUNDS = 10
+
+# default number of rows of the (filter, row range) tiles of realise_bands
+TILE_SIZE = 262144
+
+# version of the realisation recipe layout (see realisation_recipe)
+RECIPE_VERSION = 1
+
+
+def realisation_column_names(filt):
+    """
+    Find the output column names of a magnitude realisation depending on
+    whether evolution correction or magnification was applied to the model
+    magnitudes.
+    Parameters
+    ----------
+    filt : str
+        Table column name of the model magnitudes.
+    Returns
+    -------
+    key : str
+        Column name of the magnitude realisation.
+    keyerr : str
+        Column name of the magnitude realisation error.
+    """
+    if "_evo" in filt:
+        key = filt.replace("_evo", "_obs")
+        keyerr = filt.replace("_evo", "_obserr")
+    else:
+        if filt.endswith("_mag"):
+            key = filt[:-4] + "_obs_mag"
+            keyerr = filt[:-4] + "_obserr_mag"
+        else:
+            key = filt + "_obs"
+            keyerr = filt + "_obserr"
+    return key, keyerr
+
+
+def noise_key(seed, band):
+    """
+    Create the key of the counter-based random generator (see philox4x32)
+    of a filter.
+    Parameters
+    ----------
+    seed : str
+        String to seed the random generator.
+    band : str
+        Name of the filter, such that the noise does not depend on the order
+        or the number of processed filters.
+    Returns
+    -------
+    key : tuple of int
+        Two 32 bit key words from the md5 hash of the seed and band strings.
+    """
+    hashval = md5(bytes("%s:%s" % (seed, band), "utf-8")).digest()
+    return tuple(int(word) for word in np.frombuffer(hashval[:8], dtype="<u4"))
+
+
+def philox4x32(counter, key):
+    """
+    Philox4x32-10 counter-based random generator (Salmon et al. 2011), maps
+    a 128 bit counter and a 64 bit key to 128 random bits. Each counter is
+    processed independently, i.e. any subset of counters reproduces the
+    random bits of the full set.
+    Parameters
+    ----------
+    counter : list of array_like
+        Four 32 bit words of the counters, arrays or scalars that broadcast
+        to the shape of the output.
+    key : tuple of int
+        Two 32 bit key words.
+    Returns
+    -------
+    words : list of array_like
+        Four 32 bit random words of each counter (stored as uint64).
+    """
+    mask = np.uint64(0xFFFFFFFF)
+    x0, x1, x2, x3 = [
+        np.asarray(word, dtype=np.uint64) & mask for word in counter]
+    k0, k1 = key
+    for i in range(PHILOX_ROUNDS):
+        if i > 0:  # bump the key
+            k0 = (k0 + PHILOX_W[0]) & 0xFFFFFFFF
+            k1 = (k1 + PHILOX_W[1]) & 0xFFFFFFFF
+        # 32 x 32 bit products are exact in 64 bit
+        prod0 = x0 * np.uint64(PHILOX_M[0])
+        prod1 = x2 * np.uint64(PHILOX_M[1])
+        x0, x1, x2, x3 = (
+            (prod1 >> np.uint64(32)) ^ x1 ^ np.uint64(k0), prod1 & mask,
+            (prod0 >> np.uint64(32)) ^ x3 ^ np.uint64(k1), prod0 & mask)
+    return [x0, x1, x2, x3]
+
+
+def standard_normal_noise(seed, band, object_ids, realisation=0):
+    """
+    Draw standard normal noise for a set of objects with a counter-based
+    random generator keyed by the seed and the filter. The counter of each
+    object holds its ID and the realisation index, such that the noise of an
+    object does not depend on the filter order, on the other objects
+    processed or on how the catalogue is split into chunks.
+    Parameters
+    ----------
+    seed : str
+        String to seed the random generator.
+    band : str
+        Name of the filter.
+    object_ids : array_like
+        Stable, non-negative integer ID of each object, e.g. its row index
+        in the full catalogue.
+    realisation : int
+        Index of the realisation.
+    Returns
+    -------
+    noise : array_like
+        Standard normal random numbers of the objects.
+    """
+    ids = np.asarray(object_ids).astype(np.uint64)
+    words = philox4x32(
+        [ids, ids >> np.uint64(32), realisation, 0], noise_key(seed, band))
+    # two uniform numbers in [0, 1) with 53 bit resolution
+    u1, u2 = [
+        ((hi >> np.uint64(5)) * 67108864.0 + (lo >> np.uint64(6))) / 2.0**53
+        for hi, lo in (words[:2], words[2:])]
+    # Box-Muller transform
+    noise = np.sqrt(-2.0 * np.log1p(-u1))
+    noise *= np.cos(2.0 * np.pi * u2)
+    return noise
+
+
+def realise_magnitudes(
+        model_mags, mag_limit, noise, sn_factor=None, significance=1.0,
+        sn_limit=0.2, sn_detect=1.0, out=None):
+    """
+    Compute magnitude realisations from the model magnitudes and a draw of
+    standard normal noise.
+    Parameters
+    ----------
+    model_mags : array_like
+        Model magnitudes.
+    mag_limit : float or array_like
+        Magnitude limit of the filter, either a single value or the value of
+        each object.
+    noise : array_like
+        Standard normal random numbers, either with the shape of model_mags
+        or with an additional leading axis for multiple realisations.
+    sn_factor : array_like
+        Correction factors for the signal-to-noise ratio of extended sources
+        (optional).
+    significance : float
+        Significance of detection against magnitude limits.
+    sn_limit : float
+        Lower numerical limit for the signal-to-noise ratio.
+    sn_detect : float
+        Limiting signal-to-noise ratio for object detection.
+    out : tuple of array_like
+        Preallocated float32 arrays with the shape of noise that receive the
+        magnitude realisations and their errors (optional).
+    Returns
+    -------
+    real_mags : array_like
+        Magnitude realisations (float32), the shape is that of noise.
+    real_mags_err : array_like
+        Errors of the magnitude realisations (float32).
+    """
+    non_detection_magnitude = 99.0  # inserted for non-detections
+    # compute the model flux
+    model_flux = np.power(10.0, -0.4 * np.asarray(model_mags))
+    # compute the flux error from the magnitude limit
+    flux_err = np.power(10.0, -0.4 * mag_limit) / significance
+    if sn_factor is not None:
+        # point source correction: 0 < data[sn_key] <= 1
+        flux_err = flux_err / np.asarray(sn_factor)
+    # compute the flux realisation (the flux error does not change)
+    real_flux = model_flux + flux_err * noise
+    # convert to magnitudes
+
+    real_flux[real_flux<=0] = 1.e-99
+    real_mags = -2.5 * np.log10(real_flux)
+
+    real_SN = np.maximum(real_flux / flux_err, sn_limit)
+    real_mags_err = 2.5 / np.log(10.0) / real_SN
+    # set magnitudes of undetected objects and mag < 5.0 to 99.0
+    not_detected = (real_SN < sn_detect) | (real_mags < 5)
+    real_mags[not_detected] = non_detection_magnitude
+    real_mags_err[not_detected] = np.broadcast_to(  # one sigma magnitude limit
+        mag_limit - 2.5 * np.log10(significance),
+        real_mags_err.shape)[not_detected]
+    if out is None:
+        return real_mags.astype(np.float32), real_mags_err.astype(np.float32)
+    out[0][...] = real_mags
+    out[1][...] = real_mags_err
+    return out
+
+
+def realise_bands(
+        mag_model_data, mag_model_limits, sn_factor_data=None,
+        realisations=(0,), significance=1.0, sn_limit=0.2, sn_detect=1.0,
+        seed="KV450", object_ids=None, bands=None, threads=1,
+        chunk_size=TILE_SIZE, verbose=True):
+    """
+    Compute the magnitude realisations of all filters. The work is split into
+    tiles of one filter and a range of rows, which are processed by a pool of
+    threads and write directly into preallocated float32 arrays. The noise
+    of each tile is drawn with standard_normal_noise, i.e. the result does
+    not depend on the number of threads or the tile size.
+    Parameters
+    ----------
+    mag_model_data : dict
+        Model magnitudes for each filter (table column) name.
+    mag_model_limits : dict
+        Magnitude limit for each filter name, either a single value or the
+        value of each object.
+    sn_factor_data : dict
+        Correction factors for the signal-to-noise ratio of extended sources
+        for each filter name (optional).
+    realisations : list of int
+        Indices of the realisations to create.
+    significance : float
+        Significance of detection against magnitude limits.
+    sn_limit : float
+        Lower numerical limit for the signal-to-noise ratio.
+    sn_detect : float
+        Limiting signal-to-noise ratio for object detection.
+    seed : str
+        String to seed the random generator.
+    object_ids : array_like
+        Stable, non-negative integer ID of each object (default: the row
+        index).
+    bands : dict
+        Band name that keys the noise of each filter name (default: the
+        filter name).
+    threads : int
+        Number of threads processing the tiles.
+    chunk_size : int
+        Number of rows per tile.
+    verbose : bool
+        Whether the processed filters are printed.
+    Returns
+    -------
+    results : dict
+        Magnitude realisations and their errors for each filter name, arrays
+        with shape (n_realisations, n_objects).
+    """
+    if sn_factor_data is None:
+        sn_factor_data = {}
+    if bands is None:
+        bands = {}
+    if chunk_size < 1:
+        raise ValueError("chunk size must be positive")
+    n_objects = len(next(iter(mag_model_data.values())))
+    if object_ids is None:
+        object_ids = np.arange(n_objects)
+    object_ids = np.asarray(object_ids)
+    # the outputs are allocated once and filled tile by tile
+    results = {
+        filt: (
+            np.empty((len(realisations), n_objects), dtype=np.float32),
+            np.empty((len(realisations), n_objects), dtype=np.float32))
+        for filt in mag_model_data}
+
+    def realise_tile(tile):
+        filt, rows = tile
+        mag_limit = mag_model_limits[filt]
+        if np.ndim(mag_limit) > 0:
+            mag_limit = np.asarray(mag_limit)[rows]
+        sn_factor = sn_factor_data.get(filt)
+        if sn_factor is not None:
+            sn_factor = np.asarray(sn_factor)[rows]
+        real_mags, real_mags_err = results[filt]
+        for i, realisation in enumerate(realisations):
+            realise_magnitudes(
+                np.asarray(mag_model_data[filt])[rows], mag_limit,
+                standard_normal_noise(
+                    seed, bands.get(filt, filt), object_ids[rows],
+                    realisation),
+                sn_factor, significance=significance, sn_limit=sn_limit,
+                sn_detect=sn_detect,
+                out=(real_mags[i, rows], real_mags_err[i, rows]))
+
+    tiles = []
+    for filt in mag_model_data:
+        if verbose and len(realisations) > 1:
+            print("processing filter '%s' (%d realisations)" % (
+                filt, len(realisations)))
+        elif verbose:
+            print("processing filter '%s'" % filt)
+        tiles.extend(
+            (filt, slice(start, min(start + chunk_size, n_objects)))
+            for start in range(0, n_objects, chunk_size))
+    if threads > 1 and len(tiles) > 1:
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(realise_tile, tiles))
+    else:
+        for tile in tiles:
+            realise_tile(tile)
+    return results
+
+
+def realisation_recipe(
+        catalogue, filters, limits, sn_factors=None, n_realisations=1,
+        significance=1.0, sn_limit=0.2, sn_detect=1.0, seed="KV450",
+        id_column=None, bands=None, limits_map=None, map_index=None,
+        format=None):
+    """
+    Collect the parameters that regenerate photometry realisations from the
+    input columns of a catalogue (see realisation_view.RealisationView),
+    such that only the recipe needs to be stored instead of the realisations.
+    Parameters
+    ----------
+    catalogue : str
+        File path of the catalogue with the input columns.
+    filters : list of str
+        Column names of the model magnitudes.
+    limits : list of float
+        Magnitude limit of each filter.
+    sn_factors : list of str
+        Column names of the S/N correction factor of each filter (optional).
+    n_realisations : int
+        Number of realisations.
+    significance : float
+        Significance of detection against magnitude limits.
+    sn_limit : float
+        Lower numerical limit for the signal-to-noise ratio.
+    sn_detect : float
+        Limiting signal-to-noise ratio for object detection.
+    seed : str
+        String to seed the random generator.
+    id_column : str
+        Column name of the stable object ID (default: the row index).
+    bands : list of str
+        Band name that keys the noise of each filter (default: the filter
+        names).
+    limits_map : str
+        File path of a map of the magnitude limits (optional).
+    map_index : str
+        Column name of the pointing or pixel index of the map.
+    format : str
+        Catalogue format (see catalogue_io.table_format).
+    Returns
+    -------
+    recipe : dict
+        JSON serialisable parameters.
+    """
+    return {
+        "version": RECIPE_VERSION, "catalogue": catalogue, "format": format,
+        "filters": list(filters), "limits": [float(lim) for lim in limits],
+        "sn_factors": None if sn_factors is None else list(sn_factors),
+        "n_realisations": int(n_realisations),
+        "significance": float(significance), "sn_limit": float(sn_limit),
+        "sn_detect": float(sn_detect), "seed": seed, "id_column": id_column,
+        "bands": list(filters if bands is None else bands),
+        "limits_map": limits_map, "map_index": map_index}
+
+
+def photometry_realisation(
+        mag_model_data, mag_model_limits, sn_factor_data=None,
+        significance=1.0, sn_limit=0.2, sn_detect=1.0, seed="KV450",
+        object_ids=None, bands=None, threads=1):
+    """
+    Create a photometry realisation based on simulated model magnitudes and
+    observational detection limits. The noise of each object is drawn with
+    standard_normal_noise, i.e. any subset of the objects processed with
+    their IDs reproduces the realisation of the full catalogue.
+    Parameters
+    ----------
+    mag_model_data : dict
+        Model magnitudes for each filter (table column) name.
+    mag_model_limits : dict
+        Magnitude limit for each filter name, either a single value or the
+        value of each object (e.g. from a condition_maps.ConditionMap).
+    sn_factor_data : dict
+        Correction factors for the signal-to-noise ratio of extended sources
+        for each filter name (optional).
+    significance : float
+        Significance of detection against magnitude limits.
+    sn_limit : float
+        Lower numerical limit for the signal-to-noise ratio.
+    sn_detect : float
+        Limiting signal-to-noise ratio for object detection.
+    seed : str
+        String to seed the random generator.
+    object_ids : array_like
+        Stable, non-negative integer ID of each object (default: the row
+        index).
+    bands : dict
+        Band name that keys the noise of each filter name, e.g. to draw the
+        same noise for evolved and unevolved magnitudes (default: the filter
+        name).
+    threads : int
+        Number of threads processing the filters and row ranges (see
+        realise_bands).
+    Returns
+    -------
+    table : astropy.table.Table
+        Table with the magnitude realisations and their errors.
+    """
+    results = realise_bands(
+        mag_model_data, mag_model_limits, sn_factor_data,
+        significance=significance, sn_limit=sn_limit, sn_detect=sn_detect,
+        seed=seed, object_ids=object_ids, bands=bands, threads=threads)
+
+    columns = []
+    for filt, (real_mags, real_mags_err) in results.items():
+        # find the correct magnitude column suffix depending on whether
+        # magnification was applied or not
+        key, keyerr = realisation_column_names(filt)
+        columns.append(Column(
+            real_mags[0], name=key, unit=units.mag, copy=False,
+            description="realisation of model magnitude"))
+        columns.append(Column(
+            real_mags_err[0], name=keyerr, unit=units.mag, copy=False,
+            description="error of realisation of model magnitude"))
+    # the columns reference the output arrays
+    return Table(columns, copy=False)
+
+
+def photometry_realisations(
+        mag_model_data, mag_model_limits, sn_factor_data=None,
+        n_realisations=1, significance=1.0, sn_limit=0.2, sn_detect=1.0,
+        seed="KV450", object_ids=None, bands=None, threads=1):
+    """
+    Create a batch of independent photometry realisations from the same model
+    magnitudes. The realisation index is part of the counter of the random
+    generator (see standard_normal_noise) such that realisations can be
+    reproduced individually and independent of the batch size, the first
+    realisation is the output of photometry_realisation.
+    Parameters
+    ----------
+    mag_model_data : dict
+        Model magnitudes for each filter (table column) name.
+    mag_model_limits : dict
+        Magnitude limit for each filter name, either a single value or the
+        value of each object (e.g. from a condition_maps.ConditionMap).
+    sn_factor_data : dict
+        Correction factors for the signal-to-noise ratio of extended sources
+        for each filter name (optional).
+    n_realisations : int
+        Number of realisations to create.
+    significance : float
+        Significance of detection against magnitude limits.
+    sn_limit : float
+        Lower numerical limit for the signal-to-noise ratio.
+    sn_detect : float
+        Limiting signal-to-noise ratio for object detection.
+    seed : str
+        String to seed the random generator.
+    object_ids : array_like
+        Stable, non-negative integer ID of each object (default: the row
+        index).
+    bands : dict
+        Band name that keys the noise of each filter name, e.g. to draw the
+        same noise for evolved and unevolved magnitudes (default: the filter
+        name).
+    threads : int
+        Number of threads processing the filters and row ranges (see
+        realise_bands).
+    Returns
+    -------
+    table : astropy.table.Table
+        Table with the magnitude realisations and their errors, each column
+        has the shape (n_objects, n_realisations).
+    """
+    results = realise_bands(
+        mag_model_data, mag_model_limits, sn_factor_data,
+        realisations=range(n_realisations), significance=significance,
+        sn_limit=sn_limit, sn_detect=sn_detect, seed=seed,
+        object_ids=object_ids, bands=bands, threads=threads)
+
+    columns = []
+    for filt, (real_mags, real_mags_err) in results.items():
+        key, keyerr = realisation_column_names(filt)
+        # the realisation axis is the second table axis, the transposed
+        # views share the memory of the output arrays
+        columns.append(Column(
+            real_mags.T, name=key, unit=units.mag, copy=False,
+            description="realisations of model magnitude"))
+        columns.append(Column(
+            real_mags_err.T, name=keyerr, unit=units.mag, copy=False,
+            description="errors of realisations of model magnitude"))
+    table = Table(columns, copy=False)
+    table.meta["NREAL"] = n_realisations
+    table.meta["SEED"] = seed
+    return table
 
 
 if __name__ == "__main__":
@@ -26,7 +518,12 @@ if __name__ == "__main__":
         help='astropy.table format specifier of the input table '
              '(default: %(default)s)')
     data_group.add_argument(
-        '-o', '--output', required=True, help='file path of output table')
+        '-o', '--output', help='file path of output table')
+    data_group.add_argument(
+        '--recipe',
+        help='write a JSON recipe to this path instead of an output table, '
+             'from which the realisations are regenerated when they are '
+             'read (see realisation_view.py and catalogue_io.load_table)')
     data_group.add_argument(
         '--o-format', default='fits',
         help='astropy.table format specifier of the output table '
@@ -39,6 +536,16 @@ if __name__ == "__main__":
     params_group.add_argument(
         '--limits', nargs='*', type=float, required=True,
         help='magnitude limits for each entry in --filters')
+    params_group.add_argument(
+        '--limits-map',
+        help='table with the magnitude limits per pointing or HEALPix pixel, '
+             'the first column is the index, followed by one column per '
+             'entry in --filters (see condition_maps.py), --limits are used '
+             'for filters and objects not in the map')
+    params_group.add_argument(
+        '--map-index',
+        help='column name of the pointing or pixel index of the objects '
+             '(default: name of the first column of --limits-map)')
     params_group.add_argument(
         '--significance', type=float, default=1.0,
         help='significance of detection against magnitude limits '
@@ -59,11 +566,31 @@ if __name__ == "__main__":
     params_group.add_argument(
         '--seed', default='KV450',
         help='string to seed the random generator (default: %(default)s)')
+    params_group.add_argument(
+        '--id-column',
+        help='table column name of a stable, non-negative integer object ID '
+             'that keys the random noise of each object, such that any '
+             'subset of the input reproduces the realisation of the full '
+             'table (default: row index)')
+    params_group.add_argument(
+        '--n-realisations', type=int, default=1,
+        help='number of realisations, if larger than one, each output column '
+             'has a second axis that indexes the realisations '
+             '(default: %(default)s)')
+    params_group.add_argument(
+        '--threads', type=int, default=cpu_count(),
+        help='number of threads that process the filters in chunks of rows, '
+             'the result does not depend on it (default: %(default)s)')
 
     args = parser.parse_args()
+    setattr(args, "threads", min(cpu_count(), max(1, args.threads)))
 
     # check if all argument lengths match
     filters = args.filters
+    if args.output is None and args.recipe is None:
+        sys.exit("ERROR: either --output or --recipe is required")
+    if args.n_realisations < 1:
+        sys.exit("ERROR: --n-realisations must be positive")
     if len(args.limits) != len(filters):
         sys.exit("ERROR: number of input --limits do not match --filters")
     if args.sn_factors is None:
@@ -78,79 +605,60 @@ if __name__ == "__main__":
     columns = [f for f in filters]
     if args.sn_factors is not None:
         columns.extend(sn_factors)
+    if args.id_column is not None:
+        columns.append(args.id_column)
+    if args.limits_map is not None:
+        limits_map = ConditionMap.read(args.limits_map)
+        if args.map_index is None:
+            setattr(args, "map_index", limits_map.column)
+        columns.append(args.map_index)
     data = load_table(args.input, args.i_format, columns)
     print("use input filters: %s" % ", ".join(filters))
 
-    # get all input magnitudes and their limits
-    mag_model_data = {filt: data[filt] for filt in filters}
-    mag_model_limits = {
-        filt: lim for filt, lim in zip(filters, args.limits)}
+    if args.recipe is not None:
+        # store only the parameters, the realisations are regenerated on
+        # demand from the input columns (see realisation_view.py)
+        print("write realisation recipe to: %s" % args.recipe)
+        with open(args.recipe, "w") as f:
+            json.dump(realisation_recipe(
+                os.path.abspath(args.input), filters, args.limits,
+                args.sn_factors, n_realisations=args.n_realisations,
+                significance=args.significance, sn_limit=args.sn_limit,
+                sn_detect=args.sn_detect, seed=args.seed,
+                id_column=args.id_column, limits_map=(
+                    None if args.limits_map is None
+                    else os.path.abspath(args.limits_map)),
+                map_index=args.map_index, format=args.i_format), f, indent=4)
+    else:
+        # get all input magnitudes and their limits
+        mag_model_data = {filt: data[filt] for filt in filters}
+        mag_model_limits = {
+            filt: lim for filt, lim in zip(filters, args.limits)}
+        if args.limits_map is not None:
+            # magnitude limit of each object from its pointing or pixel
+            mag_model_limits = limits_map.gather(
+                data[args.map_index], mag_model_limits,
+                index_nside(args.map_index))
 
-    # create noise realisations
-    SN_limit = args.sn_limit
-    SN_detect = args.sn_detect
-    non_detection_magnitude = 99.0  # inserted for non-detections
-    detect_sigma_to_mag = 2.5 * np.log10(args.significance)  # ZP conversion
-    # dictionaries that collect the magnitude realisations per filter
-    mag_realisation_data = {}
-    mag_realisation_error = {}
-    # reseed the random state -> reproducible results
-    hasher = md5(bytes(args.seed, "utf-8"))
-    hashval = bytes(hasher.hexdigest(), "utf-8")
-    np.random.seed(np.frombuffer(hashval, dtype=np.uint32))
-    np.random.seed(np.frombuffer(hashval, dtype=np.uint32))
-    
-    for filt, sn_key in zip(filters, sn_factors):
-        print("processing filter '%s'" % filt)
-        model_mags = mag_model_data[filt]
-        # compute the model flux
-        model_flux = np.power(10.0, -0.4 * model_mags)
-        # compute the flux error from the magnitude limit
-        flux_err = np.power(
-            10.0, -0.4 * mag_model_limits[filt]) / args.significance
-        if sn_key is not None:
-            # point source correction: 0 < data[sn_key] <= 1
-            flux_err /= data[sn_key]
-        # compute the flux realisation (the flux error does not change)
-        real_flux = np.random.normal(model_flux, flux_err)
-        # convert to magnitudes
-        
-        real_flux[real_flux<=0] = 1.e-99        
-        real_mags = -2.5 * np.log10(real_flux)
-        
-        real_SN = np.maximum(real_flux / flux_err, args.sn_limit)
-        real_mags_err = 2.5 / np.log(10.0) / real_SN
-        # set magnitudes of undetected objects and mag < 5.0 to 99.0
-        not_detected = (real_SN < args.sn_detect) | (real_mags < 5)
-        real_mags[not_detected] = non_detection_magnitude
-        real_mags_err[not_detected] = (  # one sigma magnitude limit
-            mag_model_limits[filt] - 2.5 * np.log10(args.significance))
-        # collect the results
-        mag_realisation_data[filt] = real_mags.astype(np.float32)
-        mag_realisation_error[filt] = real_mags_err.astype(np.float32)
-
-    # collect output data
-    table = Table()
-    for filt in filters:
-        # find the correct magnitude column suffix depending on whether
-        # magnification was applied or not
-        if "_evo" in filt:
-            key = filt.replace("_evo", "_obs")
-            keyerr = filt.replace("_evo", "_obserr")
+        # create noise realisations
+        sn_factor_data = {
+            filt: data[sn_key] for filt, sn_key in zip(filters, sn_factors)
+            if sn_key is not None}
+        object_ids = None if args.id_column is None else data[args.id_column]
+        if args.n_realisations > 1:
+            table = photometry_realisations(
+                mag_model_data, mag_model_limits, sn_factor_data,
+                n_realisations=args.n_realisations,
+                significance=args.significance, sn_limit=args.sn_limit,
+                sn_detect=args.sn_detect, seed=args.seed,
+                object_ids=object_ids, threads=args.threads)
         else:
-            if filt.endswith("_mag"):
-                key = filt[:-4] + "_obs_mag"
-                keyerr = filt[:-4] + "_obserr_mag"
-            else:
-                key = filt + "_obs"
-                keyerr = filt + "_obserr"
-        table[key] = Column(
-            mag_realisation_data[filt], unit=units.mag,
-            description="realisation of model magnitude")
-        table[keyerr] = Column(
-            mag_realisation_error[filt], unit=units.mag,
-            description="error of realisation of model magnitude")
-
-    # write to specified output path
-    print("write table to: %s" % args.output)
-    table.write(args.output, format=args.o_format, overwrite=True)
+            table = photometry_realisation(
+                mag_model_data, mag_model_limits, sn_factor_data,
+                significance=args.significance, sn_limit=args.sn_limit,
+                sn_detect=args.sn_detect, seed=args.seed,
+                object_ids=object_ids, threads=args.threads)
+
+        # write to specified output path
+        print("write table to: %s" % args.output)
+        table.write(args.output, format=args.o_format, overwrite=True)
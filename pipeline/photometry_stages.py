@@ -0,0 +1,666 @@
+###############################################################################
+#                                                                             #
+#   Stage definitions of the photometric mock pipeline (footprint, masking,   #
+#   aperture S/N, photometry realisation, galaxy weights, BPZ photo-z and the #
+#   final selection) for the in-process runner in stage_graph.py.             #
+#                                                                             #
+###############################################################################
+
+import operator
+import os
+
+import numpy as np
+from astropy.table import Column, Table
+
+from catalogue_io import load_table, open_writer
+from column_store import ColumnStore, is_column_store
+from condition_maps import ConditionMap, gather_conditions
+from data_healpix_index import healpix_index
+from footprint_regions import Rectangle, mask_ra_dec
+from footprint_tiling import (
+    TileTable, tile_footprints, tile_table_path, write_tile_files)
+from healpix import ang2pix, index_column
+from mocks_bpz_wrapper import run_bpz
+from mocks_dc2_mag_evolved import mag_correction
+from mocks_draw_property import draw_property
+from mocks_extended_object_sn import extended_object_sn
+from mocks_flux_magnification import magnification_correction
+from mocks_generate_footprint import make_pointings, register_footprint
+from mocks_magnitude_transform import (
+    magnitude_offset, transform_magnitudes, transformed_names)
+from mocks_photometry_realisation import (
+    philox4x32, photometry_realisation, realisation_column_names,
+    realisation_recipe, realise_bands, standard_normal_noise)
+from pointing_grid import assign_pointings
+from spatial_index import iter_region_chunks, load_region
+from stage_graph import Stage, StageGraph
+from telemetry import measure
+
+
+# output columns of BPZ
+BPZ_COLUMNS = (
+    "ID", "Z_B", "Z_B_MIN", "Z_B_MAX", "T_B", "ODDS", "Z_ML", "T_ML",
+    "CHI-SQUARED", "M_0")
+
+# stages that process each object independently and can be streamed in chunks
+PER_OBJECT_STAGES = (
+    "mask", "healpix", "pointing", "magnitudes", "apertures", "realisation")
+
+# column with the row of each object in the input catalogue, which keys the
+# noise of the photometry realisation if there is no object ID column
+ROW_INDEX_COLUMN = "row_index"
+
+# operators used in the select_rules, e.g. "M_0 ll 90.0"
+RULE_OPERATORS = {
+    "ll": operator.lt, "le": operator.le, "gg": operator.gt,
+    "ge": operator.ge, "eq": operator.eq, "ne": operator.ne}
+
+
+def parse_select_rule(rule):
+    """
+    Parse a selection rule of the form "column operator value", where the
+    operator is one of ll (<), le (<=), gg (>), ge (>=), eq (==) or ne (!=).
+    Parameters
+    ----------
+    rule : str
+        Selection rule.
+    Returns
+    -------
+    column : str
+        Column name the rule is applied to.
+    op : callable
+        Comparison operator.
+    value : float
+        Value to compare to.
+    """
+    try:
+        column, op_name, value = rule.split()
+    except ValueError:
+        raise ValueError("invalid selection rule: '%s'" % rule)
+    if op_name not in RULE_OPERATORS:
+        raise ValueError(
+            "invalid operator '%s' in selection rule: '%s'" % (op_name, rule))
+    return column, RULE_OPERATORS[op_name], float(value)
+
+
+def footprint_stage(data, footprint_file, pointings_file, survey, bounds,
+                    grid, tile_area=None):
+    """
+    Register the survey footprint and create the pointings file and its
+    binary tile table, either from a fixed grid or with an adaptive number
+    of pointings per declination band (tile_area).
+    """
+    if os.path.exists(footprint_file):
+        os.remove(footprint_file)
+    register_footprint(footprint_file, survey, bounds)
+    if tile_area is None:
+        pointing_names, bound_tuples = make_pointings(survey, bounds, grid)
+    else:
+        tiles = tile_footprints({survey: bounds}, tile_area=tile_area)
+        pointing_names, bound_tuples = tiles.names, tiles.bound_tuples
+        print("create %d pointings with %.7e sqdeg each" % (
+            len(tiles), tiles.tiles["area"][0]))
+    write_tile_files(pointings_file, pointing_names, bound_tuples)
+
+
+def mask_stage(data, ra, dec, bounds):
+    """
+    Mask the catalogue to the RA/DEC bounds of the footprint.
+    """
+    print(
+        ("mask data to bounds with RA: %011.7f-%011.7f " % tuple(bounds[:2])) +
+        ("and DEC: %0+11.7f-%0+11.7f " % tuple(bounds[2:])))
+    mask = mask_ra_dec(data[ra], data[dec], *bounds)
+    # when streaming, individual chunks may not overlap with the footprint
+    if np.count_nonzero(mask) == 0 and "chunk" not in data.meta:
+        raise ValueError("no data found within RA/DEC limits")
+    return mask
+
+
+def healpix_stage(data, ra, dec, nside, column):
+    """
+    Add the NESTED HEALPix index of the objects.
+    """
+    return Table([healpix_index(data[ra], data[dec], nside, column)])
+
+
+def pointing_stage(data, ra, dec, pointings_file, column):
+    """
+    Add the index of the pointing (the row in the pointings file) that
+    contains each object.
+    """
+    tiles = TileTable.read(pointings_file)
+    index = assign_pointings(data[ra], data[dec], tiles.bound_tuples)
+    return Table([Column(
+        index, name=column,
+        description="index of the pointing in %s" % os.path.basename(
+            pointings_file))])
+
+
+def magnitude_stage(data, filters, redshift, convergence):
+    """
+    Apply the evolution and magnification corrections to all model
+    magnitudes in one pass.
+    """
+    return transform_magnitudes(data, filters, redshift, convergence)
+
+
+def aperture_stage(data, size_major, size_minor, psf_sizes, scale, flux_frac,
+                   geometry=True, psf_map=None, map_index=None):
+    """
+    Compute the point source S/N correction for extended objects, optionally
+    with the PSF sizes of the pointing or pixel of each object.
+    """
+    psf_sizes = gather_conditions(data, psf_map, psf_sizes, map_index)
+    return extended_object_sn(
+        data[size_major], data[size_minor], psf_sizes, scale=scale,
+        flux_frac=flux_frac, geometry=geometry)
+
+
+def realisation_stage(data, mags, filters, limits, significance, sn_detect,
+                      seed, maglim_map=None, map_index=None, id_column=None,
+                      threads=1):
+    """
+    Generate the photometry realisation of the model magnitudes using the S/N
+    correction factors of the filters, optionally with the magnitude limits
+    of the pointing or pixel of each object. The noise is keyed by the
+    filter and the object ID column or, by default, the row index in the
+    input catalogue, such that streamed chunks reproduce the unchunked run.
+    Catalogue shards without an ID column are seeded with their name. The
+    filters and row ranges are processed on a pool of threads. Without an ID
+    column the row index is stored as column (ROW_INDEX_COLUMN), such that
+    the realisations can be regenerated from the output (see
+    photometry_recipe).
+    """
+    limits = gather_conditions(
+        data, maglim_map, dict(zip(filters, limits)), map_index)
+    limits = [limits[filt] for filt in filters]
+    if id_column is not None:
+        object_ids = data[id_column]
+    else:
+        if "shard" in data.meta:
+            seed = "%s:%s" % (seed, data.meta["shard"])
+        object_ids = data.meta.get("row_index")
+        if object_ids is None:
+            object_ids = np.arange(len(data))
+    mag_model_data = {mag: data[mag] for mag in mags}
+    sn_factor_data = {
+        mag: data["sn_factor_" + filt] for mag, filt in zip(mags, filters)}
+    table = photometry_realisation(
+        mag_model_data, dict(zip(mags, limits)), sn_factor_data,
+        significance=significance, sn_detect=sn_detect, seed=seed,
+        object_ids=object_ids, bands=dict(zip(mags, filters)),
+        threads=threads)
+    if id_column is None:
+        table[ROW_INDEX_COLUMN] = Column(
+            np.asarray(object_ids, dtype=np.int64),
+            description="row in the input catalogue, keys the noise of the "
+                        "photometry realisation")
+    return table
+
+
+def weight_stage(data, s_attr, s_prop, d_file, d_attr, d_prop, r_max,
+                 fallback, tree, threads):
+    """
+    Assign galaxy weights by nearest neighbour matching to the real data.
+    """
+    real = load_table(d_file, "fits", [*d_attr, *d_prop])
+    return draw_property(
+        np.transpose([data[s] for s in s_attr]),
+        np.transpose([real[s] for s in d_attr]),
+        real[tuple(d_prop)], s_prop, r_max=r_max, fallback=fallback,
+        tree_path=tree, threads=threads,
+        description="drawn via %s from file: %s" % (
+            ", ".join(d_attr), d_file))
+
+
+def photoz_stage(data, filters, errors, prior_filter, work_base, **kwargs):
+    """
+    Compute photometric redshifts with BPZ.
+    """
+    return run_bpz(
+        data, filters, errors, prior_filter, work_base, "photoz", **kwargs)
+
+
+def select_stage(data, rules):
+    """
+    Apply the final selection rules.
+    """
+    mask = np.ones(len(data), dtype="bool")
+    for rule in rules:
+        column, op, value = parse_select_rule(rule)
+        print("apply rule: %s" % rule)
+        mask &= op(data[column], value)
+    return mask
+
+
+def model_magnitudes(config):
+    """
+    Get the model magnitude columns that enter the photometry realisation,
+    i.e. the configured magnitudes with the optional evolution (suffix _evo)
+    and magnification (suffix _mag) corrections applied.
+    Parameters
+    ----------
+    config : dict
+        Pipeline configuration (see ./scripts/config_yamls).
+    Returns
+    -------
+    mags : list of str
+        Model magnitude column names, in the order of the filters.
+    """
+    return transformed_names(
+        config["columns"]["magnitudes"],
+        config["photometric_setup"].get("evolution", False),
+        config["columns"].get("convergence") is not None)
+
+
+def condition_map_inputs(path, column=None):
+    """
+    Get the catalogue columns and source files required by a condition map
+    (see condition_maps.gather_conditions), none if path is None.
+    """
+    if path is None:
+        return [], []
+    if column is None:
+        column = ConditionMap.read(path).column
+    return [column], [path]
+
+
+def build_photometry_graph(config, names=None):
+    """
+    Build the stage graph of the photometric pipeline from a configuration.
+    Parameters
+    ----------
+    config : dict
+        Pipeline configuration (see ./scripts/config_yamls).
+    names : list of str
+        Subset of stages to include in the graph (default: all).
+    Returns
+    -------
+    graph : stage_graph.StageGraph
+        Graph with all pipeline stages.
+    """
+    survey = config["survey"]
+    threads = int(config["threads"])
+    datadir = config["paths"]["DATADIR"]
+    bounds = [float(b) for b in config["fields"]["bounds"]]
+    ra = config["columns"]["coordinates"]["RA"]
+    dec = config["columns"]["coordinates"]["DEC"]
+    shapes = config["columns"]["shapes"]
+    filters = config["columns"]["magnitudes"]
+    convergence = config["columns"].get("convergence")
+    phot = config["photometric_setup"]
+    weights = config["weight_assignment"]
+    photoz = config["photoz_setup"]
+
+    mags = model_magnitudes(config)
+    obs_keys = [realisation_column_names(mag) for mag in mags]
+    mags_obs = [key for key, keyerr in obs_keys]
+    mags_obserr = [keyerr for key, keyerr in obs_keys]
+    prior_filter = photoz["prior_filter"]
+    if prior_filter in filters:
+        prior_filter = mags[filters.index(prior_filter)]
+    prior_filter = realisation_column_names(prior_filter)[0]
+
+    footprint_file = os.path.join(datadir, "footprint.txt")
+    pointings_file = os.path.join(datadir, "pointings_%s.txt" % survey)
+
+    stages = [
+        Stage(
+            "footprint", footprint_stage, params={
+                "footprint_file": footprint_file,
+                "pointings_file": pointings_file,
+                "survey": survey, "bounds": bounds,
+                "grid": config["fields"].get("grid"),
+                "tile_area": config["fields"].get("tile_area")},
+            code=[register_footprint, make_pointings, tile_footprints],
+            products=[
+                footprint_file, pointings_file,
+                tile_table_path(pointings_file)]),
+        Stage(
+            "mask", mask_stage, inputs=[ra, dec], selection=True,
+            params={"ra": ra, "dec": dec, "bounds": bounds},
+            code=[mask_ra_dec])]
+    # optional HEALPix index for spatial lookups of the masked objects
+    if config.get("healpix") is not None:
+        nside = int(config["healpix"]["nside"])
+        column = config["healpix"].get("column", index_column(nside))
+        stages.append(Stage(
+            "healpix", healpix_stage, inputs=[ra, dec], outputs=[column],
+            params={"ra": ra, "dec": dec, "nside": nside, "column": column},
+            code=[healpix_index, ang2pix]))
+    # optional index of the pointing of each object, e.g. for jackknife
+    # samples or depth variations per pointing
+    if config["fields"].get("pointing_column") is not None:
+        column = config["fields"]["pointing_column"]
+        stages.append(Stage(
+            "pointing", pointing_stage, inputs=[ra, dec], outputs=[column],
+            params={
+                "ra": ra, "dec": dec, "pointings_file": pointings_file,
+                "column": column},
+            code=[assign_pointings], sources=[pointings_file]))
+    # optional evolution and magnification corrections of the model
+    # magnitudes, applied in a single pass
+    evolution = phot.get("evolution", False)
+    if evolution or convergence is not None:
+        redshift = config["columns"].get("redshift", "redshift")
+        if not evolution:
+            redshift = None
+        inputs = [col for col in (redshift, convergence) if col is not None]
+        stages.append(Stage(
+            "magnitudes", magnitude_stage, inputs=[*inputs, *filters],
+            outputs=mags, params={
+                "filters": list(filters), "redshift": redshift,
+                "convergence": convergence},
+            code=[
+                magnitude_offset, mag_correction, magnification_correction]))
+    # optional maps of the PSF sizes and magnitude limits per pointing or
+    # HEALPix pixel, gathered with the index column of the objects
+    psf_map = phot.get("psf_map")
+    maglim_map = phot.get("maglim_map")
+    map_index = phot.get("map_index")
+    psf_inputs, psf_sources = condition_map_inputs(psf_map, map_index)
+    maglim_inputs, maglim_sources = condition_map_inputs(
+        maglim_map, map_index)
+    # optional stable object ID that keys the noise of the realisation
+    id_column = phot.get("id_column")
+    id_inputs = [] if id_column is None else [id_column]
+    stages.extend([
+        # Compute the effective radius (that contains 50% of the luminosity),
+        # compute the observational size using the PSFs, scale this with a
+        # factor of 2.5 (similar to what sextractor would do) to get a mock
+        # aperture. Finally calculate a correction factor for the S/N based
+        # on the aperture area compared to a point source (= PSF area).
+        Stage(
+            "apertures", aperture_stage,
+            inputs=[
+                shapes["size_major"], shapes["size_minor"], *psf_inputs],
+            outputs=["sn_factor_" + filt for filt in filters],
+            params={
+                "size_major": shapes["size_major"],
+                "size_minor": shapes["size_minor"],
+                "psf_sizes": dict(zip(filters, phot["PSFs"])),
+                "scale": float(phot["scale"]), "flux_frac": 0.5,
+                "geometry": phot.get("aperture_geometry", True),
+                "psf_map": psf_map, "map_index": map_index},
+            code=[extended_object_sn, ConditionMap], sources=psf_sources),
+        # Based on the limiting magnitudes, calcalute the mock galaxy S/N and
+        # apply the aperture size S/N correction to obtain a magnitude
+        # realisation.
+        Stage(
+            "realisation", realisation_stage,
+            inputs=(
+                mags + ["sn_factor_" + filt for filt in filters] +
+                maglim_inputs + id_inputs),
+            outputs=mags_obs + mags_obserr + (
+                [ROW_INDEX_COLUMN] if id_column is None else []),
+            params={
+                "mags": mags, "filters": filters, "limits": phot["MAGlims"],
+                "significance": float(phot["MAGsig"]),
+                "sn_detect": float(phot["sn_detect"]),
+                "seed": phot.get("seed", "KV450"),
+                "maglim_map": maglim_map, "map_index": map_index,
+                "id_column": id_column, "threads": threads},
+            code=[
+                photometry_realisation, realise_bands, standard_normal_noise,
+                philox4x32, ConditionMap],
+            sources=maglim_sources),
+        # Assign weights by matching mock galaxies in magnitude space to their
+        # nearest neighbour data galaxies. Mock galaxies that do not have a
+        # nearest neighbour within r_max (Minkowski distance) are assigned the
+        # fallback values.
+        Stage(
+            "weights", weight_stage, inputs=mags_obs,
+            outputs=["recal_weight"], params={
+                "s_attr": mags_obs, "s_prop": ["recal_weight"],
+                "d_file": weights["real_weight_file"],
+                "d_attr": weights["real_mag_col"],
+                "d_prop": [weights["real_weight_col"]],
+                "r_max": 1.0, "fallback": ["0.0"], "tree": weights["tree"],
+                "threads": threads},
+            code=[draw_property],
+            sources=[weights["real_weight_file"]]),
+        # Run BPZ on the mock galaxy photometry.
+        Stage(
+            "photoz", photoz_stage, inputs=mags_obs + mags_obserr,
+            outputs=BPZ_COLUMNS, after=["weights"], params={
+                "filters": mags_obs, "errors": mags_obserr,
+                "prior_filter": prior_filter,
+                "work_base": os.path.splitext(
+                    datadir + config["paths"]["MOCKoutfull"])[0],
+                "templates": photoz["templates"], "prior": photoz["prior"],
+                "z_min": float(photoz["z_min"]),
+                "z_max": float(photoz["z_max"]), "threads": threads},
+            code=[run_bpz]),
+        Stage(
+            "select", select_stage,
+            inputs=[parse_select_rule(r)[0] for r in phot["select_rules"]],
+            selection=True, params={"rules": phot["select_rules"]})])
+    if names is not None:
+        stages = [stage for stage in stages if stage.name in names]
+    return StageGraph(stages)
+
+
+def default_checkpoints(config):
+    """
+    Get the default checkpoints of the photometric pipeline, which reproduce
+    the data products of the previous script chain (MOCKmasked, MOCKoutfull
+    and MOCKout). If MOCKoutfull is a column store (.columns), it is updated
+    after every stage that adds columns, such that each stage only appends its
+    new columns. The optional configuration section 'checkpoints' maps stage
+    names to additional or alternative output paths relative to DATADIR.
+    Parameters
+    ----------
+    config : dict
+        Pipeline configuration (see ./scripts/config_yamls).
+    Returns
+    -------
+    checkpoints : dict
+        Output file path(s) for each stage name.
+    """
+    datadir = config["paths"]["DATADIR"]
+    MOCKoutfull = datadir + config["paths"]["MOCKoutfull"]
+    checkpoints = {
+        "mask": datadir + config["paths"]["MOCKmasked"],
+        "photoz": MOCKoutfull,
+        "select": datadir + config["paths"]["MOCKout"]}
+    if is_column_store(MOCKoutfull):
+        checkpoints["mask"] = [checkpoints["mask"], MOCKoutfull]
+        stages = ["apertures", "realisation", "weights"]
+        if (config["photometric_setup"].get("evolution", False) or
+                config["columns"].get("convergence") is not None):
+            stages.append("magnitudes")
+        if config.get("healpix") is not None:
+            stages.append("healpix")
+        if config["fields"].get("pointing_column") is not None:
+            stages.append("pointing")
+        for stage in stages:
+            checkpoints[stage] = MOCKoutfull
+    for stage, path in config.get("checkpoints", {}).items():
+        if path is None:  # disable a default checkpoint
+            checkpoints.pop(stage, None)
+        else:
+            checkpoints[stage] = datadir + path
+    return checkpoints
+
+
+def photometry_recipe(config, n_realisations=1, path=None):
+    """
+    Get the recipe that regenerates the photometry realisations of the
+    pipeline output (see realisation_view.RealisationView). The noise is
+    keyed by the object ID column or, by default, by the stored row index
+    (ROW_INDEX_COLUMN), such that realisation 0 reproduces the stored _obs
+    and _obserr columns.
+    Parameters
+    ----------
+    config : dict
+        Pipeline configuration (see ./scripts/config_yamls).
+    n_realisations : int
+        Number of realisations.
+    path : str
+        Catalogue with the input columns of the realisation stage (default:
+        MOCKoutfull).
+    Returns
+    -------
+    recipe : dict
+        JSON serialisable parameters.
+    """
+    phot = config["photometric_setup"]
+    filters = config["columns"]["magnitudes"]
+    id_column = phot.get("id_column")
+    if id_column is None and config.get("sharding") is not None:
+        raise ValueError(
+            "sharded realisations are seeded per shard, the recipe requires "
+            "photometric_setup: id_column")
+    if path is None:
+        path = config["paths"]["DATADIR"] + config["paths"]["MOCKoutfull"]
+    return realisation_recipe(
+        path, model_magnitudes(config), phot["MAGlims"],
+        sn_factors=["sn_factor_" + filt for filt in filters],
+        n_realisations=n_realisations,
+        significance=float(phot["MAGsig"]),
+        sn_detect=float(phot["sn_detect"]), seed=phot.get("seed", "KV450"),
+        id_column=ROW_INDEX_COLUMN if id_column is None else id_column,
+        bands=filters, limits_map=phot.get("maglim_map"),
+        map_index=phot.get("map_index"))
+
+
+def survey_region(config):
+    """
+    Get the RA/DEC bounds of the survey (config entry fields/bounds) as
+    footprint_regions.Rectangle.
+    """
+    return Rectangle(
+        config["survey"], *[float(b) for b in config["fields"]["bounds"]])
+
+
+def load_raw(config, row_index=False):
+    """
+    Load the objects of the raw catalogue (MOCKraw) within the survey bounds.
+    Only the overlapping row ranges are read if the catalogue is spatially
+    sorted (see data_spatial_sort.py). Optionally returns the row index of the
+    objects in the raw catalogue, which keys the photometry realisation.
+    """
+    coordinates = config["columns"]["coordinates"]
+    return load_region(
+        config["paths"]["MOCKraw"], survey_region(config),
+        coordinates["RA"], coordinates["DEC"], "fits", row_index=row_index)
+
+
+def raw_chunks(config, chunk_size):
+    """
+    Iterate over the raw catalogue (MOCKraw) in chunks of rows, restricted to
+    the row ranges that overlap with the survey bounds if the catalogue is
+    spatially sorted (see spatial_index.iter_region_chunks). The chunks still
+    pass through the mask stage.
+    """
+    return iter_region_chunks(
+        config["paths"]["MOCKraw"], survey_region(config), "fits",
+        chunk_size=chunk_size)
+
+
+def stream_photometry(config, chunk_size, cache=None, telemetry=None):
+    """
+    Run the photometric pipeline with bounded memory. The footprint is
+    created first, then the raw catalogue (MOCKraw) is read in chunks of rows
+    that are passed through all per-object stages (PER_OBJECT_STAGES) and
+    appended to MOCKmasked and MOCKoutfull. Finally the stages that need the
+    full catalogue (weights, photo-z, selection) run on MOCKoutfull, which is
+    memory-mapped if it is a column store.
+    Parameters
+    ----------
+    config : dict
+        Pipeline configuration (see ./scripts/config_yamls).
+    chunk_size : int
+        Number of rows per chunk.
+    cache : stage_cache.StageCache
+        Cache of stage results used for the stages that are not streamed
+        (optional).
+    telemetry : telemetry.Telemetry
+        Collects the performance records of the stages (optional).
+    Returns
+    -------
+    table : astropy.table.Table
+        Final catalogue.
+    """
+    datadir = config["paths"]["DATADIR"]
+    MOCKraw = config["paths"]["MOCKraw"]
+    MOCKoutfull = datadir + config["paths"]["MOCKoutfull"]
+    checkpoints = default_checkpoints(config)
+
+    graph = build_photometry_graph(config, ["footprint"])
+    graph.run(checkpoints={
+        stage: path for stage, path in checkpoints.items()
+        if stage in graph.stages}, cache=cache, telemetry=telemetry)
+
+    # the chunks pass through the per-object stages, the checkpoints of these
+    # stages become chunk writers, MOCKoutfull is written after the last one
+    graph = build_photometry_graph(config, PER_OBJECT_STAGES)
+    writers = {}
+    for stage in graph.stages:
+        paths = checkpoints.get(stage, [])
+        if isinstance(paths, str):
+            paths = [paths]
+        paths = [path for path in paths if path != MOCKoutfull]
+        if len(paths) > 0:
+            writers[stage] = [open_writer(path) for path in paths]
+    last = list(graph.stages)[-1]
+    writers.setdefault(last, []).append(open_writer(MOCKoutfull))
+    print("==> stream %s in chunks of %d rows" % (MOCKraw, chunk_size))
+    nrows = graph.stream(
+        raw_chunks(config, chunk_size), writers,
+        telemetry=telemetry)
+    if nrows == 0:
+        raise ValueError("no data found within RA/DEC limits")
+
+    graph = build_photometry_graph(config, ["weights", "photoz", "select"])
+    if is_column_store(MOCKoutfull):
+        catalogue = ColumnStore(MOCKoutfull).table()
+        graph.mark_stored(MOCKoutfull, catalogue.colnames)
+    else:
+        catalogue = load_table(MOCKoutfull, "fits")
+    return graph.run(
+        catalogue, checkpoints={
+            stage: path for stage, path in checkpoints.items()
+            if stage in graph.stages}, cache=cache, telemetry=telemetry)
+
+
+def mask_catalogue(config, chunk_size=None, cache=None, telemetry=None):
+    """
+    Create the footprint and mask the raw catalogue (MOCKraw) to the
+    footprint, the result is written to MOCKmasked.
+    Parameters
+    ----------
+    config : dict
+        Pipeline configuration (see ./scripts/config_yamls).
+    chunk_size : int
+        Stream the raw catalogue in chunks of this number of rows instead of
+        loading it at once (optional).
+    cache : stage_cache.StageCache
+        Cache of stage results (optional, not used when streaming).
+    telemetry : telemetry.Telemetry
+        Collects the performance records of the stages (optional).
+    """
+    datadir = config["paths"]["DATADIR"]
+    MOCKraw = config["paths"]["MOCKraw"]
+    MOCKmasked = datadir + config["paths"]["MOCKmasked"]
+
+    graph = build_photometry_graph(config, ["footprint"])
+    graph.run(cache=cache, telemetry=telemetry)
+    graph = build_photometry_graph(config, ["mask"])
+    if chunk_size is not None:
+        print("==> stream %s in chunks of %d rows" % (MOCKraw, chunk_size))
+        nrows = graph.stream(
+            raw_chunks(config, chunk_size),
+            {"mask": open_writer(MOCKmasked, background=True)},
+            telemetry=telemetry)
+        if nrows == 0:
+            raise ValueError("no data found within RA/DEC limits")
+    else:
+        print("==> load DC2 catalogue for " + config["survey"])
+        with measure(telemetry, "load") as record:
+            catalogue, row_index = load_raw(config, row_index=True)
+            record["rows_out"] = len(catalogue)
+        graph.run(
+            catalogue, checkpoints={"mask": MOCKmasked}, cache=cache,
+            telemetry=telemetry, row_index=row_index)
@@ -0,0 +1,222 @@
+###############################################################################
+#                                                                             #
+#   Vectorized assignment of objects to the pointings of a survey footprint.  #
+#   The pointings created by mocks_generate_footprint.make_pointings form a   #
+#   separable grid of RA columns and DEC rows, such that the pointing of an   #
+#   object follows from a binary search of its RA and DEC in the grid edges.  #
+#                                                                             #
+###############################################################################
+
+import numpy as np
+
+from footprint_tiling import TileTable
+
+
+class PointingGrid(object):
+    """
+    Separable grid of pointings, pointing i * n_RA + j covers DEC row i and
+    RA column j (the order of make_pointings and the pointings file). The RA
+    columns may wrap around RA = 0.
+    Parameters
+    ----------
+    ra_edges : array_like
+        RA edges of the columns in degrees (n_RA + 1), increasing modulo 360.
+    dec_edges : array_like
+        DEC edges of the rows in degrees (n_DEC + 1), increasing.
+    names : list of str
+        Names of the pointings (optional).
+    """
+
+    def __init__(self, ra_edges, dec_edges, names=None):
+        self.ra_edges = np.asarray(ra_edges, dtype=np.float64)
+        self.dec_edges = np.asarray(dec_edges, dtype=np.float64)
+        if len(self.ra_edges) < 2 or len(self.dec_edges) < 2:
+            raise ValueError("the grid requires at least two edges per axis")
+        if np.any(np.diff(self.dec_edges) <= 0.0):
+            raise ValueError("DEC edges must be increasing")
+        # RA offsets of the edges from the first edge, unwrapped at RA = 0,
+        # a column width of 0 is a full circle
+        widths = np.mod(np.diff(self.ra_edges), 360.0)
+        widths[widths == 0.0] = 360.0
+        self._ra_offsets = np.concatenate([[0.0], np.cumsum(widths)])
+        if self._ra_offsets[-1] > 360.0:
+            raise ValueError("RA columns cover more than 360 degrees")
+        if names is not None and len(names) != len(self):
+            raise ValueError(
+                "expected %d pointing names, got %d" % (len(self), len(names)))
+        self.names = names
+
+    @property
+    def shape(self):
+        """
+        Number of DEC rows and RA columns.
+        """
+        return len(self.dec_edges) - 1, len(self.ra_edges) - 1
+
+    def __len__(self):
+        n_dec, n_ra = self.shape
+        return n_dec * n_ra
+
+    @classmethod
+    def from_bounds(cls, bound_tuples, names=None):
+        """
+        Reconstruct the grid from the bounds of the pointings.
+        Parameters
+        ----------
+        bound_tuples : list of tuple
+            Bounds (RAmin, RAmax, DECmin, DECmax) of each pointing in the
+            order of make_pointings.
+        names : list of str
+            Names of the pointings (optional).
+        Returns
+        -------
+        grid : PointingGrid
+            Grid of the pointings, None if the pointings do not form a
+            contiguous, separable grid.
+        """
+        bounds = np.asarray(bound_tuples, dtype=np.float64)
+        if bounds.ndim != 2 or bounds.shape[1] != 4 or len(bounds) == 0:
+            return None
+        # the pointings of the first DEC row share its lower bound
+        n_ra = np.argmin(np.append(bounds[:, 2] == bounds[0, 2], False))
+        if len(bounds) % n_ra != 0:
+            return None
+        bounds = bounds.reshape(-1, n_ra, 4)
+        ra_min, ra_max = bounds[0, :, 0], bounds[0, :, 1]
+        dec_min, dec_max = bounds[:, 0, 2], bounds[:, 0, 3]
+        separable = (
+            np.all(bounds[:, :, 0] == ra_min) and
+            np.all(bounds[:, :, 1] == ra_max) and
+            np.all(bounds[:, :, 2] == dec_min[:, None]) and
+            np.all(bounds[:, :, 3] == dec_max[:, None]))
+        contiguous = (
+            np.all(ra_max[:-1] == ra_min[1:]) and
+            np.all(dec_max[:-1] == dec_min[1:]))
+        if not (separable and contiguous):
+            return None
+        try:
+            return cls(
+                np.append(ra_min, ra_max[-1]),
+                np.append(dec_min, dec_max[-1]), names)
+        except ValueError:
+            return None
+
+    @classmethod
+    def read(cls, pointings_file):
+        """
+        Read the grid from a pointings file (see
+        footprint_tiling.TileTable.read), None if the pointings do not form
+        a separable grid.
+        """
+        tiles = TileTable.read(pointings_file)
+        return cls.from_bounds(tiles.bound_tuples, tiles.names)
+
+    def assign(self, ra, dec, clip=True):
+        """
+        Assign objects to the pointing that contains them, the bounds follow
+        footprint_regions.mask_ra_dec (lower bounds inclusive).
+        Parameters
+        ----------
+        ra : array_like
+            Right ascension of the objects in degrees.
+        dec : array_like
+            Declination of the objects in degrees.
+        clip : bool
+            Whether objects outside of the grid (e.g. due to the rounding of
+            the bounds in the pointings file) are assigned to the closest
+            pointing at the edge of the grid, otherwise their index is -1.
+        Returns
+        -------
+        index : array_like
+            Index of the pointing of each object (int32).
+        """
+        n_dec, n_ra = self.shape
+        ra = np.asarray(ra, dtype=np.float64)
+        dec = np.asarray(dec, dtype=np.float64)
+        # RA relative to the first edge in [0, 360)
+        ra_offset = np.mod(ra - self.ra_edges[0], 360.0)
+        i_ra = np.searchsorted(self._ra_offsets, ra_offset, side="right") - 1
+        i_dec = np.searchsorted(self.dec_edges, dec, side="right") - 1
+        outside_ra = i_ra >= n_ra
+        outside_dec = (i_dec < 0) | (i_dec >= n_dec)
+        if clip:
+            # closer to the last than to the first RA edge
+            i_ra[outside_ra] = np.where(
+                ra_offset[outside_ra] - self._ra_offsets[-1] <
+                360.0 - ra_offset[outside_ra], n_ra - 1, 0)
+            np.clip(i_dec, 0, n_dec - 1, out=i_dec)
+        index = (i_dec * n_ra + i_ra).astype(np.int32)
+        if not clip:
+            index[outside_ra | outside_dec] = -1
+        return index
+
+
+def pointing_lookup(bound_tuples):
+    """
+    Build the lookup structure of a set of pointings for assign_pointings,
+    e.g. once for many calls.
+    Parameters
+    ----------
+    bound_tuples : list of tuple
+        Bounds (RAmin, RAmax, DECmin, DECmax) of each pointing.
+    Returns
+    -------
+    lookup : PointingGrid or footprint_tiling.TileTable
+        Grid of the pointings if they form a separable grid, otherwise a tile
+        table.
+    """
+    grid = PointingGrid.from_bounds(bound_tuples)
+    if grid is not None:
+        return grid
+    return TileTable.from_bounds(bound_tuples)
+
+
+def assign_pointings(ra, dec, bound_tuples, lookup=None):
+    """
+    Assign objects to the pointing that contains them. Objects that fall into
+    gaps between the pointings (due to the rounding of the boundaries in the
+    pointings file) are assigned to the pointing with the closest centre.
+    Pointings that form a separable grid (see PointingGrid) are looked up
+    with a binary search of the grid edges, other pointings with a binary
+    search per declination band (see footprint_tiling.TileTable).
+    Parameters
+    ----------
+    ra : array_like
+        Right ascension of the objects in degrees.
+    dec : array_like
+        Declination of the objects in degrees.
+    bound_tuples : list of tuple
+        Bounds (RAmin, RAmax, DECmin, DECmax) of each pointing.
+    lookup : PointingGrid or footprint_tiling.TileTable
+        Lookup of the pointings created by pointing_lookup (optional).
+    Returns
+    -------
+    index : array_like
+        Index of the pointing of each object.
+    """
+    if lookup is None:
+        lookup = pointing_lookup(bound_tuples)
+    if isinstance(lookup, PointingGrid):
+        return lookup.assign(ra, dec)
+    ra = np.asarray(ra)
+    dec = np.asarray(dec)
+    index = lookup.assign(ra, dec)
+    unassigned = np.flatnonzero(index == -1)
+    if len(unassigned) > 0:
+        bounds = np.asarray(bound_tuples)
+        ra_centre = (bounds[:, 0] + bounds[:, 1]) / 2.0
+        wraps = bounds[:, 0] > bounds[:, 1]
+        ra_centre[wraps] += 180.0
+        dec_centre = (bounds[:, 2] + bounds[:, 3]) / 2.0
+
+        def unit_vectors(ra, dec):
+            ra, dec = np.radians(ra), np.radians(dec)
+            return np.transpose([
+                np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra),
+                np.sin(dec)])
+
+        cos_dist = np.dot(
+            unit_vectors(ra[unassigned], dec[unassigned]),
+            unit_vectors(ra_centre, dec_centre).T)
+        index[unassigned] = np.argmax(cos_dist, axis=1)
+    return index
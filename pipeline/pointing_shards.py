@@ -0,0 +1,319 @@
+###############################################################################
+#                                                                             #
+#   Pointing-sharded execution of the photometric pipeline. The masked        #
+#   catalogue is partitioned by the pointings of the survey footprint, the    #
+#   per-object stages and BPZ run independently on each shard (in a process   #
+#   pool or distributed over several nodes sharing a file system) and the     #
+#   shard outputs are merged in the order of the pointings file.              #
+#                                                                             #
+###############################################################################
+
+import contextlib
+import copy
+import json
+import os
+import shutil
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from catalogue_io import iter_chunks, open_writer
+from column_store import ColumnStore, STORE_EXTENSION
+from mocks_generate_footprint import read_pointings_file
+from photometry_stages import build_photometry_graph, default_checkpoints
+from pointing_grid import assign_pointings
+from stage_cache import StageCache
+from telemetry import Telemetry, measure
+
+
+# stages that run on the full catalogue before it is partitioned
+UNSHARDED_STAGES = ("footprint", "mask")
+
+# file in each shard directory that marks a successfully processed shard
+SHARD_STATUS_FILE = "shard.json"
+
+# telemetry report of each shard
+SHARD_TELEMETRY_FILE = "telemetry.json"
+
+
+def pointings_file(config):
+    """
+    Get the path of the pointings file created by the footprint stage.
+    """
+    return os.path.join(
+        config["paths"]["DATADIR"], "pointings_%s.txt" % config["survey"])
+
+
+def shard_directory(config):
+    """
+    Get the directory in which the shards are stored (DATADIR/shards or the
+    optional config entry sharding: directory, relative to DATADIR).
+    """
+    sharding = config.get("sharding") or {}
+    return config["paths"]["DATADIR"] + sharding.get("directory", "/shards")
+
+
+def shard_input(config, name):
+    """
+    Get the path of the input catalogue (column store) of a shard.
+    """
+    return os.path.join(
+        shard_directory(config), name, "input" + STORE_EXTENSION)
+
+
+def shard_config(config, name, threads=None):
+    """
+    Create the configuration of a single shard, which writes all its outputs
+    into the shard directory.
+    Parameters
+    ----------
+    config : dict
+        Pipeline configuration (see ./scripts/config_yamls).
+    name : str
+        Name of the pointing of the shard.
+    threads : int
+        Number of threads used by the stages of the shard (default: as in the
+        pipeline configuration).
+    Returns
+    -------
+    config : dict
+        Copy of the configuration with modified output paths.
+    """
+    config = copy.deepcopy(config)
+    config["paths"]["DATADIR"] = os.path.join(shard_directory(config), name)
+    config["paths"]["MOCKmasked"] = "/input" + STORE_EXTENSION
+    if threads is not None:
+        config["threads"] = threads
+    return config
+
+
+def partition_catalogue(config, chunk_size=1000000, telemetry=None):
+    """
+    Partition the masked catalogue (MOCKmasked) by pointing. Each shard is
+    a column store in the shard directory, objects keep their order from
+    the masked catalogue. Pointings without objects have no shard.
+    Parameters
+    ----------
+    config : dict
+        Pipeline configuration (see ./scripts/config_yamls).
+    chunk_size : int
+        Number of rows of the masked catalogue that are read at once.
+    telemetry : telemetry.Telemetry
+        Collects the performance record of the partitioning (optional).
+    Returns
+    -------
+    counts : dict
+        Number of objects per pointing name.
+    """
+    ra = config["columns"]["coordinates"]["RA"]
+    dec = config["columns"]["coordinates"]["DEC"]
+    MOCKmasked = config["paths"]["DATADIR"] + config["paths"]["MOCKmasked"]
+    pointing_names, bound_tuples = read_pointings_file(pointings_file(config))
+    print("==> partition %s into %d pointings" % (
+        MOCKmasked, len(pointing_names)))
+    # remove the shards of a previous partitioning
+    for name in pointing_names:
+        if os.path.exists(shard_input(config, name)):
+            shutil.rmtree(shard_input(config, name))
+        if shard_done(config, name):
+            os.remove(os.path.join(
+                shard_directory(config), name, SHARD_STATUS_FILE))
+    with measure(telemetry, "partition") as record:
+        stores = {}
+        counts = {}
+        for offset, chunk in iter_chunks(MOCKmasked, chunk_size=chunk_size):
+            index = assign_pointings(chunk[ra], chunk[dec], bound_tuples)
+            # stable sort keeps the object order within each pointing
+            order = np.argsort(index, kind="stable")
+            index = index[order]
+            chunk = chunk[order]
+            splits = np.flatnonzero(np.diff(index)) + 1
+            for start, end in zip(
+                    np.concatenate([[0], splits]),
+                    np.concatenate([splits, [len(index)]])):
+                if end == start:
+                    continue
+                name = pointing_names[index[start]]
+                if name not in stores:
+                    stores[name] = ColumnStore(
+                        shard_input(config, name), create=True)
+                    counts[name] = 0
+                stores[name].append_table(chunk[start:end])
+                counts[name] += end - start
+        record["rows_in"] = record["rows_out"] = sum(counts.values())
+    print("created %d shards with %d objects" % (
+        len(counts), sum(counts.values())))
+    return counts
+
+
+def shard_names(config):
+    """
+    Get the names of all shards, in the order of the pointings file.
+    """
+    pointing_names, _ = read_pointings_file(pointings_file(config))
+    return [
+        name for name in pointing_names
+        if os.path.exists(shard_input(config, name))]
+
+
+def shard_done(config, name):
+    """
+    Whether a shard has been processed successfully.
+    """
+    return os.path.exists(os.path.join(
+        shard_directory(config), name, SHARD_STATUS_FILE))
+
+
+def run_shard(config, name, threads=None):
+    """
+    Run all stages following the masking (see UNSHARDED_STAGES) on a single
+    shard. The output is logged to shard.log in the shard directory, the
+    telemetry of the stages is written to telemetry.json.
+    Parameters
+    ----------
+    config : dict
+        Pipeline configuration (see ./scripts/config_yamls).
+    name : str
+        Name of the pointing of the shard.
+    threads : int
+        Number of threads used by the stages of the shard (default: as in the
+        pipeline configuration).
+    Returns
+    -------
+    nrows : int
+        Number of objects in the final selection of the shard.
+    """
+    config = shard_config(config, name, threads)
+    datadir = config["paths"]["DATADIR"]
+    status_file = os.path.join(datadir, SHARD_STATUS_FILE)
+    if os.path.exists(status_file):
+        os.remove(status_file)
+    telemetry = Telemetry("shard", info={"pointing": name})
+    with open(os.path.join(datadir, "shard.log"), "w") as log:
+        with contextlib.redirect_stdout(log):
+            catalogue = ColumnStore(
+                datadir + config["paths"]["MOCKmasked"]).table()
+            graph = build_photometry_graph(config, [
+                stage for stage in build_photometry_graph(config).stages
+                if stage not in UNSHARDED_STAGES])
+            checkpoints = {
+                stage: path
+                for stage, path in default_checkpoints(config).items()
+                if stage in graph.stages}
+            cache_dir = config.get("stage_cache", "/stage_cache")
+            cache = None if cache_dir is None else StageCache(
+                datadir + cache_dir)
+            table = graph.run(
+                catalogue, checkpoints=checkpoints, cache=cache,
+                meta={"shard": name}, telemetry=telemetry)
+            telemetry.write(os.path.join(datadir, SHARD_TELEMETRY_FILE))
+    with open(status_file, "w") as f:
+        json.dump({
+            "pointing": name, "nrows_in": len(catalogue),
+            "nrows_out": len(table)}, f, indent=4)
+    return len(table)
+
+
+def _run_shard_safe(args):
+    # report exceptions of worker processes as text, they are collected by
+    # run_shards
+    config, name, threads = args
+    try:
+        return name, run_shard(config, name, threads), None
+    except Exception:
+        return name, None, traceback.format_exc()
+
+
+def run_shards(config, names=None, processes=1, rerun=False, telemetry=None):
+    """
+    Process the shards in a pool of worker processes. Shards that were
+    processed successfully before are skipped unless rerun is set.
+    Parameters
+    ----------
+    config : dict
+        Pipeline configuration (see ./scripts/config_yamls).
+    names : list of str
+        Names of the shards to process (default: all).
+    processes : int
+        Number of worker processes, the configured threads are divided among
+        them.
+    rerun : bool
+        Whether to process shards that have been completed before.
+    telemetry : telemetry.Telemetry
+        Collects the performance records of the stages, summed over the
+        processed shards (optional).
+    """
+    if names is None:
+        names = shard_names(config)
+    unknown = set(names) - set(shard_names(config))
+    if len(unknown) > 0:
+        raise ValueError("unknown shards: %s" % ", ".join(sorted(unknown)))
+    if not rerun:
+        names = [name for name in names if not shard_done(config, name)]
+    if len(names) == 0:
+        print("==> all shards are processed")
+        return
+    processes = max(1, min(processes, len(names)))
+    threads = max(1, int(config["threads"]) // processes)
+    print("==> process %d shards with %d processes and %d threads each" % (
+        len(names), processes, threads))
+    failed = {}
+    arguments = [(config, name, threads) for name in names]
+    with ProcessPoolExecutor(processes) as pool:
+        for name, nrows, error in pool.map(_run_shard_safe, arguments):
+            if error is None:
+                print("shard %s: done, %d objects selected" % (name, nrows))
+                if telemetry is not None:
+                    with open(os.path.join(
+                            shard_directory(config), name,
+                            SHARD_TELEMETRY_FILE)) as f:
+                        for record in json.load(f)["stages"]:
+                            telemetry.add(record, merge=True)
+            else:
+                print("shard %s: FAILED, see %s" % (name, os.path.join(
+                    shard_directory(config), name, "shard.log")))
+                failed[name] = error
+    if len(failed) > 0:
+        for name, error in failed.items():
+            print("==> error in shard %s:\n%s" % (name, error))
+        raise RuntimeError(
+            "%d shard(s) failed, rerun with --shards %s" % (
+                len(failed), " ".join(failed)))
+
+
+def merge_shards(config, chunk_size=1000000, telemetry=None):
+    """
+    Merge the outputs of all shards (MOCKoutfull and MOCKout) in the order of
+    the pointings file. All shards must be processed successfully.
+    Parameters
+    ----------
+    config : dict
+        Pipeline configuration (see ./scripts/config_yamls).
+    chunk_size : int
+        Number of rows of the shard outputs that are copied at once.
+    telemetry : telemetry.Telemetry
+        Collects the performance records of the merging (optional).
+    """
+    names = shard_names(config)
+    pending = [name for name in names if not shard_done(config, name)]
+    if len(pending) > 0:
+        raise RuntimeError(
+            "shards not processed: %s" % ", ".join(pending))
+    datadir = config["paths"]["DATADIR"]
+    for key in ("MOCKoutfull", "MOCKout"):
+        output = datadir + config["paths"][key]
+        print("==> merge %d shards into: %s" % (len(names), output))
+        with measure(telemetry, "merge:%s" % key) as record:
+            writer = open_writer(output)
+            try:
+                for name in names:
+                    shard_path = os.path.join(
+                        shard_directory(config), name) + config["paths"][key]
+                    for offset, chunk in iter_chunks(
+                            shard_path, chunk_size=chunk_size):
+                        writer.write(chunk)
+            finally:
+                writer.close()
+            record["rows_in"] = record["rows_out"] = writer.nrows
+        print("wrote %d objects" % writer.nrows)
@@ -0,0 +1,441 @@
+###############################################################################
+#                                                                             #
+#   Photometry realisations regenerated on demand. The noise of a realisation #
+#   depends only on the seed, filter, object ID and realisation index, such   #
+#   that any rows of any realisation are recomputed from the stored model     #
+#   magnitudes, limits and S/N factors instead of being written to disk.      #
+#                                                                             #
+###############################################################################
+
+import json
+
+import numpy as np
+from astropy import units
+from astropy.table import Column, Table
+
+from catalogue_io import map_columns
+from condition_maps import ConditionMap, index_nside
+from mocks_photometry_realisation import (
+    RECIPE_VERSION, realisation_column_names, realisation_recipe,
+    realise_bands)
+
+
+class RealisationColumn(object):
+    """
+    Array-like column of a RealisationView, the values are computed when the
+    column is indexed. Indexing follows the stored columns of
+    mocks_photometry_realisation.py, i.e. the second axis indexes the
+    realisations if there are more than one. The column converts to a numpy
+    array, but is not an astropy Column.
+    Parameters
+    ----------
+    view : RealisationView
+        View that computes the values.
+    name : str
+        Name of the realisation (_obs) or error (_obserr) column.
+    """
+
+    def __init__(self, view, name):
+        self.view = view
+        self.name = name
+        self.unit = units.mag
+
+    @property
+    def shape(self):
+        if self.view.n_realisations > 1:
+            return (len(self.view), self.view.n_realisations)
+        return (len(self.view),)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def dtype(self):
+        return np.dtype(np.float32)
+
+    def __len__(self):
+        return len(self.view)
+
+    def __getitem__(self, key):
+        realisations = None
+        if isinstance(key, tuple):
+            if len(key) != 2 or self.view.n_realisations == 1:
+                raise IndexError("too many indices for column %s" % self.name)
+            key, realisations = key
+        # shape (n_realisations, n_rows)
+        values = self.view.read(self.name, key, realisations)
+        if isinstance(key, (int, np.integer)):
+            values = values[:, 0]
+        if self.view.n_realisations == 1:
+            return values[0]
+        values = np.moveaxis(values, 0, -1)
+        if isinstance(realisations, (int, np.integer)):
+            return values[..., 0]
+        return values
+
+    def __array__(self, dtype=None, copy=None):
+        values = self[:]
+        return values if dtype is None else values.astype(dtype)
+
+
+class RealisationView(object):
+    """
+    Read-only view of photometry realisations (see
+    mocks_photometry_realisation.photometry_realisations) that are recomputed
+    for the requested rows and realisations when they are accessed. Only the
+    input columns of these rows are read from the catalogue, which should
+    therefore be memory-mapped (see catalogue_io.load_table). Recipe files
+    are read like a catalogue of the realisation columns by the readers of
+    catalogue_io (see column).
+    Parameters
+    ----------
+    data : astropy.table.Table
+        Catalogue with the model magnitudes, the S/N correction factors and
+        the object ID and map index columns.
+    filters : list of str
+        Column names of the model magnitudes.
+    limits : list of float
+        Magnitude limit of each filter.
+    sn_factors : list of str
+        Column names of the S/N correction factor of each filter (optional).
+    n_realisations : int
+        Number of realisations provided by the view.
+    significance : float
+        Significance of detection against magnitude limits.
+    sn_limit : float
+        Lower numerical limit for the signal-to-noise ratio.
+    sn_detect : float
+        Limiting signal-to-noise ratio for object detection.
+    seed : str
+        String to seed the random generator.
+    id_column : str
+        Column name of the stable object ID (default: the row index).
+    bands : list of str
+        Band name that keys the noise of each filter (default: the filter
+        names).
+    limits_map : str
+        File path of a map of the magnitude limits per pointing or pixel
+        (see condition_maps.ConditionMap, optional).
+    map_index : str
+        Column name of the pointing or pixel index (default: the map index
+        column).
+    threads : int
+        Number of threads used to compute the realisations.
+    """
+
+    def __init__(self, data, filters, limits, sn_factors=None,
+                 n_realisations=1, significance=1.0, sn_limit=0.2,
+                 sn_detect=1.0, seed="KV450", id_column=None, bands=None,
+                 limits_map=None, map_index=None, threads=1):
+        self.data = data
+        self.filters = list(filters)
+        self.limits = [float(lim) for lim in limits]
+        if len(self.limits) != len(self.filters):
+            raise ValueError("number of limits does not match the filters")
+        self.sn_factors = None if sn_factors is None else list(sn_factors)
+        if self.sn_factors is not None and \
+                len(self.sn_factors) != len(self.filters):
+            raise ValueError(
+                "number of S/N factors does not match the filters")
+        if n_realisations < 1:
+            raise ValueError("number of realisations must be positive")
+        self.n_realisations = int(n_realisations)
+        self.significance = float(significance)
+        self.sn_limit = float(sn_limit)
+        self.sn_detect = float(sn_detect)
+        self.seed = seed
+        self.id_column = id_column
+        self.bands = list(self.filters if bands is None else bands)
+        if len(self.bands) != len(self.filters):
+            raise ValueError("number of bands does not match the filters")
+        self.limits_map = limits_map
+        self._map = None
+        if limits_map is not None:
+            self._map = ConditionMap.read(limits_map)
+            if map_index is None:
+                map_index = self._map.column
+        self.map_index = map_index
+        self.threads = threads
+        # output column name -> (filter, whether it is the error column)
+        self._columns = {}
+        for filt in self.filters:
+            key, keyerr = realisation_column_names(filt)
+            self._columns[key] = (filt, False)
+            self._columns[keyerr] = (filt, True)
+        missing = [
+            col for col in self.input_columns if col not in data.colnames]
+        if len(missing) > 0:
+            raise KeyError(
+                "catalogue does not contain columns: %s" % ", ".join(missing))
+        # the realisations of the last read, such that the magnitudes and
+        # their errors of the same rows are computed once
+        self._last = (None, None)
+
+    @property
+    def input_columns(self):
+        """
+        Catalogue columns required to compute the realisations.
+        """
+        columns = list(self.filters)
+        if self.sn_factors is not None:
+            columns.extend(self.sn_factors)
+        for col in (self.id_column, self.map_index):
+            if col is not None and col not in columns:
+                columns.append(col)
+        return columns
+
+    @property
+    def colnames(self):
+        return list(self._columns.keys())
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __getitem__(self, name):
+        if name not in self:
+            raise KeyError("no realisation column: %s" % name)
+        return RealisationColumn(self, name)
+
+    def _rows(self, rows):
+        """
+        Normalise a row index to a slice with step 1 or an integer array.
+        """
+        if rows is None:
+            return slice(0, len(self))
+        if isinstance(rows, slice):
+            start, stop, step = rows.indices(len(self))
+            if step == 1:
+                return slice(start, max(start, stop))
+            return np.arange(start, stop, step)
+        if isinstance(rows, (int, np.integer)):
+            if not -len(self) <= rows < len(self):
+                raise IndexError("row %d out of range" % rows)
+            start = rows % len(self)
+            return slice(start, start + 1)
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            if rows.shape != (len(self),):
+                raise IndexError(
+                    "boolean index of length %d for %d rows" % (
+                        len(rows), len(self)))
+            return np.flatnonzero(rows)
+        if rows.dtype.kind not in "iu":
+            raise IndexError("row indices must be integers")
+        # negative indices count from the end, the rows are also the object
+        # IDs if there is no ID column
+        if np.any((rows < -len(self)) | (rows >= len(self))):
+            raise IndexError("row index out of range for %d rows" % len(self))
+        return np.where(rows < 0, rows + len(self), rows)
+
+    def _realisations(self, realisations):
+        """
+        Normalise a realisation index to a list of realisation indices.
+        """
+        if realisations is None:
+            return list(range(self.n_realisations))
+        indices = np.arange(self.n_realisations)[realisations]
+        return [int(i) for i in np.atleast_1d(indices)]
+
+    def compute(self, filt, rows=None, realisations=None):
+        """
+        Compute the realisations of a filter for a range of rows.
+        Parameters
+        ----------
+        filt : str
+            Column name of the model magnitudes.
+        rows : slice or array_like
+            Rows to compute (default: all).
+        realisations : int, slice or array_like
+            Realisations to compute (default: all).
+        Returns
+        -------
+        real_mags : array_like
+            Magnitude realisations (float32), shape (n_realisations, n_rows).
+        real_mags_err : array_like
+            Errors of the magnitude realisations (float32).
+        """
+        rows = self._rows(rows)
+        realisations = self._realisations(realisations)
+        if isinstance(rows, slice):
+            key = (filt, rows.start, rows.stop, tuple(realisations))
+            if self._last[0] == key:
+                return self._last[1]
+        else:
+            key = None
+        index = self.filters.index(filt)
+        mag_model_limits = {filt: self.limits[index]}
+        if self._map is not None:
+            mag_model_limits = self._map.gather(
+                self.data[self.map_index][rows], mag_model_limits,
+                index_nside(self.map_index))
+        sn_factor_data = None
+        if self.sn_factors is not None:
+            sn_factor_data = {
+                filt: self.data[self.sn_factors[index]][rows]}
+        if self.id_column is not None:
+            object_ids = self.data[self.id_column][rows]
+        elif isinstance(rows, slice):
+            object_ids = np.arange(rows.start, rows.stop)
+        else:
+            object_ids = rows
+        result = realise_bands(
+            {filt: self.data[filt][rows]}, mag_model_limits, sn_factor_data,
+            realisations=realisations, significance=self.significance,
+            sn_limit=self.sn_limit, sn_detect=self.sn_detect, seed=self.seed,
+            object_ids=object_ids, bands={filt: self.bands[index]},
+            threads=self.threads, verbose=False)[filt]
+        if key is not None:
+            self._last = (key, result)
+        return result
+
+    def read(self, name, rows=None, realisations=None):
+        """
+        Read the values of a realisation column.
+        Parameters
+        ----------
+        name : str
+            Name of the realisation (_obs) or error (_obserr) column.
+        rows : slice or array_like
+            Rows to read (default: all).
+        realisations : int, slice or array_like
+            Realisations to read (default: all).
+        Returns
+        -------
+        values : array_like
+            Column values (float32), shape (n_realisations, n_rows).
+        """
+        if name not in self:
+            raise KeyError("no realisation column: %s" % name)
+        filt, is_error = self._columns[name]
+        return self.compute(filt, rows, realisations)[int(is_error)]
+
+    def column(self, name, rows=None):
+        """
+        Compute a realisation column for a range of rows with all
+        realisations, in the layout of the stored columns (see
+        RealisationColumn), e.g. to read a recipe like a catalogue (see
+        catalogue_io.load_table).
+        Parameters
+        ----------
+        name : str
+            Name of the realisation (_obs) or error (_obserr) column.
+        rows : slice or array_like
+            Rows to compute (default: all).
+        Returns
+        -------
+        column : astropy.table.Column
+            Column with the magnitude realisations or their errors.
+        """
+        values = self[name][self._rows(rows)]
+        is_error = self._columns[name][1]
+        if self.n_realisations > 1:
+            description = (
+                "errors of realisations of model magnitude" if is_error
+                else "realisations of model magnitude")
+        else:
+            description = (
+                "error of realisation of model magnitude" if is_error
+                else "realisation of model magnitude")
+        return Column(
+            values, name=name, unit=units.mag, description=description,
+            copy=False)
+
+    def table(self, rows=None, realisation=0, columns=None):
+        """
+        Compute a table of the realisation columns of a single realisation,
+        e.g. to process a catalogue in chunks of rows.
+        Parameters
+        ----------
+        rows : slice or array_like
+            Rows to compute (default: all).
+        realisation : int
+            Index of the realisation.
+        columns : list of str
+            Subset of columns to include (default: all).
+        Returns
+        -------
+        table : astropy.table.Table
+            Table with the magnitude realisations and their errors.
+        """
+        if columns is None:
+            columns = self.colnames
+        table_columns = []
+        for name in columns:
+            values = self.read(name, rows, realisation)[0]
+            is_error = self._columns[name][1]
+            table_columns.append(Column(
+                values, name=name, unit=units.mag, copy=False,
+                description=(
+                    "error of realisation of model magnitude" if is_error
+                    else "realisation of model magnitude")))
+        table = Table(table_columns, copy=False)
+        table.meta["REALISATION"] = realisation
+        table.meta["SEED"] = self.seed
+        return table
+
+    def recipe(self, path, format=None):
+        """
+        Get the parameters that recreate the view from a catalogue file (see
+        mocks_photometry_realisation.realisation_recipe).
+        Parameters
+        ----------
+        path : str
+            File path of the catalogue that provides the input columns.
+        format : str
+            Catalogue format (see catalogue_io.table_format).
+        Returns
+        -------
+        recipe : dict
+            JSON serialisable parameters (see from_recipe).
+        """
+        return realisation_recipe(
+            path, self.filters, self.limits, self.sn_factors,
+            n_realisations=self.n_realisations,
+            significance=self.significance, sn_limit=self.sn_limit,
+            sn_detect=self.sn_detect, seed=self.seed,
+            id_column=self.id_column, bands=self.bands,
+            limits_map=self.limits_map, map_index=self.map_index,
+            format=format)
+
+    def write(self, recipe_path, path, format=None):
+        """
+        Write the recipe of the view (see recipe) to a JSON file.
+        """
+        with open(recipe_path, "w") as f:
+            json.dump(self.recipe(path, format), f, indent=4)
+
+    @classmethod
+    def from_recipe(cls, recipe, threads=1):
+        """
+        Create a view from a recipe (see recipe), the input columns of the
+        catalogue are memory-mapped.
+        """
+        if recipe.get("version") != RECIPE_VERSION:
+            raise ValueError(
+                "unsupported realisation recipe version: %s" %
+                recipe.get("version"))
+        params = {
+            key: value for key, value in recipe.items()
+            if key not in ("version", "catalogue", "format")}
+        columns = list(recipe["filters"])
+        if recipe["sn_factors"] is not None:
+            columns.extend(recipe["sn_factors"])
+        for col in (recipe["id_column"], recipe["map_index"]):
+            if col is not None and col not in columns:
+                columns.append(col)
+        data = Table(
+            map_columns(recipe["catalogue"], recipe["format"], columns),
+            copy=False)
+        return cls(data, threads=threads, **params)
+
+    @classmethod
+    def open(cls, recipe_path, threads=1):
+        """
+        Create a view from a JSON recipe file (see write).
+        """
+        with open(recipe_path) as f:
+            return cls.from_recipe(json.load(f), threads)
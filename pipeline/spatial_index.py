@@ -0,0 +1,226 @@
+###############################################################################
+#                                                                             #
+#   Row range index of spatially sorted catalogues. The rows of a catalogue   #
+#   sorted by their NESTED HEALPix index (see data_spatial_sort.py) form one  #
+#   contiguous range per pixel. A sidecar file records the number of rows in  #
+#   each pixel, such that region reads only touch the row ranges of the       #
+#   pixels that overlap the region.                                           #
+#                                                                             #
+###############################################################################
+
+import os
+
+import numpy as np
+from astropy.table import vstack
+
+import healpix
+from catalogue_io import count_rows, iter_chunks, load_table
+
+
+# file name extension of the sidecar index, appended to the catalogue path
+INDEX_EXTENSION = ".index.npz"
+
+
+def index_path(path):
+    """
+    File path of the sidecar index of a catalogue.
+    """
+    return path.rstrip(os.sep) + INDEX_EXTENSION
+
+
+class SpatialIndex(object):
+    """
+    Maps the pixels of a NESTED HEALPix map to the row ranges of a catalogue
+    sorted by pixel index.
+    Parameters
+    ----------
+    nside : int
+        HEALPix resolution parameter of the sorting.
+    counts : array_like
+        Number of rows in each pixel.
+    """
+
+    version = 1
+
+    def __init__(self, nside, counts):
+        healpix.check_nside(nside)
+        counts = np.asarray(counts, dtype=np.int64)
+        if len(counts) != healpix.npix(nside):
+            raise ValueError(
+                "expected %d pixel counts for nside=%d, got %d" % (
+                    healpix.npix(nside), nside, len(counts)))
+        self.nside = int(nside)
+        self.counts = counts
+        # rows of pixel i: offsets[i] to offsets[i + 1]
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    @property
+    def nrows(self):
+        return int(self.offsets[-1])
+
+    def save(self, path):
+        """
+        Write the index to a (compressed) numpy .npz file.
+        """
+        np.savez_compressed(
+            path, version=self.version, nside=self.nside, counts=self.counts)
+
+    @classmethod
+    def open(cls, path, format=None):
+        """
+        Read the sidecar index of a catalogue.
+        Parameters
+        ----------
+        path : str
+            File path of the catalogue.
+        format : str
+            Catalogue format (see catalogue_io.table_format).
+        Returns
+        -------
+        index : SpatialIndex
+            Index of the catalogue, None if there is no index or if it does
+            not match the row count of the catalogue (e.g. the catalogue was
+            replaced after sorting).
+        """
+        ipath = index_path(path)
+        if not os.path.exists(ipath):
+            return None
+        with np.load(ipath) as data:
+            if int(data["version"]) != cls.version:
+                return None
+            index = cls(int(data["nside"]), data["counts"])
+        if index.nrows != count_rows(path, format):
+            print("WARNING: ignoring outdated spatial index: %s" % ipath)
+            return None
+        return index
+
+    def row_ranges(self, region, max_gap=0):
+        """
+        Compute the row ranges of the pixels that overlap with a region.
+        Parameters
+        ----------
+        region : object
+            Region with a coverage(nside) method, e.g. a
+            footprint_regions.Rectangle or RegionMask.
+        max_gap : int
+            Ranges separated by up to this number of rows are merged, which
+            trades reading surplus rows for fewer reads.
+        Returns
+        -------
+        ranges : array_like
+            Start and stop row of the ranges, shape (n_ranges, 2).
+        """
+        maybe, inside = region.coverage(self.nside)
+        pix = np.flatnonzero(maybe & (self.counts > 0))
+        if len(pix) == 0:
+            return np.empty((0, 2), dtype=np.int64)
+        starts = self.offsets[pix]
+        stops = self.offsets[pix + 1]
+        # neighbouring pixels along the NESTED curve are adjacent in the file
+        gaps = starts[1:] - stops[:-1] > max_gap
+        first = np.concatenate([[True], gaps])
+        last = np.concatenate([gaps, [True]])
+        return np.column_stack([starts[first], stops[last]])
+
+
+def iter_region_chunks(
+        path, region, format=None, columns=None, chunk_size=1000000,
+        max_gap=None):
+    """
+    Iterate over the rows of a catalogue that may lie within a region, the
+    chunks still require an exact mask (e.g. region.contains). Only the row
+    ranges listed by the sidecar index are read, without an index all rows
+    are read (see catalogue_io.iter_chunks).
+    Parameters
+    ----------
+    path : str
+        File path of the catalogue.
+    region : object
+        Region with a coverage(nside) method, e.g. a
+        footprint_regions.Rectangle or RegionMask.
+    format : str
+        Catalogue format (see catalogue_io.table_format).
+    columns : list of str
+        Columns to read (default: all).
+    chunk_size : int
+        Maximum number of rows per chunk.
+    max_gap : int
+        Merge row ranges separated by up to this number of rows (default:
+        chunk_size / 16).
+    Yields
+    ------
+    offset : int
+        Row index of the first row of the chunk in the catalogue.
+    chunk : astropy.table.Table
+        Table with the data of the chunk.
+    """
+    index = SpatialIndex.open(path, format)
+    if index is None:
+        yield from iter_chunks(path, format, columns, chunk_size)
+        return
+    if max_gap is None:
+        max_gap = chunk_size // 16
+    for start, stop in index.row_ranges(region, max_gap):
+        yield from iter_chunks(
+            path, format, columns, chunk_size, start=start, stop=stop)
+
+
+def load_region(path, region, ra, dec, format=None, cols=None,
+                row_index=False):
+    """
+    Load the objects of a catalogue within a region. If the catalogue has a
+    sidecar index, only the overlapping row ranges are read.
+    Parameters
+    ----------
+    path : str
+        File path of the catalogue.
+    region : object
+        Region with coverage(nside) and contains(ra, dec) methods, e.g. a
+        footprint_regions.Rectangle.
+    ra : str
+        Column name of the right ascension.
+    dec : str
+        Column name of the declination.
+    format : str
+        Catalogue format (see catalogue_io.table_format).
+    cols : list of str
+        Subset of columns to load (default: all).
+    row_index : bool
+        Whether the row index of the objects in the catalogue is returned.
+    Returns
+    -------
+    table : astropy.table.Table
+        Objects within the region.
+    rows : array_like
+        Row index of the objects in the catalogue (if row_index is True).
+    """
+    read_cols = cols
+    if cols is not None:
+        read_cols = list(cols) + [c for c in (ra, dec) if c not in cols]
+    index = SpatialIndex.open(path, format)
+    if index is None:
+        chunks = [(0, load_table(path, format, read_cols))]
+    else:
+        print("load data table: %s (%d / %d pixels)" % (
+            path, np.count_nonzero(region.coverage(index.nside)[0]),
+            healpix.npix(index.nside)))
+        chunks = list(iter_region_chunks(
+            path, region, format, read_cols, chunk_size=max(index.nrows, 1)))
+        if len(chunks) == 0:
+            # keep the columns of the catalogue
+            offset, chunk = next(iter_chunks(path, format, read_cols, 1))
+            chunks = [(0, chunk[:0])]
+    masked = []
+    rows = []
+    for offset, chunk in chunks:
+        mask = region.contains(chunk[ra].data, chunk[dec].data)
+        if isinstance(mask, dict):  # RegionMask: union of the regions
+            mask = np.any(list(mask.values()), axis=0)
+        masked.append(chunk[mask])
+        rows.append(offset + np.flatnonzero(mask))
+    table = masked[0] if len(masked) == 1 else vstack(masked)
+    if cols is not None:
+        table = table[list(cols)]
+    if row_index:
+        return table, np.concatenate(rows)
+    return table
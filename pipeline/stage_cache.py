@@ -0,0 +1,233 @@
+###############################################################################
+#                                                                             #
+#   Content-addressed cache for the stages of stage_graph.StageGraph. Each    #
+#   stage is identified by a hash of its input columns, its parameters and    #
+#   the source code it runs. If a result with the same hash exists on disk,   #
+#   the stage is skipped and the cached result is loaded instead.             #
+#                                                                             #
+###############################################################################
+
+import inspect
+import json
+import os
+import shutil
+import sys
+from hashlib import md5
+
+import numpy as np
+from astropy.table import Column, Table
+
+
+def column_fingerprint(data):
+    """
+    Compute a hash of the content of a data column.
+    Parameters
+    ----------
+    data : array_like
+        Column data.
+    Returns
+    -------
+    fingerprint : str
+        Hexadecimal md5 digest of the data type, shape and values.
+    """
+    data = np.ascontiguousarray(data)
+    hasher = md5(bytes("%s %s" % (data.dtype.str, data.shape), "utf-8"))
+    hasher.update(data.view(np.uint8).reshape(-1).data)
+    return hasher.hexdigest()
+
+
+def params_fingerprint(params):
+    """
+    Compute a hash of stage parameters.
+    Parameters
+    ----------
+    params : dict
+        Keyword arguments of a stage.
+    Returns
+    -------
+    fingerprint : str
+        Hexadecimal md5 digest of the parameters.
+    """
+    string = json.dumps(params, sort_keys=True, default=repr)
+    return md5(bytes(string, "utf-8")).hexdigest()
+
+
+def file_fingerprint(fpath):
+    """
+    Compute a hash of the path, size and modification time of a file.
+    Parameters
+    ----------
+    fpath : str
+        File path.
+    Returns
+    -------
+    fingerprint : str
+        Hexadecimal md5 digest of the file properties.
+    """
+    stat = os.stat(fpath)
+    string = "%s %d %d" % (
+        os.path.abspath(fpath), stat.st_size, stat.st_mtime_ns)
+    return md5(bytes(string, "utf-8")).hexdigest()
+
+
+def code_fingerprint(objects):
+    """
+    Compute a hash of the source files that define a set of functions or
+    modules, such that any change to the code invalidates cached results.
+    Parameters
+    ----------
+    objects : list
+        Functions or modules.
+    Returns
+    -------
+    fingerprint : str
+        Hexadecimal md5 digest of the source files.
+    """
+    hasher = md5()
+    files = set()
+    for obj in objects:
+        if not inspect.ismodule(obj):
+            obj = sys.modules[obj.__module__]
+        files.add(inspect.getsourcefile(obj))
+    for fpath in sorted(files):
+        with open(fpath, "rb") as f:
+            hasher.update(f.read())
+    return hasher.hexdigest()
+
+
+class StageCache(object):
+    """
+    On-disk cache of stage results, indexed by stage name and stage hash.
+    Table results are stored as one .npy file per column, selection masks as
+    mask.npy. A manifest (result.json) records the hash inputs and is written
+    last, such that only complete results are considered valid.
+    Parameters
+    ----------
+    cache_dir : str
+        Folder in which the results are stored.
+    keep : int
+        Number of results to keep per stage, older ones are deleted.
+    """
+
+    def __init__(self, cache_dir, keep=3):
+        self.cache_dir = cache_dir
+        self.keep = keep
+        os.makedirs(cache_dir, exist_ok=True)
+        self._checkpoint_file = os.path.join(cache_dir, "checkpoints.json")
+
+    def _path(self, stage_name, digest):
+        return os.path.join(self.cache_dir, stage_name, digest)
+
+    def has(self, stage_name, digest):
+        """
+        Whether a complete result of a stage with a given hash exists.
+        """
+        return os.path.exists(
+            os.path.join(self._path(stage_name, digest), "result.json"))
+
+    def load(self, stage_name, digest):
+        """
+        Load a cached stage result.
+        Parameters
+        ----------
+        stage_name : str
+            Name of the stage.
+        digest : str
+            Stage hash.
+        Returns
+        -------
+        result : astropy.table.Table, boolean array_like or None
+            Result in the format returned by the stage function.
+        """
+        path = self._path(stage_name, digest)
+        with open(os.path.join(path, "result.json")) as f:
+            manifest = json.load(f)
+        if manifest["type"] == "none":
+            return None
+        if manifest["type"] == "mask":
+            return np.load(os.path.join(path, "mask.npy"))
+        table = Table()
+        for i, meta in enumerate(manifest["columns"]):
+            data = np.load(
+                os.path.join(path, "%03d.npy" % i), mmap_mode="r")
+            table[meta["name"]] = Column(
+                data, unit=meta["unit"], description=meta["description"],
+                copy=False)
+        return table
+
+    def store(self, stage_name, digest, result, info=None):
+        """
+        Store the result of a stage.
+        Parameters
+        ----------
+        stage_name : str
+            Name of the stage.
+        digest : str
+            Stage hash.
+        result : astropy.table.Table, boolean array_like or None
+            Result returned by the stage function.
+        info : dict
+            Additional information recorded in the manifest.
+        """
+        path = self._path(stage_name, digest)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        manifest = {"stage": stage_name, "digest": digest}
+        if info is not None:
+            manifest.update(info)
+        if result is None:
+            manifest["type"] = "none"
+        elif isinstance(result, Table):
+            manifest["type"] = "table"
+            manifest["columns"] = []
+            for i, col in enumerate(result.colnames):
+                column = result[col]
+                np.save(
+                    os.path.join(path, "%03d.npy" % i), np.asarray(column))
+                manifest["columns"].append({
+                    "name": col,
+                    "unit": None if column.unit is None else str(column.unit),
+                    "description": column.description})
+        else:
+            manifest["type"] = "mask"
+            np.save(
+                os.path.join(path, "mask.npy"),
+                np.asarray(result, dtype="bool"))
+        with open(os.path.join(path, "result.json"), "w") as f:
+            json.dump(manifest, f, indent=4, default=repr)
+        self._prune(stage_name, digest)
+
+    def _prune(self, stage_name, current):
+        """
+        Delete the oldest results of a stage exceeding self.keep.
+        """
+        stage_dir = os.path.join(self.cache_dir, stage_name)
+        results = sorted(
+            (os.path.getmtime(os.path.join(stage_dir, d)), d)
+            for d in os.listdir(stage_dir) if d != current)
+        for mtime, digest in results[:max(0, len(results) - self.keep + 1)]:
+            shutil.rmtree(os.path.join(stage_dir, digest))
+
+    def _read_checkpoints(self):
+        if not os.path.exists(self._checkpoint_file):
+            return {}
+        with open(self._checkpoint_file) as f:
+            return json.load(f)
+
+    def checkpoint_current(self, path, digest):
+        """
+        Whether a checkpoint file exists and was written from a catalogue
+        state with the given hash.
+        """
+        checkpoints = self._read_checkpoints()
+        return os.path.exists(path) and checkpoints.get(path) == digest
+
+    def register_checkpoint(self, path, digest):
+        """
+        Record the catalogue state hash of a written checkpoint file.
+        """
+        checkpoints = self._read_checkpoints()
+        checkpoints[path] = digest
+        with open(self._checkpoint_file, "w") as f:
+            json.dump(checkpoints, f, indent=4)
@@ -0,0 +1,578 @@
+###############################################################################
+#                                                                             #
+#   In-process pipeline runner. Pipeline stages are modelled as a dependency  #
+#   graph based on the catalogue columns they consume and produce. Column     #
+#   data is passed between stages in memory, data is only written to disk at  #
+#   explicitly requested checkpoints. Optionally, stage results are cached    #
+#   and reused if inputs, parameters and code are unchanged (stage_cache.py). #
+#                                                                             #
+###############################################################################
+
+import os
+from collections import OrderedDict
+from hashlib import md5
+
+import numpy as np
+from astropy.table import Table
+
+from column_store import ColumnStore, is_column_store
+from stage_cache import (
+    code_fingerprint, column_fingerprint, file_fingerprint,
+    params_fingerprint)
+from telemetry import measure
+
+
+class Stage(object):
+    """
+    A single pipeline stage that computes new catalogue columns from a set of
+    input columns.
+    Parameters
+    ----------
+    name : str
+        Unique name of the stage.
+    function : callable
+        Stage implementation, called as function(data, **params), where data
+        is an astropy.table.Table with the input columns. Must return an
+        astropy.table.Table with the new columns, a boolean mask (selection
+        stages) or None (stages with side effects only, e.g. footprint files).
+    inputs : list of str
+        Catalogue columns required by the stage.
+    outputs : list of str
+        Catalogue columns produced by the stage (used to resolve the
+        dependencies between stages).
+    params : dict
+        Keyword arguments passed to function.
+    after : list of str
+        Names of stages that must run before this stage, independent of the
+        column dependencies.
+    selection : bool
+        Whether the stage returns a row mask that is applied to all catalogue
+        columns. Selection stages are barriers: they run after all stages
+        added before them and before all stages added after them.
+    code : list
+        Additional functions or modules whose source code determines the
+        stage version, the module defining function is always included.
+    products : list of str
+        Files created by the stage as a side effect. A cached result is only
+        used if all these files exist.
+    sources : list of str
+        External files read by the stage (e.g. real data tables), their size
+        and modification time are included in the stage hash.
+    """
+
+    def __init__(
+            self, name, function, inputs=(), outputs=(), params=None,
+            after=(), selection=False, code=(), products=(), sources=()):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = {} if params is None else params
+        self.after = list(after)
+        self.selection = selection
+        self.code = [function, *code]
+        self.products = list(products)
+        self.sources = list(sources)
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, self.name)
+
+    def __call__(self, data):
+        return self.function(data, **self.params)
+
+    def version(self):
+        """
+        Hash of the source code run by the stage.
+        """
+        return code_fingerprint(self.code)
+
+
+class StageGraph(object):
+    """
+    Dependency graph of pipeline stages that runs all stages in-process and
+    keeps the catalogue columns in memory.
+    Parameters
+    ----------
+    stages : list of Stage
+        Stages in their preferred order of execution, which is used whenever
+        the dependencies do not determine the order.
+    """
+
+    def __init__(self, stages=()):
+        self.stages = OrderedDict()
+        for stage in stages:
+            self.add(stage)
+        self.columns = OrderedDict()
+        # content hashes of the columns, None if not yet computed
+        self.fingerprints = OrderedDict()
+        # name of the stage that created each column
+        self.provenance = {}
+        # columns written to each column store checkpoint during this run
+        self._store_written = {}
+        # meta data passed to the stages, e.g. the current chunk when streaming
+        self.meta = {}
+        # row of each object in the input catalogue, follows the selections
+        self.row_index = None
+        # content hash of the row index, None if not yet computed
+        self._row_fingerprint = None
+
+    def add(self, stage):
+        """
+        Register a new stage.
+        Parameters
+        ----------
+        stage : Stage
+            Stage to add to the graph.
+        """
+        if stage.name in self.stages:
+            raise ValueError("stage '%s' already exists" % stage.name)
+        self.stages[stage.name] = stage
+
+    def dependencies(self):
+        """
+        Collect the stages each stage depends on.
+        Returns
+        -------
+        depends : dict
+            List of stage names per stage name.
+        """
+        names = list(self.stages.keys())
+        producers = {}
+        for name, stage in self.stages.items():
+            for col in stage.outputs:
+                producers[col] = name
+        depends = OrderedDict()
+        for i, (name, stage) in enumerate(self.stages.items()):
+            deps = set(stage.after)
+            for col in stage.inputs:
+                if col in producers and producers[col] != name:
+                    deps.add(producers[col])
+            # selection stages are barriers in the order of insertion
+            for j, other in enumerate(names):
+                if j < i and self.stages[other].selection:
+                    deps.add(other)
+                elif j < i and stage.selection:
+                    deps.add(other)
+            unknown = deps - set(names)
+            if len(unknown) > 0:
+                raise KeyError(
+                    "stage '%s' depends on unknown stages: %s" % (
+                        name, ", ".join(sorted(unknown))))
+            depends[name] = [n for n in names if n in deps]
+        return depends
+
+    def order(self):
+        """
+        Compute the order of execution of the stages from their dependencies.
+        Returns
+        -------
+        order : list of Stage
+            Stages in topological order.
+        """
+        depends = self.dependencies()
+        order = []
+        done = set()
+        while len(order) < len(depends):
+            # pick the first stage (in insertion order) that is ready to run
+            for name, deps in depends.items():
+                if name not in done and all(d in done for d in deps):
+                    order.append(self.stages[name])
+                    done.add(name)
+                    break
+            else:
+                pending = [n for n in depends if n not in done]
+                raise RuntimeError(
+                    "circular dependency between stages: %s" %
+                    ", ".join(pending))
+        return order
+
+    def __len__(self):
+        if len(self.columns) == 0:
+            return 0
+        return len(next(iter(self.columns.values())))
+
+    def table(self, columns=None):
+        """
+        Get a table view of the in-memory catalogue columns.
+        Parameters
+        ----------
+        columns : list of str
+            Subset of columns to include (default: all).
+        Returns
+        -------
+        table : astropy.table.Table
+            Table referencing the in-memory column data (no copy).
+        """
+        if columns is None:
+            columns = list(self.columns.keys())
+        missing = [col for col in columns if col not in self.columns]
+        if len(missing) > 0:
+            raise KeyError(
+                "catalogue does not contain columns: %s" % ", ".join(missing))
+        return Table(
+            [self.columns[col] for col in columns], meta=self.meta,
+            copy=False)
+
+    def stage_input(self, stage):
+        """
+        Get the input table of a stage, its meta data contains the row index
+        of each object in the input catalogue (row_index), e.g. to key random
+        numbers independent of selections and chunking.
+        """
+        table = self.table(stage.inputs)
+        # the table references the graph meta data
+        table.meta = dict(self.meta)
+        if self.row_index is not None:
+            table.meta["row_index"] = self.row_index
+        return table
+
+    def fingerprint(self, col):
+        """
+        Get the content hash of a catalogue column. Columns created by stages
+        are identified by the hash of the stage, all others are hashed from
+        their data on first request.
+        """
+        if self.fingerprints.get(col) is None:
+            self.fingerprints[col] = column_fingerprint(self.columns[col])
+        return self.fingerprints[col]
+
+    def row_fingerprint(self):
+        """
+        Get the content hash of the row index, hashed from its data on first
+        request.
+        """
+        if self._row_fingerprint is None:
+            self._row_fingerprint = column_fingerprint(self.row_index)
+        return self._row_fingerprint
+
+    def stage_digest(self, stage):
+        """
+        Compute the hash of a stage from its name, code version, parameters,
+        input column contents and the row index (see stage_input), which keys
+        the random numbers of stages.
+        Parameters
+        ----------
+        stage : Stage
+            Stage to compute the hash for.
+        Returns
+        -------
+        digest : str
+            Hexadecimal md5 digest.
+        """
+        hasher = md5(bytes(stage.name, "utf-8"))
+        hasher.update(bytes(stage.version(), "utf-8"))
+        hasher.update(bytes(params_fingerprint(stage.params), "utf-8"))
+        if len(self.meta) > 0:
+            hasher.update(bytes(params_fingerprint(self.meta), "utf-8"))
+        for fpath in stage.sources:
+            hasher.update(bytes(file_fingerprint(fpath), "utf-8"))
+        for col in stage.inputs:
+            hasher.update(bytes(col + self.fingerprint(col), "utf-8"))
+        if self.row_index is not None:
+            hasher.update(bytes("row_index" + self.row_fingerprint(), "utf-8"))
+        return hasher.hexdigest()
+
+    def state_digest(self):
+        """
+        Compute the hash of the current in-memory catalogue.
+        """
+        hasher = md5()
+        for col in self.columns:
+            hasher.update(bytes(col + self.fingerprint(col), "utf-8"))
+        return hasher.hexdigest()
+
+    def _update(self, stage, result, digest=None):
+        """
+        Merge the result of a stage into the in-memory catalogue.
+        """
+        if result is None:
+            return
+        if stage.selection:
+            mask = np.asarray(result, dtype="bool")
+            if len(mask) != len(self):
+                raise ValueError(
+                    "stage '%s' returned a mask of length %d for %d rows" % (
+                        stage.name, len(mask), len(self)))
+            if self.row_index is not None:
+                self.row_index = self.row_index[mask]
+                if digest is not None and self._row_fingerprint is not None:
+                    self._row_fingerprint = md5(bytes(
+                        digest + self._row_fingerprint, "utf-8")).hexdigest()
+                else:
+                    self._row_fingerprint = None
+            print("removed %d / %d rows" % (
+                len(mask) - np.count_nonzero(mask), len(mask)))
+            for col in self.columns:
+                self.columns[col] = self.columns[col][mask]
+                self._invalidate_stores(col)
+                # derive the hashes of columns that were created by stages
+                if digest is not None and self.fingerprints[col] is not None:
+                    self.fingerprints[col] = md5(bytes(
+                        digest + self.fingerprints[col], "utf-8")).hexdigest()
+                else:
+                    self.fingerprints[col] = None
+        else:
+            if len(self.columns) > 0 and len(result) != len(self):
+                raise ValueError(
+                    "stage '%s' returned %d rows for %d rows" % (
+                        stage.name, len(result), len(self)))
+            for col in result.colnames:
+                if col in self.columns:
+                    print("WARNING: replacing column '%s'" % col)
+                self.columns[col] = result[col]
+                self.provenance[col] = stage.name
+                self._invalidate_stores(col)
+                if digest is None:
+                    self.fingerprints[col] = None
+                else:
+                    self.fingerprints[col] = md5(
+                        bytes(digest + col, "utf-8")).hexdigest()
+
+    def _invalidate_stores(self, col):
+        for written in self._store_written.values():
+            written.discard(col)
+
+    def _write_store(self, path):
+        """
+        Update a column store checkpoint with the in-memory catalogue. Only
+        columns that are new or changed since they were last stored are
+        written, existing column files are not touched.
+        """
+        store = ColumnStore(path, create=True)
+        if store.nrows is not None and store.nrows != len(self):
+            print("row count changed, clearing column store")
+            store.clear()
+        written = self._store_written.setdefault(path, set())
+        n_write = 0
+        for col in self.columns:
+            fingerprint = self.fingerprints.get(col)
+            if col in written:
+                continue
+            if col in store and fingerprint is not None:
+                stored = store.meta(col)["provenance"].get("fingerprint")
+                if stored == fingerprint:
+                    written.add(col)
+                    continue
+            store.add_column(
+                col, self.columns[col], overwrite=True, provenance={
+                    "stage": self.provenance.get(col, "input"),
+                    "fingerprint": fingerprint})
+            written.add(col)
+            n_write += 1
+        print("wrote %d / %d columns" % (n_write, len(self.columns)))
+
+    def mark_stored(self, path, columns):
+        """
+        Declare columns that are already present in a column store checkpoint,
+        e.g. if the catalogue was loaded from that store, such that they are
+        not written again.
+        Parameters
+        ----------
+        path : str
+            Directory of the column store.
+        columns : list of str
+            Names of the columns present in the store.
+        """
+        self._store_written.setdefault(path, set()).update(columns)
+
+    def write_checkpoint(self, path, fmt="fits"):
+        """
+        Write the current in-memory catalogue to disk.
+        Parameters
+        ----------
+        path : str
+            File path of the output table. Paths with the column store
+            extension (.columns) are written as column_store.ColumnStore and
+            are updated incrementally.
+        fmt : str
+            astropy.table format specifier of the output table.
+        """
+        print("write checkpoint to: %s" % path)
+        if is_column_store(path):
+            self._write_store(path)
+        else:
+            table = self.table()
+            table.meta = {}  # stage meta data is not written
+            table.write(path, format=fmt, overwrite=True)
+
+    def run(self, catalogue=None, checkpoints=None, checkpoint_format="fits",
+            cache=None, meta=None, telemetry=None, row_index=None):
+        """
+        Run all stages in order of their dependencies. If a cache is provided,
+        stages with unchanged inputs, parameters and code are skipped and
+        their results are loaded from the cache instead, make-style.
+        Parameters
+        ----------
+        catalogue : astropy.table.Table
+            Initial catalogue providing all columns not produced by a stage.
+        checkpoints : dict
+            File path or list of paths, indexed by stage name, to which the
+            in-memory catalogue is written after the stage has finished.
+        checkpoint_format : str
+            astropy.table format specifier of the checkpoint tables.
+        cache : stage_cache.StageCache
+            Cache of stage results (optional).
+        meta : dict
+            Meta data passed to the stages with their input table, e.g. the
+            name of a catalogue shard.
+        telemetry : telemetry.Telemetry
+            Collects the performance records of the stages and checkpoints
+            (optional).
+        row_index : array_like
+            Row of each object of the catalogue in the input file, e.g. if
+            the catalogue was read from a subset of rows (default: the row
+            number of the catalogue).
+        Returns
+        -------
+        table : astropy.table.Table
+            Final in-memory catalogue.
+        """
+        if checkpoints is None:
+            checkpoints = {}
+        unknown = set(checkpoints) - set(self.stages)
+        if len(unknown) > 0:
+            raise KeyError(
+                "checkpoints for unknown stages: %s" %
+                ", ".join(sorted(unknown)))
+        self.meta = {} if meta is None else dict(meta)
+        self.row_index = None
+        self._row_fingerprint = None
+        if row_index is not None:
+            self.row_index = np.asarray(row_index)
+        if catalogue is not None:
+            if self.row_index is None:
+                self.row_index = np.arange(len(catalogue))
+            elif len(self.row_index) != len(catalogue):
+                raise ValueError(
+                    "expected a row index of length %d, got %d" % (
+                        len(catalogue), len(self.row_index)))
+            for col in catalogue.colnames:
+                self.columns[col] = catalogue[col]
+                self.fingerprints[col] = None
+        for stage in self.order():
+            with measure(telemetry, stage.name, len(self)) as record:
+                if cache is None:
+                    print("==> run stage: %s" % stage.name)
+                    result = stage(self.stage_input(stage))
+                    self._update(stage, result)
+                else:
+                    digest = self.stage_digest(stage)
+                    products_exist = all(
+                        os.path.exists(p) for p in stage.products)
+                    if cache.has(stage.name, digest) and products_exist:
+                        print("==> skip stage: %s (unchanged, %s)" % (
+                            stage.name, digest))
+                        result = cache.load(stage.name, digest)
+                        record["cached"] = True
+                    else:
+                        print("==> run stage: %s" % stage.name)
+                        result = stage(self.stage_input(stage))
+                        cache.store(stage.name, digest, result, info={
+                            "inputs": stage.inputs,
+                            "params": stage.params,
+                            "code": stage.version()})
+                    self._update(stage, result, digest)
+                record["rows_out"] = len(self)
+            paths = checkpoints.get(stage.name, [])
+            if isinstance(paths, str):
+                paths = [paths]
+            for path in paths:
+                with measure(
+                        telemetry, "%s:checkpoint" % stage.name, len(self),
+                        path=path) as record:
+                    if cache is None:
+                        self.write_checkpoint(path, checkpoint_format)
+                    else:
+                        state = self.state_digest()
+                        if cache.checkpoint_current(path, state):
+                            print("checkpoint is up to date: %s" % path)
+                            record["cached"] = True
+                        else:
+                            self.write_checkpoint(path, checkpoint_format)
+                            cache.register_checkpoint(path, state)
+                    record["rows_out"] = len(self)
+            print("\n")
+        return self.table()
+
+    def stream(self, chunks, writers=None, telemetry=None):
+        """
+        Run all stages on a catalogue chunk by chunk, such that the memory
+        usage is set by the chunk size and not by the size of the catalogue.
+        Only suited for stages that process each object independently. After
+        a stage has finished, the chunk is appended to its writers, which
+        replace the checkpoints of run().
+        Parameters
+        ----------
+        chunks : iterable
+            Pairs of row offset and astropy.table.Table with the catalogue
+            chunk (see catalogue_io.iter_chunks).
+        writers : dict
+            Writer or list of writers (see catalogue_io.open_writer), indexed
+            by stage name. Writers are closed when the stream is exhausted.
+        telemetry : telemetry.Telemetry
+            Collects the performance records of the stages and writers,
+            summed over all chunks (optional).
+        Returns
+        -------
+        nrows : int
+            Number of rows remaining after the last stage.
+        """
+        if writers is None:
+            writers = {}
+        writers = {
+            stage: [w] if not isinstance(w, (list, tuple)) else list(w)
+            for stage, w in writers.items()}
+        unknown = set(writers) - set(self.stages)
+        if len(unknown) > 0:
+            raise KeyError(
+                "writers for unknown stages: %s" % ", ".join(sorted(unknown)))
+        order = self.order()
+        nrows = 0
+        try:
+            chunks = iter(chunks)
+            i = 0
+            while True:
+                with measure(telemetry, "read", merge=True) as record:
+                    offset, chunk = next(chunks, (None, None))
+                    record["rows_in"] = 0 if chunk is None else len(chunk)
+                    record["rows_out"] = record["rows_in"]
+                if chunk is None:
+                    break
+                print("==> process chunk %d (rows %d-%d)" % (
+                    i, offset, offset + len(chunk)))
+                self.columns = OrderedDict()
+                self.fingerprints = OrderedDict()
+                self.provenance = {}
+                # stages that draw random numbers use the position of the
+                # objects in the input catalogue
+                self.meta = {"chunk": i, "row_offset": offset}
+                self.row_index = np.arange(offset, offset + len(chunk))
+                self._row_fingerprint = None
+                for col in chunk.colnames:
+                    self.columns[col] = chunk[col]
+                    self.fingerprints[col] = None
+                for stage in order:
+                    with measure(
+                            telemetry, stage.name, len(self),
+                            merge=True) as record:
+                        self._update(stage, stage(self.stage_input(stage)))
+                        record["rows_out"] = len(self)
+                    for writer in writers.get(stage.name, []):
+                        with measure(
+                                telemetry, "%s:write" % stage.name, len(self),
+                                merge=True) as record:
+                            table = self.table()
+                            table.meta = {}  # do not write the chunk meta
+                            writer.write(table)
+                            record["rows_out"] = len(self)
+                nrows += len(self)
+                i += 1
+                print("\n")
+        finally:
+            for stage_writers in writers.values():
+                for writer in stage_writers:
+                    writer.close()
+            self.meta = {}
+            self.row_index = None
+            self._row_fingerprint = None
+        return nrows
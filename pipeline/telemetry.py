@@ -0,0 +1,266 @@
+###############################################################################
+#                                                                             #
+#   Performance telemetry of pipeline runs. Each measured stage records its   #
+#   wall and CPU time, peak resident memory, rows in/out, bytes read/written  #
+#   and throughput. The records of a run are collected in one JSON report.    #
+#                                                                             #
+###############################################################################
+
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+
+def _read_proc_file(path):
+    """
+    Parse a /proc file with "key: value" lines, returns None if it does not
+    exist (e.g. on macOS).
+    """
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    values = {}
+    for line in lines:
+        key, _, value = line.partition(":")
+        values[key.strip()] = value.strip()
+    return values
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of the process (Linux only), such that
+    the peak memory can be measured per stage. Returns whether the reset was
+    successful.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """
+    Peak resident set size of the process in bytes.
+    """
+    status = _read_proc_file("/proc/self/status")
+    if status is not None and "VmHWM" in status:
+        return int(status["VmHWM"].split()[0]) * 1024
+    # fallback: the maximum over the process lifetime
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def snapshot():
+    """
+    Capture the current resource counters of the process and its terminated
+    child processes (e.g. BPZ).
+    Returns
+    -------
+    counters : dict
+        Wall clock time, CPU time (user + system) and bytes read and written
+        (None if not available).
+    """
+    times = os.times()
+    counters = {
+        "wall": time.perf_counter(),
+        "cpu": times.user + times.system,
+        "cpu_children": times.children_user + times.children_system,
+        "bytes_read": None, "bytes_written": None}
+    io = _read_proc_file("/proc/self/io")
+    if io is not None:
+        # bytes passed through read/write calls (including the page cache)
+        counters["bytes_read"] = int(io["rchar"])
+        counters["bytes_written"] = int(io["wchar"])
+    return counters
+
+
+class Telemetry(object):
+    """
+    Collects the performance records of the stages of a pipeline run.
+    Parameters
+    ----------
+    name : str
+        Name of the run, e.g. the script that is executed.
+    info : dict
+        Additional information stored in the report (e.g. the configuration
+        file).
+    """
+
+    def __init__(self, name, info=None):
+        self.name = name
+        self.info = {} if info is None else dict(info)
+        self.records = []
+        self._start = snapshot()
+        self._start_time = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    def __len__(self):
+        return len(self.records)
+
+    def record(self, stage):
+        """
+        Get the record of a stage, None if it does not exist.
+        """
+        for record in self.records:
+            if record["stage"] == stage:
+                return record
+        return None
+
+    @contextmanager
+    def measure(self, stage, rows_in=None, merge=False, **info):
+        """
+        Measure the resources used by a stage. The yielded record can be
+        updated within the context, e.g. to set rows_out.
+        Parameters
+        ----------
+        stage : str
+            Name of the stage.
+        rows_in : int
+            Number of input rows.
+        merge : bool
+            Whether the measurement is added to an existing record of the
+            same stage (e.g. when processing chunks), counters are summed
+            and the peak memory is the maximum.
+        **info
+            Additional entries of the record.
+        Yields
+        ------
+        record : dict
+            Record of the measurement.
+        """
+        record = {
+            "stage": stage, "rows_in": rows_in, "rows_out": None, **info}
+        reset_peak_rss()
+        start = snapshot()
+        try:
+            yield record
+        finally:
+            stop = snapshot()
+            record["wall_time"] = stop["wall"] - start["wall"]
+            record["cpu_time"] = stop["cpu"] - start["cpu"]
+            record["cpu_time_children"] = (
+                stop["cpu_children"] - start["cpu_children"])
+            record["peak_rss"] = peak_rss()
+            for key in ("bytes_read", "bytes_written"):
+                if start[key] is None:
+                    record[key] = None
+                else:
+                    record[key] = stop[key] - start[key]
+            self.add(record, merge)
+
+    def add(self, record, merge=False):
+        """
+        Add a record, e.g. measured in another process.
+        Parameters
+        ----------
+        record : dict
+            Record created by measure().
+        merge : bool
+            Whether the record is added to an existing record of the same
+            stage.
+        """
+        record = dict(record)
+        existing = self.record(record["stage"]) if merge else None
+        if existing is None:
+            record.setdefault("calls", 1)
+            self.records.append(record)
+        else:
+            existing["calls"] += record.get("calls", 1)
+            for key in (
+                    "rows_in", "rows_out", "wall_time", "cpu_time",
+                    "cpu_time_children", "bytes_read", "bytes_written"):
+                if existing.get(key) is None or record.get(key) is None:
+                    existing[key] = record.get(key, existing.get(key))
+                else:
+                    existing[key] += record[key]
+            existing["peak_rss"] = max(
+                existing["peak_rss"], record["peak_rss"])
+            record = existing
+        # throughput of the stage
+        if record["rows_in"] and record["wall_time"] > 0.0:
+            record["rows_per_second"] = record["rows_in"] / record["wall_time"]
+        else:
+            record["rows_per_second"] = None
+
+    def report(self):
+        """
+        Create the report of the run.
+        Returns
+        -------
+        report : dict
+            Run information, totals and the stage records.
+        """
+        stop = snapshot()
+        total = {
+            "wall_time": stop["wall"] - self._start["wall"],
+            "cpu_time": stop["cpu"] - self._start["cpu"],
+            "cpu_time_children": (
+                stop["cpu_children"] - self._start["cpu_children"]),
+            # the peak memory is reset for each stage
+            "peak_rss": max(
+                [peak_rss()] + [r["peak_rss"] for r in self.records])}
+        for key in ("bytes_read", "bytes_written"):
+            if self._start[key] is None:
+                total[key] = None
+            else:
+                total[key] = stop[key] - self._start[key]
+        return {
+            "name": self.name, "start": self._start_time,
+            "host": platform.node(), "pid": os.getpid(), **self.info,
+            "total": total, "stages": self.records}
+
+    def write(self, path):
+        """
+        Write the report of the run as JSON file.
+        Parameters
+        ----------
+        path : str
+            File path of the report, a directory creates a file named after
+            the run and its start time.
+        Returns
+        -------
+        path : str
+            File path of the written report.
+        """
+        if os.path.isdir(path) or path.endswith(os.sep):
+            os.makedirs(path, exist_ok=True)
+            path = os.path.join(path, "%s_%s.json" % (
+                self.name, self._start_time.replace(" ", "_").replace(
+                    ":", "")))
+        print("write telemetry report to: %s" % path)
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=4)
+        return path
+
+
+@contextmanager
+def measure(telemetry, stage, rows_in=None, merge=False, **info):
+    """
+    Measure a stage with Telemetry.measure if telemetry is not None,
+    otherwise the yielded record is discarded.
+    """
+    if telemetry is None:
+        yield {}
+    else:
+        with telemetry.measure(stage, rows_in, merge, **info) as record:
+            yield record
+
+
+def telemetry_path(config):
+    """
+    Get the directory of the telemetry reports from the pipeline
+    configuration: DATADIR/telemetry or the optional config entry
+    'telemetry' relative to DATADIR, None if disabled (null).
+    """
+    path = config.get("telemetry", "/telemetry")
+    if path is None:
+        return None
+    return os.path.join(config["paths"]["DATADIR"] + path, "")
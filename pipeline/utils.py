@@ -1,5 +1,47 @@
+import os
+
+import yaml
+from yaml import Loader
+
+
 def list2string(alist, prefix='', suffix=''):
     st = ''
     for l in alist:
         st += ' ' + prefix + str(l) + suffix
-    return st
\ No newline at end of file
+    return st
+
+
+def expand_paths(item):
+    """
+    Recursively expand environment variables (e.g. ${HOME}) in all strings of
+    a (nested) configuration entry.
+    """
+    if isinstance(item, str):
+        return os.path.expandvars(item)
+    if isinstance(item, dict):
+        return {key: expand_paths(val) for key, val in item.items()}
+    if isinstance(item, list):
+        return [expand_paths(val) for val in item]
+    return item
+
+
+def load_config(config_file):
+    """
+    Read a pipeline yaml configuration file. Environment variables in the
+    configuration values are expanded, since the files are no longer
+    evaluated by a shell.
+    Parameters
+    ----------
+    config_file : str
+        Path to the yaml configuration file.
+    Returns
+    -------
+    config : dict
+        Configuration with one entry per section of the yaml file.
+    """
+    with open(config_file) as file:
+        documents = yaml.load(file, Loader=Loader)
+    config = {}
+    for item in documents:
+        config[item] = expand_paths(documents[item])
+    return config
@@ -1,56 +1,128 @@
-import yaml
-import numpy as np
-from yaml import Loader
-from subprocess import run
-import subprocess
+import argparse
 import os
-from astropy.io import fits
 import sys
+from concurrent.futures import ProcessPoolExecutor
+
+# the pipeline modules are imported from the pipeline folder
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, "pipeline"))
+
+import specz_selection
+from catalogue_io import count_rows, load_table, read_colnames
+from mocks_DC2_specz_sample import (
+    apply_selection, get_selection_functions, selection_columns, write_stats)
+from telemetry import Telemetry, measure, telemetry_path
+from utils import load_config
+
 
 survey_folder = os.path.expanduser('~')+"/DATA/mocks/KV450/SPECZ/"  # need to be specified!
 
-config_file = sys.argv[1]
-with open(config_file) as file:
-    documents = yaml.load(file, Loader=Loader)
-
-config = {}
-for i, item in enumerate(documents):
-    config[item] = documents[item]
-    
-def list2string(alist, prefix='', suffix=''):
-    st = ''
-    for l in alist:
-        st += ' ' + prefix + str(l) + suffix
-    return st
-
-THREADS = str(config['threads'])
+# simulation data shared with the worker processes
+simul = None
+
+
+def init_worker(data):
+    global simul
+    simul = data
+
+
+def select_survey(arguments):
+    survey, n_data, n_z, pass_phot_detection, seed = arguments
+    print("==> apply %s selection" % survey)
+    # measured in the worker process and returned to the main process
+    telemetry = Telemetry("selection")
+    with telemetry.measure("select:%s" % survey, len(simul)) as record:
+        mask, stats = apply_selection(
+            simul, survey, n_data=n_data, n_z=n_z,
+            pass_phot_detection=pass_phot_detection, seed=seed)
+        record["rows_out"] = int(mask.sum())
+    return survey, mask, stats, telemetry.records[0]
+
+
+parser = argparse.ArgumentParser(
+    description='Apply any number of spectroscopic selection functions to '
+                'the photometric mock catalogue (MOCKout), which is loaded '
+                'only once.')
+parser.add_argument(
+    'config', help='pipeline configuration file (see ./config_yamls)')
+parser.add_argument(
+    'surveys', nargs='+', choices=list(get_selection_functions().keys()),
+    metavar='survey', help='selection functions to apply, e.g. DEEP2 VVDSf02')
+parser.add_argument(
+    '--processes', type=int, default=1,
+    help='number of selection functions applied in parallel '
+         '(default: %(default)s)')
+parser.add_argument(
+    '--seed', default='KV450',
+    help='string to seed the random generator (default: %(default)s)')
+parser.add_argument(
+    '--pass-phot-detection', action='store_true',
+    help='whether included objects must be detected in the photometric '
+         'survey detection band')
+parser.add_argument(
+    '--stats-file', action='store_true',
+    help='write a file with basic object selection statistics per survey')
+args = parser.parse_args()
+
+config = load_config(args.config)
+
 DATADIR = config['paths']['DATADIR']
 OUTROOT = DATADIR + '/REALISATION/'
 MOCKout = DATADIR + config['paths']['MOCKout']
 
-if ~os.path.isdir(DATADIR):
-    os.system('mkdir '+DATADIR)
-
-if ~os.path.isdir(OUTROOT):
-    os.system('mkdir '+OUTROOT)
-    
-surveys = sys.argv[2:]#['DEEP2', 'VVDSf02', 'zCOSMOS']
-
-for survey in surveys:
-    print("==> generate photometry realizations and apply "+survey+" selection")
-    if ~os.path.isdir(OUTROOT+"/"+survey+"_phot_samples/"):
-        os.system("mkdir "+OUTROOT+"/"+survey+"_phot_samples/")
-    survey_file = fits.open(survey_folder+survey+"_masked.fits")
-    n_obj = len(survey_file[1].data)
-    print(n_obj)
-    run("mocks_DC2_specz_sample.py \
-        -s "+MOCKout+" \
-        --s-type LSST \
-        --survey "+survey+" \
-        --d-z-spec z_spec \
-        --n-data "+str(n_obj)+" \
-        -o "+OUTROOT+"/"+survey+"_phot_samples/"+survey+"_phot_samples.fits", shell=True, check=True)
+os.makedirs(OUTROOT, exist_ok=True)
+telemetry = Telemetry(
+    "spec_selection", info={"config": os.path.abspath(args.config)})
 
-print("done!")
+# load only the columns used by the selection functions
+columns = selection_columns(
+    specz_selection.LSST_dc2_data, read_colnames(MOCKout))
+print("==> load columns from %s: %s" % (MOCKout, ", ".join(columns)))
+with measure(telemetry, "load") as record:
+    data = specz_selection.LSST_dc2_data(
+        load_table(MOCKout, "fits", columns))
+    record["rows_out"] = len(data)
 
+# collect the survey data: the number of objects or the redshifts
+selection_functions = get_selection_functions()
+tasks = []
+for survey in args.surveys:
+    survey_file = survey_folder + survey + "_masked.fits"
+    n_z = None
+    if selection_functions[survey].needs_n_z:
+        n_z = load_table(survey_file, "fits", ["z_spec"])["z_spec"]
+    n_obj = count_rows(survey_file)
+    print("%s: %d objects" % (survey, n_obj))
+    tasks.append((survey, n_obj, n_z, args.pass_phot_detection, args.seed))
 
+# apply the selection functions, each one reseeds the random state
+if args.processes > 1:
+    with ProcessPoolExecutor(
+            min(args.processes, len(tasks)), initializer=init_worker,
+            initargs=(data,)) as pool:
+        results = list(pool.map(select_survey, tasks))
+else:
+    init_worker(data)
+    results = [select_survey(task) for task in tasks]
+
+# write the samples with all columns, reading only the selected rows
+full_table = load_table(MOCKout, "fits")
+for survey, mask, stats, record in results:
+    telemetry.add(record)
+    outdir = os.path.join(OUTROOT, survey + "_phot_samples")
+    os.makedirs(outdir, exist_ok=True)
+    output = os.path.join(outdir, survey + "_phot_samples.fits")
+    if args.stats_file:
+        write_stats(
+            os.path.join(outdir, "%s_selection.stats" % survey), stats,
+            output)
+    print("write %s sample with %d objects to: %s" % (
+        survey, mask.sum(), output))
+    with measure(
+            telemetry, "write:%s" % survey, int(mask.sum())) as record:
+        full_table[mask].write(output, overwrite=True)
+        record["rows_out"] = int(mask.sum())
+
+if telemetry_path(config) is not None:
+    telemetry.write(telemetry_path(config))
+print("done!")
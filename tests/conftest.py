@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the pipeline modules are imported by name, as by the scripts in ./pipeline
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pipeline"))
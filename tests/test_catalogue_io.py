@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+from astropy import units
+from astropy.table import Column, Table, vstack
+
+from catalogue_io import (
+    count_rows, iter_chunks, load_table, map_columns, open_writer,
+    read_colnames, table_format)
+
+LAYOUTS = ["fits", "hdf5_compound", "hdf5_columns", "columns"]
+
+
+@pytest.fixture
+def catalogue():
+    rng = np.random.default_rng(9)
+    n = 1000
+    return Table([
+        Column(rng.uniform(0.0, 360.0, n), name="ra", unit=units.deg),
+        Column(rng.normal(size=n).astype(np.float32), name="mag"),
+        Column(rng.integers(-10**6, 10**6, n), name="id"),
+        Column(rng.integers(0, 2, n).astype(bool), name="flag"),
+        Column(rng.normal(size=(n, 3)), name="vector")])
+
+
+def write_catalogue(tmp_path, catalogue, layout):
+    """
+    Write the catalogue in one of the layouts and return the file path and
+    the table read by astropy, if it can read the layout.
+    """
+    if layout == "fits":
+        path = str(tmp_path / "catalogue.fits")
+        catalogue.write(path)
+        return path, Table.read(path)
+    if layout == "hdf5_compound":
+        pytest.importorskip("h5py")
+        path = str(tmp_path / "catalogue.hdf5")
+        catalogue.write(path, path="data", serialize_meta=True)
+        return path, Table.read(path, path="data")
+    if layout == "hdf5_columns":
+        pytest.importorskip("h5py")
+        path = str(tmp_path / "catalogue.h5")
+    else:
+        path = str(tmp_path / "catalogue.columns")
+    writer = open_writer(path)
+    for offset in range(0, len(catalogue), 300):
+        writer.write(catalogue[offset:offset + 300])
+    writer.close()
+    return path, catalogue
+
+
+def assert_tables_equal(table, reference, check_units=True):
+    assert table.colnames == reference.colnames
+    for col in reference.colnames:
+        assert table[col].shape == reference[col].shape, col
+        assert np.array_equal(table[col], reference[col]), col
+        if check_units:
+            assert table[col].unit == reference[col].unit, col
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_load_table_matches_astropy(tmp_path, catalogue, layout):
+    path, reference = write_catalogue(tmp_path, catalogue, layout)
+    assert table_format(path) == layout.split("_")[0]
+    assert read_colnames(path) == catalogue.colnames
+    assert count_rows(path) == len(catalogue)
+    # astropy stores the units of compound datasets in its meta data
+    assert_tables_equal(
+        load_table(path), reference, check_units=layout != "hdf5_compound")
+    assert_tables_equal(load_table(path), catalogue, check_units=False)
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_requested_columns(tmp_path, catalogue, layout):
+    path, reference = write_catalogue(tmp_path, catalogue, layout)
+    cols = ["vector", "ra"]
+    table = load_table(path, cols=cols)
+    assert table.colnames == cols
+    assert_tables_equal(table, reference[cols], check_units=False)
+    assert [col.name for col in map_columns(path, columns=["id"])] == ["id"]
+    for offset, chunk in iter_chunks(path, columns=cols, chunk_size=400):
+        assert chunk.colnames == cols
+    with pytest.raises(KeyError):
+        load_table(path, cols=["ra", "dec"])
+    with pytest.raises(KeyError):
+        next(iter_chunks(path, columns=["dec"]))
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_chunk_boundaries(tmp_path, catalogue, layout):
+    path, reference = write_catalogue(tmp_path, catalogue, layout)
+    for chunk_size, start, stop in [
+            (1000, 0, None), (7, 0, None), (128, 0, None), (5000, 0, None),
+            (300, 150, 850), (64, 999, None), (10, 990, 5000)]:
+        offsets = []
+        chunks = []
+        for offset, chunk in iter_chunks(
+                path, chunk_size=chunk_size, start=start, stop=stop):
+            assert 0 < len(chunk) <= chunk_size
+            offsets.append(offset)
+            chunks.append(chunk)
+        end = len(reference) if stop is None else min(stop, len(reference))
+        assert offsets == list(range(start, end, chunk_size))
+        assert_tables_equal(
+            vstack(chunks), reference[start:end],
+            check_units=layout != "hdf5_compound")
+
+
+@pytest.mark.parametrize("suffix", [".fits", ".h5", ".columns"])
+def test_writer_round_trip(tmp_path, catalogue, suffix):
+    if suffix == ".h5":
+        pytest.importorskip("h5py")
+    path = str(tmp_path / ("output" + suffix))
+    writer = open_writer(path, background=True)
+    # chunks of different sizes, including a single row
+    offsets = [0, 1, 100, 500, len(catalogue)]
+    for offset, end in zip(offsets[:-1], offsets[1:]):
+        writer.write(catalogue[offset:end])
+    writer.close()
+    assert_tables_equal(load_table(path), catalogue)
+    if suffix == ".fits":
+        assert_tables_equal(Table.read(path), catalogue)
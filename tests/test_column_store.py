@@ -0,0 +1,48 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from column_store import ColumnStore
+
+
+def test_column_names_do_not_collide(tmp_path):
+    store = ColumnStore(str(tmp_path / "cat.columns"), create=True)
+    store.add_column("a/b", np.arange(5))
+    store.add_column("a_b", np.arange(5) * 2)
+    store.add_column("a%2Fb", np.arange(5) * 3)
+    assert len({store.meta(name)["file"] for name in store.colnames}) == 3
+    reopened = ColumnStore(store.path)
+    for factor, name in enumerate(("a/b", "a_b", "a%2Fb"), 1):
+        assert np.array_equal(reopened[name], np.arange(5) * factor)
+
+
+def test_collision_with_manifest_file(tmp_path):
+    # stores written by older versions replaced the path separator
+    store = ColumnStore(str(tmp_path / "cat.columns"), create=True)
+    store.add_column("a/b", np.arange(5))
+    os.rename(store._file("a/b"), os.path.join(store.path, "a_b.col"))
+    store.manifest["columns"]["a/b"]["file"] = "a_b.col"
+    with pytest.raises(ValueError):
+        store.add_column("a_b", np.arange(5))
+    # replacing the column moves it to the escaped file name
+    store.add_column("a/b", np.arange(5) + 1, overwrite=True)
+    assert not os.path.exists(os.path.join(store.path, "a_b.col"))
+    assert np.array_equal(store["a/b"], np.arange(5) + 1)
+
+
+def test_overwrite_keeps_open_maps(tmp_path):
+    store = ColumnStore(str(tmp_path / "cat.columns"), create=True)
+    store.add_column("x", np.arange(10, dtype=np.float64))
+    mapped = store.column("x")
+    store.allocate_column("x", np.float64, overwrite=True)
+    column = store.column("x", mode="r+")
+    column[:] = -1.0
+    assert np.array_equal(mapped, np.arange(10, dtype=np.float64))
+    store.add_column("x", np.ones(10), overwrite=True)
+    assert np.array_equal(mapped, np.arange(10, dtype=np.float64))
+    assert np.array_equal(ColumnStore(store.path)["x"], np.ones(10))
+    with open(os.path.join(store.path, "manifest.json")) as f:
+        assert list(json.load(f)["columns"]) == ["x"]
+    assert sorted(os.listdir(store.path)) == ["manifest.json", "x.col"]
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from astropy.table import Table
+
+import condition_maps
+import healpix
+from condition_maps import ConditionMap, gather_conditions
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_gather_matches_direct_lookup(monkeypatch, sparse):
+    if sparse:
+        monkeypatch.setattr(condition_maps, "MAX_DENSE_INDEX", 0)
+    rng = np.random.default_rng(7)
+    index = rng.choice(1000, 50, replace=False)
+    values = {"r": rng.uniform(23, 25, 50), "i": rng.uniform(22, 24, 50)}
+    cmap = ConditionMap("pointing", index, values)
+    objects = rng.integers(-5, 1005, 5000)
+    defaults = {"r": 24.0, "i": 23.5, "z": 22.0}
+    gathered = cmap.gather(objects, defaults)
+    assert gathered["z"] == 22.0  # not in the map
+    entry = {i: row for row, i in enumerate(index)}
+    for filt in ("r", "i"):
+        expected = np.array([
+            values[filt][entry[i]] if i in entry else defaults[filt]
+            for i in objects], dtype=np.float32)
+        assert np.array_equal(gathered[filt], expected)
+
+
+@pytest.mark.parametrize("suffix", [".fits", ".txt"])
+def test_healpix_map_file(tmp_path, suffix):
+    nside_map, nside = 8, 64
+    pixels = np.arange(healpix.npix(nside_map))
+    cmap = ConditionMap(
+        healpix.index_column(nside_map), pixels,
+        {"r": pixels * 0.01 + 20.0})
+    path = str(tmp_path / ("map" + suffix))
+    cmap.write(path)
+    rng = np.random.default_rng(8)
+    ra, dec = rng.uniform(0, 360, 1000), rng.uniform(-90, 90, 1000)
+    column = healpix.index_column(nside)
+    data = Table({column: healpix.ang2pix(nside, ra, dec)})
+    gathered = gather_conditions(data, path, {"r": 0.0}, column)
+    expected = healpix.ang2pix(nside_map, ra, dec) * 0.01 + 20.0
+    np.testing.assert_allclose(gathered["r"], expected, rtol=1e-6)
+    assert gather_conditions(data, None, {"r": 24.0}) == {"r": 24.0}
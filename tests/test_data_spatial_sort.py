@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from astropy.table import Table
+
+import healpix
+from catalogue_io import load_table
+from data_spatial_sort import sort_catalogue
+
+
+@pytest.mark.parametrize("output", ["sorted.fits", "sorted.columns"])
+def test_sort_keeps_row_order_within_pixels(tmp_path, output):
+    rng = np.random.default_rng(5)
+    n = 20000
+    # clustered positions such that most pixels hold several objects
+    ra = rng.normal(60.0, 2.0, n) % 360.0
+    dec = np.clip(rng.normal(-40.0, 2.0, n), -90.0, 90.0)
+    Table({"ra": ra, "dec": dec, "row": np.arange(n)}).write(
+        str(tmp_path / "input.fits"))
+    nside = 64
+    index = sort_catalogue(
+        str(tmp_path / "input.fits"), str(tmp_path / output), "ra", "dec",
+        nside=nside, chunk_size=3000, index_column="pix")
+    data = load_table(str(tmp_path / output))
+    assert np.array_equal(np.sort(data["row"]), np.arange(n))
+    assert np.array_equal(data["ra"], ra[data["row"]])
+    pix = healpix.ang2pix(nside, data["ra"], data["dec"])
+    assert np.array_equal(pix, data["pix"])
+    assert np.all(np.diff(pix) >= 0)
+    # the input order is kept within each pixel, i.e. the sort is stable
+    assert np.array_equal(
+        data["row"], np.argsort(healpix.ang2pix(nside, ra, dec),
+                                kind="stable"))
+    assert np.array_equal(index.counts, np.bincount(
+        pix, minlength=healpix.npix(nside)))
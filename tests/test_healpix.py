@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from healpix import ang2pix, check_nside, degrade, npix, pix2ang, pixel_counts
+
+
+DEC_RING = np.degrees(np.arcsin(2.0 / 3.0))  # centres of the polar faces
+
+
+# NESTED pixels: faces 0-3 touch the north pole, 4-7 are centred on the
+# equator at RA = 0, 90, 180, 270 and 8-11 touch the south pole; within a
+# face the pixel at the north corner has the highest index
+@pytest.mark.parametrize("ra,dec,expected", [
+    (0.0, 90.0, (0, 3, 15)),
+    (200.0, 90.0, (2, 11, 47)),
+    (0.0, -90.0, (8, 32, 128)),
+    (0.0, 0.001, (4, 19, 76)),
+    (360.0, 0.001, (4, 19, 76)),
+    (-1e-9, 0.001, (4, 19, 76)),
+    (90.0, 0.001, (5, 23, 92)),
+    (45.0, 60.0, (0, 3, 12)),
+    (315.0, 60.0, (3, 15, 60)),
+    (135.0, -60.0, (9, 36, 147))])
+def test_known_pixels(ra, dec, expected):
+    for nside, pix in zip((1, 2, 4), expected):
+        assert ang2pix(nside, [ra], [dec])[0] == pix
+
+
+def test_base_pixel_centres():
+    ra, dec = pix2ang(1, np.arange(12))
+    assert np.allclose(ra[:4], [45.0, 135.0, 225.0, 315.0])
+    assert np.allclose(ra[4:8], [0.0, 90.0, 180.0, 270.0])
+    assert np.allclose(ra[8:], ra[:4])
+    assert np.allclose(dec, np.repeat([DEC_RING, 0.0, -DEC_RING], 4))
+
+
+@pytest.mark.parametrize("nside", [1, 2, 4, 8, 64])
+def test_round_trip(nside):
+    pix = np.arange(npix(nside))
+    ra, dec = pix2ang(nside, pix)
+    assert np.all((ra >= 0.0) & (ra < 360.0))
+    assert np.array_equal(ang2pix(nside, ra, dec), pix)
+
+
+def test_round_trip_high_resolution():
+    nside = 2**20
+    pix = np.random.default_rng(12).integers(0, npix(nside), 10000)
+    assert np.array_equal(ang2pix(nside, *pix2ang(nside, pix)), pix)
+
+
+@pytest.mark.parametrize("nside,nside_out", [(4, 1), (64, 2), (1024, 1024)])
+def test_degrade_matches_coarse_pixels(nside, nside_out):
+    rng = np.random.default_rng(nside)
+    ra = rng.uniform(0.0, 360.0, 100000)
+    dec = np.degrees(np.arcsin(rng.uniform(-1.0, 1.0, len(ra))))
+    pix = ang2pix(nside, ra, dec)
+    coarse = ang2pix(nside_out, ra, dec)
+    assert np.array_equal(degrade(pix, nside, nside_out), coarse)
+    counts = pixel_counts(pix, nside, nside_out)
+    assert np.array_equal(counts, np.bincount(coarse, minlength=len(counts)))
+    assert counts.sum() == len(ra)
+
+
+def test_invalid_resolution():
+    for nside in (0, 3, 12, 2**30):
+        with pytest.raises(ValueError):
+            check_nside(nside)
+    with pytest.raises(ValueError):
+        degrade([0], 2, 4)
@@ -0,0 +1,33 @@
+import numpy as np
+from astropy.table import Table
+
+import mocks_dc2_mag_evolved
+from mocks_dc2_mag_evolved import evolve_catalogue, mag_correction
+
+
+def test_chunks_hold_fixed_number_of_values(tmp_path, monkeypatch):
+    rng = np.random.default_rng(10)
+    n = 1000
+    mag_cols = ["mag_%s_lsst" % b for b in "ugrizy"]
+    table = Table({"redshift": rng.uniform(0, 2, n)})
+    for col in mag_cols:
+        table[col] = rng.uniform(18, 28, n)
+    table.write(str(tmp_path / "input.fits"))
+    iter_chunks = mocks_dc2_mag_evolved.iter_chunks
+    chunk_sizes = []
+
+    def recorded(*args):
+        for offset, chunk in iter_chunks(*args):
+            chunk_sizes.append(len(chunk) * len(chunk.colnames))
+            yield offset, chunk
+
+    monkeypatch.setattr(mocks_dc2_mag_evolved, "iter_chunks", recorded)
+    nrows = evolve_catalogue(
+        str(tmp_path / "input.fits"), str(tmp_path / "output.fits"),
+        mag_cols, chunk_size=700)
+    assert nrows == n
+    assert max(chunk_sizes) <= 700
+    output = Table.read(str(tmp_path / "output.fits"))
+    for col in mag_cols:
+        expected = mag_correction(table[col], table["redshift"])
+        np.testing.assert_array_equal(output[col + "_evo"], expected)
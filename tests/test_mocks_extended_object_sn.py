@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from mocks_extended_object_sn import (
+    PercentileTable, f_R_e, find_percentile, find_percentile_batch)
+
+
+@pytest.mark.parametrize("percentile", [0.3, 0.5, 0.8])
+def test_batch_matches_scalar_solver(percentile):
+    rng = np.random.default_rng(4)
+    n = 300
+    R_e_Disk = rng.uniform(0.1, 3.0, n)
+    R_e_Bulge = rng.uniform(0.05, 2.0, n)
+    f_B = rng.uniform(0.0, 1.0, n)
+    # single component galaxies
+    f_B[:10] = 0.0
+    f_B[10:20] = 1.0
+    radius, converged = find_percentile_batch(
+        percentile, R_e_Disk, R_e_Bulge, f_B)
+    assert np.all(converged)
+    np.testing.assert_allclose(
+        f_R_e(radius, R_e_Disk, R_e_Bulge, f_B, percentile), 0.0,
+        atol=1e-12)
+    # the unbracketed Newton's method of find_percentile diverges for some
+    # galaxies with very different component sizes
+    expected = np.array([
+        find_percentile(percentile, *args)
+        for args in zip(R_e_Disk, R_e_Bulge, f_B)])
+    solved = np.isfinite(expected)
+    assert np.count_nonzero(solved) > 0.8 * n
+    np.testing.assert_allclose(radius[solved], expected[solved], rtol=1e-8)
+
+
+@pytest.mark.parametrize("rtol", [1e-2, 1e-3])
+def test_percentile_table_error_bound(tmp_path, rtol):
+    path = str(tmp_path / "percentiles.npz")
+    grid = {"n_f_B": 41, "n_log_ratio": 49}
+    table = PercentileTable.cached(path, [0.5], **grid)
+    rng = np.random.default_rng(6)
+    n = 20000
+    R_e_Disk = 10.0 ** rng.uniform(-1.0, 0.5, n)
+    R_e_Bulge = R_e_Disk * 10.0 ** rng.uniform(-3.0, 3.0, n)
+    f_B = rng.uniform(0.0, 1.0, n)
+    radius, converged = table.radius(0.5, R_e_Disk, R_e_Bulge, f_B, rtol)
+    exact, exact_converged = find_percentile_batch(
+        0.5, R_e_Disk, R_e_Bulge, f_B)
+    assert np.all(converged) and np.all(exact_converged)
+    assert np.max(np.abs(radius / exact - 1.0)) <= rtol
+    # the cached table is reused
+    cached = PercentileTable.cached(path, [0.5], **grid)
+    assert np.array_equal(cached.log_radius, table.log_radius)
+    assert np.array_equal(
+        cached.radius(0.5, R_e_Disk, R_e_Bulge, f_B, rtol)[0], radius)
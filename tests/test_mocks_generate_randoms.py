@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("table_tools")
+
+from astropy.table import Table  # noqa: E402
+
+from footprint_tiling import tile_footprints  # noqa: E402
+from mocks_generate_footprint import make_pointings  # noqa: E402
+from mocks_generate_randoms import (  # noqa: E402
+    check_pointings, generate_randoms)
+from pointing_grid import assign_pointings  # noqa: E402
+
+
+BOUNDS = [350.0, 10.0, -30.0, -20.0]
+
+
+def test_check_pointings():
+    names, pointings = make_pointings("test", BOUNDS, (4, 3))
+    check_pointings(BOUNDS, pointings)
+    # rounding of the pointings file
+    check_pointings(BOUNDS, np.round(pointings, 7))
+    # pointings of another survey
+    names, other = make_pointings("other", [30.0, 50.0, -30.0, -20.0], (4, 3))
+    with pytest.raises(ValueError):
+        check_pointings(BOUNDS, other)
+    # pointings that cover only a part of the survey
+    with pytest.raises(ValueError):
+        check_pointings(BOUNDS, pointings[:-1])
+
+
+@pytest.mark.parametrize("adaptive", [False, True])
+def test_randoms_pointings(tmp_path, adaptive):
+    if adaptive:
+        pointings = tile_footprints(
+            {"test": BOUNDS}, tile_area=7.0).bound_tuples
+    else:
+        names, pointings = make_pointings("test", BOUNDS, (4, 3))
+    tables = []
+    for processes in (1, 2):
+        path = str(tmp_path / ("randoms_%d.fits" % processes))
+        generate_randoms(
+            path, BOUNDS, 5000, "test", pointings, chunk_size=1500,
+            processes=processes)
+        tables.append(Table.read(path))
+    for name in tables[0].colnames:
+        assert np.array_equal(tables[0][name], tables[1][name])
+    randoms = tables[0]
+    assert np.array_equal(
+        randoms["pointing"],
+        assign_pointings(randoms["ra"], randoms["dec"], pointings))
+    with pytest.raises(ValueError):
+        generate_randoms(
+            str(tmp_path / "other.fits"), [30.0, 50.0, -30.0, -20.0], 10,
+            "test", pointings)
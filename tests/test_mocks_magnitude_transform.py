@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from astropy.table import Table
+
+import mocks_magnitude_transform
+from column_store import ColumnStore
+from mocks_magnitude_transform import transform_magnitudes, transform_store
+
+
+def make_store(path):
+    rng = np.random.default_rng(9)
+    n = 1000
+    table = Table({
+        "mag_r": rng.uniform(18, 28, n), "mag_i": rng.uniform(18, 28, n),
+        "redshift": rng.uniform(0, 2, n),
+        "convergence": rng.normal(0, 0.01, n)})
+    store = ColumnStore(path, create=True)
+    store.add_table(table)
+    return store, table
+
+
+def test_store_matches_table(tmp_path):
+    store, table = make_store(str(tmp_path / "cat.columns"))
+    names = transform_store(
+        store.path, ["mag_r", "mag_i"], "redshift", "convergence",
+        chunk_size=300)
+    expected = transform_magnitudes(
+        table, ["mag_r", "mag_i"], "redshift", "convergence")
+    store = ColumnStore(store.path)
+    for name in names:
+        assert store.meta(name)["dtype"] == "<f4"
+        assert np.array_equal(store[name], expected[name])
+
+
+def test_interrupted_run_keeps_columns(tmp_path, monkeypatch):
+    store, table = make_store(str(tmp_path / "cat.columns"))
+    names = transform_store(store.path, ["mag_r", "mag_i"], "redshift")
+    before = {name: np.array(ColumnStore(store.path)[name]) for name in names}
+    offset = mocks_magnitude_transform.magnitude_offset
+    calls = []
+
+    def interrupted(*args):
+        calls.append(True)
+        if len(calls) > 1:
+            raise KeyboardInterrupt
+        return offset(*args)
+
+    monkeypatch.setattr(mocks_magnitude_transform, "magnitude_offset",
+                        interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        transform_store(
+            store.path, ["mag_r", "mag_i"], "redshift", chunk_size=300,
+            overwrite=True)
+    store = ColumnStore(store.path)
+    assert store.colnames == list(table.colnames) + names
+    for name in names:
+        assert np.array_equal(store[name], before[name])
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+import mocks_photometry_realisation
+from mocks_photometry_realisation import (
+    philox4x32, photometry_realisations, realisation_column_names,
+    realise_bands, standard_normal_noise)
+
+
+# known-answer tests of Philox4x32-10 (Random123 kat_vectors)
+@pytest.mark.parametrize("counter,key,expected", [
+    ((0, 0, 0, 0), (0, 0),
+     (0x6627e8d5, 0xe169c58d, 0xbc57ac4c, 0x9b00dbd8)),
+    ((0xffffffff,) * 4, (0xffffffff,) * 2,
+     (0x408f276d, 0x41c83b0e, 0xa20bc7c6, 0x6d5451fd)),
+    ((0x243f6a88, 0x85a308d3, 0x13198a2e, 0x03707344),
+     (0xa4093822, 0x299f31d0),
+     (0xd16cfe09, 0x94fdcceb, 0x5001e420, 0x24126ea1))])
+def test_philox_known_answers(counter, key, expected):
+    assert [int(word) for word in philox4x32(counter, key)] == list(expected)
+    # counters are processed independently
+    words = philox4x32([np.array([word, 0]) for word in counter], key)
+    assert [int(word[0]) for word in words] == list(expected)
+
+
+def test_noise_is_keyed_by_object():
+    ids = np.arange(100000) * 7 + 3
+    noise = standard_normal_noise("test", "r", ids)
+    perm = np.random.default_rng(0).permutation(len(ids))
+    assert np.array_equal(
+        noise[perm], standard_normal_noise("test", "r", ids[perm]))
+    assert np.array_equal(
+        noise[:1000], standard_normal_noise("test", "r", ids[:1000]))
+    for other in (
+            standard_normal_noise("test", "i", ids),
+            standard_normal_noise("other", "r", ids),
+            standard_normal_noise("test", "r", ids, realisation=1)):
+        assert abs(np.corrcoef(noise, other)[0, 1]) < 0.02
+    assert abs(np.mean(noise)) < 0.02
+    assert abs(np.std(noise) - 1.0) < 0.02
+
+
+def test_realisation_does_not_depend_on_threads_or_tiles():
+    rng = np.random.default_rng(1)
+    n = 10007
+    mags = {filt: rng.uniform(18.0, 28.0, n) for filt in ("g", "r", "i")}
+    limits = {"g": 25.0, "r": rng.uniform(24.0, 25.0, n), "i": 24.0}
+    sn_factors = {filt: rng.uniform(0.3, 1.0, n) for filt in mags}
+    kwargs = {
+        "sn_factor_data": sn_factors, "realisations": (0, 3),
+        "significance": 1.1, "seed": "test", "verbose": False}
+    reference = realise_bands(mags, limits, **kwargs)
+    for threads, chunk_size in ((1, 1000), (4, 1000), (3, 4096), (8, 97)):
+        result = realise_bands(
+            mags, limits, threads=threads, chunk_size=chunk_size, **kwargs)
+        for filt in mags:
+            for data, expected in zip(result[filt], reference[filt]):
+                assert data.dtype == np.float32
+                assert np.array_equal(data, expected, equal_nan=True)
+
+
+def test_realisation_table_references_output(monkeypatch):
+    outputs = {}
+
+    def recording_realise_bands(*args, **kwargs):
+        outputs.update(realise_bands(*args, **kwargs))
+        return outputs
+
+    monkeypatch.setattr(
+        mocks_photometry_realisation, "realise_bands",
+        recording_realise_bands)
+    rng = np.random.default_rng(6)
+    mags = {filt: rng.uniform(18.0, 28.0, 1000) for filt in ("g", "r")}
+    table = photometry_realisations(
+        mags, {"g": 25.0, "r": 24.5}, n_realisations=4, seed="test")
+    assert table.meta["NREAL"] == 4
+    for filt, arrays in outputs.items():
+        for name, data in zip(realisation_column_names(filt), arrays):
+            assert table[name].shape == (1000, 4)
+            assert np.shares_memory(table[name], data)
@@ -0,0 +1,116 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("table_tools")
+
+from astropy.table import Table  # noqa: E402
+
+import photometry_stages  # noqa: E402
+from realisation_view import RealisationView  # noqa: E402
+from utils import load_config  # noqa: E402
+
+CONFIG_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "scripts", "config_yamls")
+
+
+def make_config(tmp_path, **photometric_setup):
+    filters = ["mag_g", "mag_r"]
+    config = {
+        "paths": {"DATADIR": str(tmp_path), "MOCKoutfull": "/MOCK.fits"},
+        "columns": {"magnitudes": filters},
+        "photometric_setup": {
+            "MAGlims": [25.0, 24.5], "MAGsig": 1.0, "sn_detect": 1.0,
+            "seed": "test", **photometric_setup}}
+    return config
+
+
+def test_recipe_reproduces_realisation_stage(tmp_path):
+    config = make_config(tmp_path)
+    rng = np.random.default_rng(3)
+    n = 500
+    data = Table({
+        "mag_g": rng.uniform(18, 27, n), "mag_r": rng.uniform(18, 27, n),
+        "sn_factor_mag_g": rng.uniform(0.5, 1, n),
+        "sn_factor_mag_r": rng.uniform(0.5, 1, n)})
+    # rows of a masked catalogue
+    data.meta["row_index"] = np.sort(rng.choice(10 * n, n, replace=False))
+    phot = config["photometric_setup"]
+    table = photometry_stages.realisation_stage(
+        data, ["mag_g", "mag_r"], ["mag_g", "mag_r"], phot["MAGlims"],
+        phot["MAGsig"], phot["sn_detect"], phot["seed"])
+    assert np.array_equal(
+        table[photometry_stages.ROW_INDEX_COLUMN], data.meta["row_index"])
+    output = Table(data, copy=True)
+    output.meta = {}
+    for name in table.colnames:
+        output[name] = table[name]
+    output.write(str(tmp_path) + "/MOCK.fits")
+
+    recipe = photometry_stages.photometry_recipe(config)
+    assert recipe["id_column"] == photometry_stages.ROW_INDEX_COLUMN
+    view = RealisationView.from_recipe(recipe)
+    regenerated = view.table(slice(None))
+    for name in regenerated.colnames:
+        assert np.array_equal(regenerated[name], table[name])
+
+
+def test_recipe_of_shards_requires_id_column(tmp_path):
+    config = make_config(tmp_path)
+    config["sharding"] = {}
+    with pytest.raises(ValueError):
+        photometry_stages.photometry_recipe(config)
+    config["photometric_setup"]["id_column"] = "galaxy_id"
+    recipe = photometry_stages.photometry_recipe(config)
+    assert recipe["id_column"] == "galaxy_id"
+
+
+def make_survey_config(datadir, raw_path):
+    config = load_config(os.path.join(CONFIG_DIR, "KV450_config.yaml"))
+    config["paths"]["DATADIR"] = datadir
+    config["paths"]["MOCKraw"] = raw_path
+    config["paths"]["MOCKoutfull"] = "/MOCK.fits"
+    config["photometric_setup"]["evolution"] = True
+    return config
+
+
+def test_stream_matches_run(tmp_path, monkeypatch):
+    # replace the stages that require external data and codes
+    monkeypatch.setattr(
+        photometry_stages, "weight_stage",
+        lambda data, **kwargs: Table({"recal_weight": np.ones(len(data))}))
+    monkeypatch.setattr(
+        photometry_stages, "photoz_stage",
+        lambda data, **kwargs: Table({
+            col: np.zeros(len(data))
+            for col in photometry_stages.BPZ_COLUMNS}))
+    rng = np.random.default_rng(4)
+    n = 3000
+    raw = Table({
+        "ra": rng.uniform(30, 70, n), "dec": rng.uniform(-70, -10, n),
+        "redshift": rng.uniform(0, 2, n),
+        "convergence": rng.normal(0, 0.01, n),
+        "size_true": rng.uniform(0.1, 2, n),
+        "size_minor_true": rng.uniform(0.05, 1, n),
+        **{"mag_%s_lsst" % b: rng.uniform(18, 28, n) for b in "ugrizy"}})
+    raw_path = str(tmp_path / "raw.fits")
+    raw.write(raw_path)
+
+    datadir = tmp_path / "serial"
+    datadir.mkdir()
+    config = make_survey_config(str(datadir), raw_path)
+    catalogue, row_index = photometry_stages.load_raw(config, row_index=True)
+    photometry_stages.build_photometry_graph(config, ["footprint"]).run()
+    reference = photometry_stages.build_photometry_graph(config).run(
+        catalogue, checkpoints={}, row_index=row_index)
+    assert 0 < len(reference) < n
+    for chunk_size in (700, 1024, n):
+        datadir = tmp_path / ("stream%d" % chunk_size)
+        datadir.mkdir()
+        streamed = photometry_stages.stream_photometry(
+            make_survey_config(str(datadir), raw_path), chunk_size)
+        assert streamed.colnames == reference.colnames
+        for col in reference.colnames:
+            assert np.array_equal(
+                streamed[col], reference[col], equal_nan=True), col
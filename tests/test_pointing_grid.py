@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("table_tools")
+
+from footprint_regions import mask_ra_dec  # noqa: E402
+from footprint_tiling import tile_footprints  # noqa: E402
+from mocks_generate_footprint import make_pointings  # noqa: E402
+from pointing_grid import PointingGrid, assign_pointings  # noqa: E402
+
+
+def brute_force(ra, dec, pointings):
+    index = np.full(len(ra), -1)
+    for i, bounds in enumerate(pointings):
+        inside = mask_ra_dec(ra, dec, *bounds)
+        assert np.all(index[inside] == -1)  # pointings do not overlap
+        index[inside] = i
+    return index
+
+
+@pytest.mark.parametrize("bounds", [
+    [30.0, 50.0, -40.0, -25.0], [340.0, 15.0, -10.0, 10.0]])
+def test_grid_matches_brute_force(bounds):
+    names, pointings = make_pointings("test", bounds, (7, 5))
+    # rounding of the pointings file
+    pointings = [tuple(np.round(b, 7)) for b in pointings]
+    grid = PointingGrid.from_bounds(pointings)
+    assert grid is not None and grid.shape == (5, 7)
+    rng = np.random.default_rng(2)
+    n = 20000
+    width = np.mod(bounds[1] - bounds[0], 360.0)
+    ra = np.mod(bounds[0] - 1.0 + rng.uniform(0, width + 2.0, n), 360.0)
+    dec = rng.uniform(bounds[2] - 1.0, bounds[3] + 1.0, n)
+    # objects on the edges of the pointings
+    edges = np.array(pointings)
+    ra[:len(edges)] = edges[:, 0]
+    dec[:len(edges)] = edges[:, 2]
+    expected = brute_force(ra, dec, pointings)
+    assert np.array_equal(grid.assign(ra, dec, clip=False), expected)
+    inside = expected >= 0
+    assert np.array_equal(grid.assign(ra, dec)[inside], expected[inside])
+    assert np.array_equal(
+        assign_pointings(ra, dec, pointings)[inside], expected[inside])
+
+
+def test_tiles_match_brute_force():
+    bounds = [340.0, 15.0, -30.0, 10.0]
+    pointings = tile_footprints({"test": bounds}, tile_area=9.0).bound_tuples
+    assert PointingGrid.from_bounds(pointings) is None
+    rng = np.random.default_rng(3)
+    n = 20000
+    ra = np.mod(rng.uniform(340.0, 375.0, n), 360.0)
+    dec = rng.uniform(-30.0, 10.0, n)
+    expected = brute_force(ra, dec, pointings)
+    inside = expected >= 0
+    assert np.count_nonzero(inside) > 0.99 * n
+    assert np.array_equal(
+        assign_pointings(ra, dec, pointings)[inside], expected[inside])
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+from astropy.table import Table
+
+from catalogue_io import (
+    count_rows, iter_chunks, load_table, read_colnames, table_format)
+from mocks_photometry_realisation import photometry_realisations
+from realisation_view import RealisationView
+
+
+@pytest.fixture
+def catalogue():
+    rng = np.random.default_rng(25)
+    n = 2000
+    return Table({
+        "mag_g": rng.uniform(20.0, 28.0, n),
+        "mag_r": rng.uniform(20.0, 28.0, n),
+        "sn_g": rng.uniform(0.2, 1.0, n),
+        "sn_r": rng.uniform(0.2, 1.0, n),
+        "gid": rng.permutation(10 * n)[:n]})
+
+
+def stored(catalogue, n_realisations, object_ids=None):
+    return photometry_realisations(
+        {f: catalogue[f] for f in ("mag_g", "mag_r")},
+        {"mag_g": 25.0, "mag_r": 24.5},
+        {"mag_g": catalogue["sn_g"], "mag_r": catalogue["sn_r"]},
+        n_realisations=n_realisations, significance=1.1, seed="test",
+        object_ids=object_ids)
+
+
+def make_view(catalogue, n_realisations, id_column=None):
+    return RealisationView(
+        catalogue, ["mag_g", "mag_r"], [25.0, 24.5], ["sn_g", "sn_r"],
+        n_realisations=n_realisations, significance=1.1, seed="test",
+        id_column=id_column)
+
+
+@pytest.mark.parametrize("id_column", [None, "gid"])
+def test_view_matches_stored(catalogue, id_column):
+    object_ids = None if id_column is None else catalogue[id_column]
+    ref = stored(catalogue, 3, object_ids)
+    view = make_view(catalogue, 3, id_column)
+    assert view.colnames == ref.colnames
+    n = len(catalogue)
+    fancy = np.random.default_rng(1).integers(-n, n, 300)
+    for name in ref.colnames:
+        column = view[name]
+        assert column.shape == ref[name].shape
+        np.testing.assert_array_equal(np.asarray(column), ref[name])
+        np.testing.assert_array_equal(column[100:900], ref[name][100:900])
+        np.testing.assert_array_equal(column[::7, 1:], ref[name][::7, 1:])
+        np.testing.assert_array_equal(column[-1], ref[name][-1])
+        np.testing.assert_array_equal(column[5, 2], ref[name][5, 2])
+        np.testing.assert_array_equal(column[[-1]], ref[name][[-1]])
+        np.testing.assert_array_equal(column[fancy], ref[name][fancy])
+        np.testing.assert_array_equal(
+            column[fancy, 1], ref[name][fancy, 1])
+        mask = np.asarray(catalogue["mag_g"]) < 22.0
+        np.testing.assert_array_equal(column[mask], ref[name][mask])
+
+
+def test_view_single_realisation_and_table(catalogue):
+    ref = stored(catalogue, 1)
+    view = make_view(catalogue, 1)
+    for name in ref.colnames:
+        np.testing.assert_array_equal(view[name][:], ref[name][:, 0])
+    table = view.table(slice(10, 50))
+    for name in ref.colnames:
+        np.testing.assert_array_equal(table[name], ref[name][10:50, 0])
+
+
+def test_view_row_bounds(catalogue):
+    view = make_view(catalogue, 2)
+    n = len(catalogue)
+    with pytest.raises(IndexError):
+        view["mag_g_obs"][[0, n]]
+    with pytest.raises(IndexError):
+        view["mag_g_obs"][[-n - 1]]
+    with pytest.raises(IndexError):
+        view["mag_g_obs"][n]
+
+
+@pytest.mark.parametrize("n_realisations", [1, 3])
+def test_recipe_reads_like_stored_table(tmp_path, catalogue, n_realisations):
+    catalogue.write(str(tmp_path / "input.fits"))
+    ref = stored(catalogue, n_realisations, catalogue["gid"])
+    if n_realisations == 1:
+        for name in ref.colnames:
+            ref[name] = ref[name][:, 0]
+    recipe = str(tmp_path / "recipe.json")
+    make_view(catalogue, n_realisations, "gid").write(
+        recipe, str(tmp_path / "input.fits"))
+    assert table_format(recipe) == "recipe"
+    assert read_colnames(recipe) == ref.colnames
+    assert count_rows(recipe) == len(ref)
+    table = load_table(recipe)
+    for name in ref.colnames:
+        np.testing.assert_array_equal(table[name], ref[name])
+        if n_realisations > 1:
+            assert table[name].description == ref[name].description
+    table = load_table(recipe, cols=["mag_r_obserr"])
+    assert table.colnames == ["mag_r_obserr"]
+    np.testing.assert_array_equal(table["mag_r_obserr"], ref["mag_r_obserr"])
+    offsets = []
+    for offset, chunk in iter_chunks(
+            recipe, columns=["mag_g_obs"], chunk_size=700, start=100):
+        offsets.append(offset)
+        np.testing.assert_array_equal(
+            chunk["mag_g_obs"], ref["mag_g_obs"][offset:offset + len(chunk)])
+    assert offsets == [100, 800, 1500]
+    with pytest.raises(KeyError):
+        load_table(recipe, cols=["mag_g"])
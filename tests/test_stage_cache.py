@@ -0,0 +1,112 @@
+import os
+
+import numpy as np
+from astropy import units
+from astropy.table import Column, Table
+
+from stage_cache import StageCache
+from stage_graph import Stage, StageGraph
+
+
+def keyed_stage(data):
+    # e.g. random numbers keyed by the row in the input catalogue
+    return Table({"key": np.asarray(data.meta["row_index"]) * 2})
+
+
+def run_graph(cache, row_index):
+    graph = StageGraph([Stage("keyed", keyed_stage, outputs=["key"])])
+    catalogue = Table({"x": np.arange(5.0)})
+    return graph.run(catalogue, cache=cache, row_index=row_index)
+
+
+def test_row_index_invalidates_cache(tmp_path, capsys):
+    cache = StageCache(str(tmp_path / "cache"))
+    first = run_graph(cache, np.arange(5))
+    assert np.array_equal(first["key"], np.arange(5) * 2)
+    capsys.readouterr()
+    run_graph(cache, np.arange(5))
+    assert "skip stage" in capsys.readouterr().out
+    # only the mapping to the raw rows changes
+    second = run_graph(cache, np.arange(5) + 100)
+    assert "skip stage" not in capsys.readouterr().out
+    assert np.array_equal(second["key"], (np.arange(5) + 100) * 2)
+
+
+calls = []
+
+
+def scaled_stage(data, factor=1.0):
+    calls.append(len(data))
+    return Table({"y": data["x"] * factor})
+
+
+def run_scaled(cache, catalogue, factor=2.0, sources=()):
+    graph = StageGraph([Stage(
+        "scaled", scaled_stage, inputs=["x"], outputs=["y"],
+        params={"factor": factor}, sources=sources)])
+    return graph.run(catalogue, cache=cache)
+
+
+def test_cache_hits_and_misses(tmp_path):
+    cache = StageCache(str(tmp_path / "cache"))
+    catalogue = Table({"x": np.arange(5.0)})
+    source = tmp_path / "real.dat"
+    source.write_text("real data")
+    del calls[:]
+    first = run_scaled(cache, catalogue, sources=[str(source)])
+    assert calls == [5]
+    # unchanged re-run
+    second = run_scaled(cache, catalogue, sources=[str(source)])
+    assert calls == [5]
+    assert np.array_equal(second["y"], first["y"])
+    # changed parameter
+    third = run_scaled(cache, catalogue, factor=3.0, sources=[str(source)])
+    assert calls == [5, 5]
+    assert np.array_equal(third["y"], np.arange(5.0) * 3.0)
+    # changed input column
+    catalogue["x"][0] = -1.0
+    fourth = run_scaled(cache, catalogue, sources=[str(source)])
+    assert calls == [5, 5, 5]
+    assert fourth["y"][0] == -2.0
+    run_scaled(cache, catalogue, sources=[str(source)])
+    assert calls == [5, 5, 5]
+    # touched source file
+    mtime = os.stat(source).st_mtime_ns + 10**9
+    os.utime(source, ns=(mtime, mtime))
+    run_scaled(cache, catalogue, sources=[str(source)])
+    assert calls == [5, 5, 5, 5]
+
+
+def test_store_and_load(tmp_path):
+    cache = StageCache(str(tmp_path / "cache"))
+    table = Table([
+        Column([1.0, 2.0], name="a", unit=units.mag, description="mags"),
+        Column([[1, 2], [3, 4]], name="b")])
+    cache.store("table", "t", table)
+    loaded = cache.load("table", "t")
+    assert loaded.colnames == ["a", "b"]
+    assert loaded["a"].unit == units.mag
+    assert loaded["a"].description == "mags"
+    assert np.array_equal(loaded["b"], table["b"])
+    cache.store("mask", "m", np.array([True, False]))
+    assert np.array_equal(cache.load("mask", "m"), [True, False])
+    cache.store("none", "n", None)
+    assert cache.has("none", "n")
+    assert cache.load("none", "n") is None
+    assert not cache.has("none", "x")
+
+
+def test_prune_keeps_newest(tmp_path):
+    cache = StageCache(str(tmp_path / "cache"), keep=3)
+    stage_dir = tmp_path / "cache" / "stage"
+    for i in range(6):
+        digest = "d%d" % i
+        cache.store("stage", digest, None)
+        # the results are ordered by modification time
+        os.utime(stage_dir / digest, (1000 + i, 1000 + i))
+    assert sorted(os.listdir(stage_dir)) == ["d3", "d4", "d5"]
+    # re-storing an old result makes it the newest
+    cache.store("stage", "d3", None)
+    os.utime(stage_dir / "d3", (2000, 2000))
+    cache.store("stage", "d6", None)
+    assert sorted(os.listdir(stage_dir)) == ["d3", "d5", "d6"]
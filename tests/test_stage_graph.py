@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from astropy.table import Table
+
+from catalogue_io import iter_chunks, load_table, open_writer
+from stage_graph import Stage, StageGraph
+
+
+def scale_stage(data, factor=1.0):
+    return Table({"y": data["x"] * factor})
+
+
+def cut_stage(data, limit=0.0):
+    return data["y"] > limit
+
+
+def noise_stage(data, seed=0):
+    # random numbers keyed by the row in the input catalogue
+    row_index = np.asarray(data.meta["row_index"])
+    noise = np.random.default_rng([seed, 0]).normal(size=1000)[row_index]
+    return Table({"z": data["y"] + noise, "key": row_index})
+
+
+def build_graph():
+    return StageGraph([
+        Stage("scale", scale_stage, inputs=["x"], outputs=["y"],
+              params={"factor": 2.0}),
+        Stage("cut", cut_stage, inputs=["y"], params={"limit": -0.5},
+              selection=True),
+        Stage("noise", noise_stage, inputs=["y"], outputs=["z", "key"],
+              params={"seed": 4})])
+
+
+@pytest.fixture
+def catalogue(tmp_path):
+    rng = np.random.default_rng(4)
+    table = Table({
+        "x": rng.normal(size=997), "flag": rng.integers(0, 5, 997)})
+    path = str(tmp_path / "raw.fits")
+    table.write(path)
+    return path
+
+
+@pytest.mark.parametrize("chunk_size", [13, 64, 500, 997, 5000])
+@pytest.mark.parametrize("suffix", [".fits", ".columns"])
+def test_stream_matches_run(tmp_path, catalogue, chunk_size, suffix):
+    reference = build_graph().run(load_table(catalogue))
+    assert 0 < len(reference) < 997
+    masked = str(tmp_path / ("masked" + suffix))
+    output = str(tmp_path / ("output" + suffix))
+    nrows = build_graph().stream(
+        iter_chunks(catalogue, chunk_size=chunk_size),
+        writers={"cut": open_writer(masked), "noise": open_writer(output)})
+    assert nrows == len(reference)
+    streamed = load_table(output)
+    assert streamed.colnames == reference.colnames
+    for col in reference.colnames:
+        assert np.array_equal(streamed[col], reference[col]), col
+    assert np.array_equal(load_table(masked)["y"], reference["y"])